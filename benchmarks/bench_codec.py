@@ -0,0 +1,111 @@
+"""
+Micro-benchmark the JSON codec backends on recorded Spotify payloads.
+
+Playlist items are synthesized from the recorded items in
+``benchmarks/fixtures`` (see ``record_fixtures.py``), either as returned
+without a field filter (``full``) or in the ``transform`` projection. For
+every installed backend it times:
+
+- encoding items one by one, as the raw blob writers do
+- decoding NDJSON lines, as the transform does
+- typed decoding of NDJSON lines into only the fields the transform reads
+  (msgspec; other backends decode everything)
+- decoding whole 100-item API pages, as the async Spotify client does
+
+Usage:
+    python benchmarks/bench_codec.py --items 20000 --shape full --repeats 5
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from mockspotify import MockSpotifyServer  # noqa: E402
+from spotifycodec import JSON_CODECS, PlaylistItemFields  # noqa: E402
+
+
+def recorded_payloads(count, shape):
+    """NDJSON lines and 100-item pages synthesized from the recorded fixtures"""
+    server = MockSpotifyServer(playlist_size=count)
+    try:
+        pages = [server.playlist_page('mockplaylist', offset, 100, projected=shape == 'transform').encode('utf-8')
+                 for offset in range(0, count, 100)]
+    finally:
+        server.server_close()
+    items = [item for page in pages for item in json.loads(page)['items']]
+    lines = [json.dumps(item, separators=(',', ':'), ensure_ascii=False).encode('utf-8') for item in items]
+    return items, lines, pages
+
+
+def best_time(function, repeats):
+    """Fastest of ``repeats`` runs; like timeit, the cyclic GC is paused so it does not dominate decode timings"""
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        finally:
+            gc.enable()
+    return min(timings)
+
+
+def available_codecs():
+    codecs = []
+    for name, factory in JSON_CODECS.items():
+        try:
+            codecs.append(factory())
+        except RuntimeError:
+            print(f'{name}: not installed, skipped', file=sys.stderr)
+    return codecs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare JSON codec backends on recorded Spotify payloads')
+    parser.add_argument('--items', type=int, default=20000, help='Number of playlist items')
+    parser.add_argument('--shape', choices=['full', 'transform'], default='full',
+                        help='Items as returned without a field filter, or in the transform projection')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs per measurement; the fastest is reported')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    items, lines, pages = recorded_payloads(args.items, args.shape)
+    megabytes = sum(len(line) for line in lines) / 1e6
+
+    results = []
+    for codec in available_codecs():
+        loads, typed_loads = codec.decoder(), codec.decoder(PlaylistItemFields)
+        timings = {
+            'encode': best_time(lambda: [codec.dumps(item) for item in items], args.repeats),
+            'decode': best_time(lambda: [loads(line) for line in lines], args.repeats),
+            'decode_typed': best_time(lambda: [typed_loads(line) for line in lines], args.repeats),
+            'decode_pages': best_time(lambda: [codec.loads(page) for page in pages], args.repeats),
+        }
+        results.append({
+            'codec': codec.name,
+            **{f'{name}_ms': round(seconds * 1000, 1) for name, seconds in timings.items()},
+            **{f'{name}_mb_per_s': round(megabytes / seconds, 1) for name, seconds in timings.items() if seconds},
+        })
+
+    if args.json:
+        print(json.dumps({'items': args.items, 'shape': args.shape, 'megabytes': round(megabytes, 2),
+                          'results': results}, indent=2))
+        return
+
+    print(f'{args.items} items ({args.shape}, {megabytes:.1f} MB as NDJSON), best of {args.repeats}')
+    print(f"{'codec':>8} {'encode ms':>10} {'decode ms':>10} {'typed ms':>10} {'pages ms':>10} {'decode MB/s':>12}")
+    for result in results:
+        print(f"{result['codec']:>8} {result['encode_ms']:>10} {result['decode_ms']:>10} {result['decode_typed_ms']:>10} "
+              f"{result['decode_pages_ms']:>10} {result['decode_mb_per_s']:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Benchmark playlist extraction offline against the mock Spotify API.
+
+Starts ``mockspotify`` in-process (or uses ``--api-url``), points the pipeline
+at it and runs ``ingest_playlists`` (or ``async_ingest_playlists`` with
+``--async``) for a number of iterations. Raw blobs go to a local directory by
+default, or to Azurite / a storage account with ``--connection-string``.
+Reports wall time, playlist latency percentiles, items/s, MB/s, time per
+extract phase and the requests and 429s seen by the mock server. With
+``--rate-limit`` the mock throttles like the real API, and each iteration's
+accepted API requests per second show how close the request scheduler gets
+to that limit.
+
+Every other app setting (``PAGE_FETCH_CONCURRENCY``, ``REQUEST_RATE_PER_SECOND``,
+``RAW_COMPRESSION``, ...) can be set in the environment as usual.
+
+Usage:
+    python benchmarks/bench_extract.py --playlists 8 --playlist-size 2000 --latency-ms 40 --iterations 3
+    python benchmarks/bench_extract.py --async --throttle-rate 0.05
+    python benchmarks/bench_extract.py --playlists 8 --playlist-size 2000 --rate-limit 5 --iterations 3
+    python benchmarks/bench_extract.py --connection-string "UseDevelopmentStorage=true"
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from mockspotify import add_server_arguments, server_options, start_mock_server  # noqa: E402
+
+
+def configure_environment(args, api_url, token_url, state_dir):
+    """Point the pipeline's settings at the mock API and the chosen blob stand-in before it is imported"""
+    os.environ['SPOTIFY_API_URL'] = api_url
+    os.environ['SPOTIFY_TOKEN_URL'] = token_url
+    os.environ.setdefault('CLIENT_ID', 'mock-client')
+    os.environ.setdefault('CLIENT_SECRET', 'mock-secret')
+    os.environ['LOCAL_STATE_DIR'] = state_dir
+    if args.connection_string:
+        os.environ['AzureWebJobsStorage'] = args.connection_string
+    else:
+        os.environ.pop('AzureWebJobsStorage', None)
+        # The file system stand-in has no leases
+        os.environ['COALESCE_ACROSS_INSTANCES'] = 'false'
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def server_requests(server):
+    """Snapshot of the mock server's request counters, or None for an external server"""
+    return dict(server.stats) if server is not None else None
+
+
+def summarize_iteration(results, wall_seconds, requests_before=None, requests_after=None):
+    succeeded = [result for result in results if result['status'] == 'succeeded']
+    durations = [result['duration_ms'] for result in succeeded]
+    items = sum(result.get('items', 0) for result in succeeded)
+    raw_bytes = sum(result.get('bytes', 0) for result in succeeded)
+    phases = {}
+    for result in results:
+        for name, value in result.get('timings', {}).get('phases_ms', {}).items():
+            phases[name] = round(phases.get(name, 0.0) + value, 1)
+    summary = {
+        'wall_s': round(wall_seconds, 3),
+        'playlists': len(results),
+        'failed': sum(result['status'] == 'failed' for result in results),
+        'items': items,
+        'bytes': raw_bytes,
+        'items_per_s': round(items / wall_seconds, 1) if wall_seconds else 0.0,
+        'mb_per_s': round(raw_bytes / wall_seconds / 1e6, 3) if wall_seconds else 0.0,
+        'p50_ms': round(percentile(durations, 0.5), 1),
+        'p95_ms': round(percentile(durations, 0.95), 1),
+        'max_ms': round(max(durations, default=0.0), 1),
+        'phases_ms': phases,
+    }
+    if requests_before is not None:
+        throttled = requests_after['throttled'] - requests_before['throttled']
+        accepted = requests_after['requests'] - requests_before['requests'] - throttled
+        summary['throttled'] = throttled
+        summary['requests_per_s'] = round(accepted / wall_seconds, 2) if wall_seconds else 0.0
+    return summary
+
+
+def run_sync(args, targets, server=None):
+    from spotifyclients import get_spotify_client, get_blob_service_client
+    from spotifyextract import CONTAINER_NAME, ingest_playlists
+
+    sp = get_spotify_client()
+    if args.connection_string:
+        container_client = get_blob_service_client().get_container_client(CONTAINER_NAME)
+        if not container_client.exists():
+            container_client.create_container()
+    else:
+        from fsblob import FileSystemContainerClient
+        container_client = FileSystemContainerClient(args.output_dir)
+
+    iterations = []
+    for _ in range(args.iterations):
+        before, started = server_requests(server), time.perf_counter()
+        results = ingest_playlists(sp, container_client, targets)
+        iterations.append(summarize_iteration(results, time.perf_counter() - started, before, server_requests(server)))
+    return iterations
+
+
+async def run_async(args, targets, server=None):
+    from spotifyclients import get_async_clients, reset_async_clients
+    from spotifyasyncextract import async_ingest_playlists
+    from spotifyextract import CONTAINER_NAME
+
+    if args.connection_string:
+        client, blob_service_client = await get_async_clients()
+        container_client = blob_service_client.get_container_client(CONTAINER_NAME)
+        if not await container_client.exists():
+            await container_client.create_container()
+    else:
+        import aiohttp
+        from fsblob import AsyncFileSystemContainerClient
+        from spotifyclients import AsyncSpotifyClient, CLIENT_ID, SECRET_ID
+        client = AsyncSpotifyClient(aiohttp.ClientSession(), CLIENT_ID, SECRET_ID)
+        container_client = AsyncFileSystemContainerClient(args.output_dir)
+
+    iterations = []
+    try:
+        for _ in range(args.iterations):
+            before, started = server_requests(server), time.perf_counter()
+            results = await async_ingest_playlists(client, container_client, targets)
+            iterations.append(summarize_iteration(results, time.perf_counter() - started, before,
+                                                  server_requests(server)))
+    finally:
+        if args.connection_string:
+            await reset_async_clients()
+        else:
+            await client.session.close()
+    return iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark playlist extraction against the mock Spotify API')
+    parser.add_argument('--playlists', type=int, default=4, help='Number of playlists per iteration')
+    parser.add_argument('--markets', default='', help='Comma-separated markets each playlist is ingested for')
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Benchmark the asyncio extract')
+    parser.add_argument('--api-url', help='Use an already running mock server, e.g. http://127.0.0.1:8085')
+    parser.add_argument('--connection-string', help='Upload to Azurite or a storage account instead of the file system')
+    parser.add_argument('--output-dir', help='Directory for raw blobs written by the file system stand-in')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    if args.api_url:
+        api_url, token_url = f"{args.api_url.rstrip('/')}/v1", f"{args.api_url.rstrip('/')}/api/token"
+    else:
+        server = start_mock_server(**server_options(args))
+        api_url, token_url = server.api_url, server.token_url
+
+    workdir = tempfile.mkdtemp(prefix='spotify_bench_')
+    args.output_dir = args.output_dir or os.path.join(workdir, 'blobs')
+    configure_environment(args, api_url, token_url, os.path.join(workdir, 'state'))
+
+    from spotifyextract import parse_markets
+    playlist_ids = [f'mockplaylist{index:010d}' for index in range(args.playlists)]
+    targets = [(playlist_id, market) for playlist_id in playlist_ids
+               for market in parse_markets(args.markets) or [None]]
+    try:
+        if args.use_async:
+            iterations = asyncio.run(run_async(args, targets, server))
+        else:
+            iterations = run_sync(args, targets, server)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    report = {
+        'mode': 'async' if args.use_async else 'sync',
+        'blob_store': 'azure' if args.connection_string else 'filesystem',
+        'iterations': iterations,
+        'median_wall_s': round(statistics.median(iteration['wall_s'] for iteration in iterations), 3),
+        'server': server.stats if server is not None else None,
+        'rate_limit': args.rate_limit,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{report['mode']} extract, {len(targets)} playlist runs, blob store: {report['blob_store']}")
+    print(f"{'iter':>4} {'wall s':>8} {'items':>8} {'items/s':>10} {'MB/s':>8} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'failed':>6} {'req/s':>7} {'429s':>5}")
+    for number, iteration in enumerate(iterations, 1):
+        print(f"{number:>4} {iteration['wall_s']:>8} {iteration['items']:>8} {iteration['items_per_s']:>10} "
+              f"{iteration['mb_per_s']:>8} {iteration['p50_ms']:>9} {iteration['p95_ms']:>9} {iteration['failed']:>6} "
+              f"{iteration.get('requests_per_s', '-'):>7} {iteration.get('throttled', '-'):>5}")
+    print(f"median wall time: {report['median_wall_s']} s")
+    if args.rate_limit and server is not None:
+        print(f"mock rate limit: {args.rate_limit} req/s over {args.rate_window} s; req/s above counts accepted "
+              f"API requests, excluding token requests")
+    print(f"phase totals of the last iteration (ms, summed over playlists): {json.dumps(iterations[-1]['phases_ms'])}")
+    if report['server']:
+        print(f"mock server: {report['server']['requests']} requests, {report['server']['throttled']} throttled, "
+              f"{report['server']['tokens']} token requests")
+
+
+if __name__ == '__main__':
+    main()
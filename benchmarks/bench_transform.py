@@ -0,0 +1,170 @@
+"""
+Benchmark building the song, album and artist tables from playlist items.
+
+Compares the original three-pass extraction (``make_album``, ``make_artist``
+and ``make_song`` over ``data['items']``, list-of-lists rows and the cleanup
+the transform applied to them, kept here as the reference) with the
+single-pass columnar ``make_columns`` of the transform,
+on synthetic payloads of increasing size. Items have the shape of the
+``transform`` field projection, with artist and album IDs repeating as in the
+mock API, so deduplication does real work.
+
+Usage:
+    python benchmarks/bench_transform.py --sizes 100,1000,10000,100000,1000000 --repeats 3
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import pandas as pd  # noqa: E402
+
+from mockspotify import ALBUM_ID, ARTIST_ID, TRACK_ID, load_fixture  # noqa: E402
+
+
+def synthesize_items(count):
+    """Playlist items in the ``transform`` projection; albums and artists repeat like in the mock API"""
+    template = load_fixture('playlist_items')['items'][0]['track']
+    album_pool, artist_pool = max(1, count // 2), max(1, count // 3)
+    albums, artists, items = {}, {}, []
+    for index in range(count):
+        album_index, artist_index = index % album_pool, (index * 7) % artist_pool
+        if album_index not in albums:
+            album_id = ALBUM_ID.format(album_index)
+            albums[album_index] = {
+                'id': album_id, 'name': template['album']['name'], 'release_date': template['album']['release_date'],
+                'total_tracks': template['album']['total_tracks'],
+                'external_urls': {'spotify': f'https://open.spotify.com/album/{album_id}'},
+            }
+        if artist_index not in artists:
+            artist_id = ARTIST_ID.format(artist_index)
+            artists[artist_index] = {
+                'id': artist_id, 'name': template['artists'][0]['name'],
+                'external_urls': {'spotify': f'https://open.spotify.com/artist/{artist_id}'},
+            }
+        track_id = TRACK_ID.format(index)
+        items.append({
+            'added_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1704067200 + index * 60)),
+            'track': {
+                'id': track_id, 'name': template['name'], 'duration_ms': template['duration_ms'],
+                'popularity': template['popularity'],
+                'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+                'album': albums[album_index], 'artists': [artists[artist_index]],
+            },
+        })
+    return items
+
+
+def album_row(song):
+    """Extract one album row from a playlist item"""
+    album = song['track']['album']
+    return [album['id'], album['name'], album['release_date'], album['total_tracks'], album['external_urls']['spotify']]
+
+
+def artist_row(song):
+    """Extract one artist row (the track's first artist) from a playlist item"""
+    artist = song['track']['artists'][0]
+    return [artist['id'], artist['name'], artist['external_urls']['spotify']]
+
+
+def song_row(song):
+    """Extract one song row from a playlist item"""
+    track = song['track']
+    return [track['id'], track['name'], track['duration_ms'], track['external_urls']['spotify'], track['popularity'],
+            song['added_at'], track['album']['id'], track['artists'][0]['id']]
+
+
+def make_album(data):
+    return [album_row(song) for song in data['items']]
+
+
+def make_artist(data):
+    return [artist_row(song) for song in data['items']]
+
+
+def make_song(data):
+    return [song_row(song) for song in data['items']]
+
+
+def three_pass(items):
+    """The transform's original table construction"""
+    data = {'items': items}
+    album_df_list, artist_df_list, song_df_list = make_album(data), make_artist(data), make_song(data)
+
+    song_df = pd.DataFrame(song_df_list, columns=['song_id', 'name', 'duration_ms', 'url', 'popularity', 'added_date', 'album_id', 'artist_id'])
+    song_df['added_date'] = pd.to_datetime(song_df['added_date'])
+
+    artist_df = pd.DataFrame(artist_df_list, columns=['artist_id', 'name', 'url'])
+    artist_df.drop_duplicates(subset='artist_id', keep='first', inplace=True, ignore_index=True)
+
+    album_df = pd.DataFrame(album_df_list, columns=['album_id', 'name', 'release_date', 'total_tracks', 'url'])
+    album_df.drop_duplicates(subset='album_id', keep='first', inplace=True, ignore_index=True)
+    album_df['release_date'] = pd.to_datetime(album_df['release_date'])
+    return song_df, album_df, artist_df
+
+
+def columnar(items):
+    from spotifytransform import make_columns
+
+    return make_columns(items)
+
+
+def best_time(function, items, repeats):
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        started = time.perf_counter()
+        function(items)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def verify(items):
+    """Both implementations must produce the same CSV output"""
+    from spotifytransform import make_csv_buffer
+
+    for expected, actual in zip(three_pass(items), columnar(items)):
+        if make_csv_buffer(expected) != make_csv_buffer(actual):
+            raise AssertionError('make_columns output differs from the three-pass tables')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark three-pass vs single-pass columnar table extraction')
+    parser.add_argument('--sizes', default='100,1000,10000,100000,1000000', help='Comma-separated item counts')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per size; the fastest is reported')
+    parser.add_argument('--verify-up-to', type=int, default=10000, help='Compare CSV output for sizes up to this')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(value) for value in args.sizes.split(',') if value]:
+        items = synthesize_items(size)
+        if size <= args.verify_up_to:
+            verify(items)
+        three_pass_s = best_time(three_pass, items, args.repeats)
+        columnar_s = best_time(columnar, items, args.repeats)
+        results.append({
+            'items': size,
+            'three_pass_ms': round(three_pass_s * 1000, 2),
+            'columnar_ms': round(columnar_s * 1000, 2),
+            'speedup': round(three_pass_s / columnar_s, 2) if columnar_s else None,
+            'columnar_items_per_s': round(size / columnar_s) if columnar_s else None,
+        })
+        del items
+        if not args.json:
+            result = results[-1]
+            print(f"{result['items']:>9} items: three-pass {result['three_pass_ms']:>10} ms, "
+                  f"columnar {result['columnar_ms']:>10} ms, speedup {result['speedup']}x")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
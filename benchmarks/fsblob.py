@@ -0,0 +1,104 @@
+"""
+File system stand-in for the parts of the Blob Storage container client the extract uses.
+
+Blobs are written under a local directory, so extraction can be benchmarked
+without Azurite or a storage account. Only the calls made by the pipeline are
+implemented; leases are not, so run with ``COALESCE_ACROSS_INSTANCES=false``.
+"""
+import os
+import shutil
+import tempfile
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+
+class FileSystemDownloader:
+    def __init__(self, path):
+        self.path = path
+
+    def readall(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def chunks(self, chunk_size=4 * 1024 * 1024):
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+class FileSystemBlobClient:
+    """Block blob under ``root`` supporting whole uploads and staged blocks"""
+
+    def __init__(self, root, blob_name):
+        self.root = root
+        self.blob_name = blob_name
+        self.path = os.path.join(root, *blob_name.split('/'))
+        self.blocks_dir = os.path.join(root, '.blocks', *blob_name.split('/'))
+
+    def _write(self, chunks):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, self.path)
+
+    def upload_blob(self, data, overwrite=False, **kwargs):
+        if not overwrite and os.path.exists(self.path):
+            raise ResourceExistsError(f'Blob {self.blob_name} already exists')
+        if hasattr(data, 'read'):
+            data = data.read()
+        self._write([data.encode('utf-8') if isinstance(data, str) else bytes(data)])
+
+    def stage_block(self, block_id, data, length=None, **kwargs):
+        os.makedirs(self.blocks_dir, exist_ok=True)
+        with open(os.path.join(self.blocks_dir, block_id.replace('/', '_')), 'wb') as f:
+            f.write(data)
+
+    def commit_block_list(self, block_list, **kwargs):
+        def chunks():
+            for current_id in block_list:
+                with open(os.path.join(self.blocks_dir, current_id.replace('/', '_')), 'rb') as f:
+                    yield f.read()
+        self._write(chunks())
+        shutil.rmtree(self.blocks_dir, ignore_errors=True)
+
+    def download_blob(self, **kwargs):
+        if not os.path.exists(self.path):
+            raise ResourceNotFoundError(f'Blob {self.blob_name} not found')
+        return FileSystemDownloader(self.path)
+
+    def delete_blob(self, **kwargs):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f'Blob {self.blob_name} not found')
+
+
+class FileSystemContainerClient:
+    """Container whose blobs are files under ``root``"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def get_blob_client(self, blob):
+        return FileSystemBlobClient(self.root, blob)
+
+    def upload_blob(self, name, data, **kwargs):
+        self.get_blob_client(name).upload_blob(data, **kwargs)
+
+    def download_blob(self, blob, **kwargs):
+        return self.get_blob_client(blob).download_blob(**kwargs)
+
+
+class AsyncFileSystemContainerClient:
+    """asyncio facade over FileSystemContainerClient for the async extract"""
+
+    def __init__(self, root):
+        self.container = FileSystemContainerClient(root)
+
+    async def upload_blob(self, name, data, **kwargs):
+        self.container.upload_blob(name, data, **kwargs)
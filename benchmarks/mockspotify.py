@@ -0,0 +1,294 @@
+"""
+Local stand-in for the Spotify Web API, for offline load tests and benchmarks.
+
+Replays the recorded responses in ``benchmarks/fixtures`` (see
+``record_fixtures.py``). Playlists of any size are synthesized from the
+recorded playlist items, with unique track IDs and repeating artist and album
+IDs so that enrichment caches behave realistically. Latency and the page size
+the server honours are configurable, and 429 responses are injected either for
+a random share of requests or, like the real API, once a request rate is
+exceeded within a rolling window.
+
+Point the function app at it with::
+
+    SPOTIFY_API_URL=http://127.0.0.1:8085/v1
+    SPOTIFY_TOKEN_URL=http://127.0.0.1:8085/api/token
+
+Usage:
+    python benchmarks/mockspotify.py --port 8085 --playlist-size 2000 --latency-ms 40 --throttle-rate 0.02
+    python benchmarks/mockspotify.py --port 8085 --rate-limit 5
+"""
+import os
+import re
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+TRACK_ID = 'mocktrack{:013d}'
+ALBUM_ID = 'mockalbum{:013d}'
+ARTIST_ID = 'mockartist{:012d}'
+
+
+def load_fixture(name, fixtures_dir=FIXTURES_DIR):
+    with open(os.path.join(fixtures_dir, f'{name}.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _strip_markets(value):
+    # The pipeline always sends a ``fields`` filter, whose main effect is to drop these lists
+    if isinstance(value, dict):
+        return {key: _strip_markets(item) for key, item in value.items() if key != 'available_markets'}
+    if isinstance(value, list):
+        return [_strip_markets(item) for item in value]
+    return value
+
+
+class ItemTemplate:
+    """A recorded playlist item whose IDs can be substituted to synthesize new items"""
+
+    def __init__(self, item, projected=False):
+        track = item['track']
+        self.ids = [track['id'], track['album']['id']] + [artist['id'] for artist in track['artists']]
+        self.added_at = item['added_at']
+        self.text = json.dumps(_strip_markets(item) if projected else item, separators=(',', ':'))
+        self.pattern = re.compile('|'.join(re.escape(value) for value in self.ids + [self.added_at]))
+
+    def render(self, index, artist_pool, album_pool):
+        replacements = {
+            self.ids[0]: TRACK_ID.format(index),
+            self.ids[1]: ALBUM_ID.format(index % album_pool),
+            self.added_at: time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1704067200 + index * 60)),
+        }
+        for position, artist_id in enumerate(self.ids[2:]):
+            replacements[artist_id] = ARTIST_ID.format((index * 7 + position) % artist_pool)
+        return self.pattern.sub(lambda match: replacements[match.group(0)], self.text)
+
+
+class MockSpotifyServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the mock's configuration and request counters.
+
+    Args:
+        address: (host, port) to bind; port 0 picks a free port
+        playlist_size: Number of items in every playlist
+        page_size: Largest ``limit`` honoured for playlist item pages
+        latency_ms: Added delay per request
+        jitter_ms: Random extra delay of up to this much per request
+        throttle_rate: Share of API requests answered with 429, regardless of the request rate
+        retry_after: Retry-After seconds sent with randomly injected 429s
+        rate_limit: API requests per second allowed over ``rate_window``, or None for no limit;
+            requests beyond it get a 429 whose Retry-After is the time until the window has room again
+        rate_window: Length of the rolling rate limit window in seconds
+        snapshot_id: Fixed snapshot_id, or None for a new one per server start
+        seed: Random seed for jitter and throttling
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), playlist_size=50, page_size=100, latency_ms=0.0, jitter_ms=0.0,
+                 throttle_rate=0.0, retry_after=1, rate_limit=None, rate_window=1.0, snapshot_id=None, seed=None,
+                 fixtures_dir=FIXTURES_DIR):
+        super().__init__(address, MockSpotifyHandler)
+        self.playlist_size = playlist_size
+        self.page_size = page_size
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.snapshot_id = snapshot_id or f'mock-{int(time.time())}'
+        self.random = random.Random(seed)
+
+        items = load_fixture('playlist_items', fixtures_dir)['items']
+        self.templates = {
+            False: [ItemTemplate(item) for item in items],
+            True: [ItemTemplate(item, projected=True) for item in items],
+        }
+        self.artist_pool = max(1, playlist_size // 3)
+        self.album_pool = max(1, playlist_size // 2)
+        self.playlist = load_fixture('playlist', fixtures_dir)
+        self.artist = load_fixture('artists', fixtures_dir)['artists'][0]
+        self.album = load_fixture('albums', fixtures_dir)['albums'][0]
+        self.audio_features = load_fixture('audio_features', fixtures_dir)['audio_features'][0]
+
+        self.stats = {'requests': 0, 'throttled': 0, 'tokens': 0}
+        self._lock = threading.Lock()
+        # Times of the API requests accepted within the rate limit window
+        self._accepted = deque()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self):
+        return f'{self.base_url}/v1'
+
+    @property
+    def token_url(self):
+        return f'{self.base_url}/api/token'
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def delay(self):
+        with self._lock:
+            seconds = (self.latency_ms + self.random.uniform(0, self.jitter_ms)) / 1000
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def throttle(self):
+        """Return the Retry-After seconds if this API request is answered with 429, otherwise None"""
+        with self._lock:
+            if self.random.random() < self.throttle_rate:
+                return self.retry_after
+            if not self.rate_limit:
+                return None
+            now = time.monotonic()
+            while self._accepted and self._accepted[0] <= now - self.rate_window:
+                self._accepted.popleft()
+            if len(self._accepted) >= self.rate_limit * self.rate_window:
+                # Whole seconds, as sent by Spotify
+                return max(1, math.ceil(self._accepted[0] + self.rate_window - now))
+            self._accepted.append(now)
+            return None
+
+    def playlist_page(self, playlist_id, offset, limit, projected):
+        limit = max(1, min(limit, self.page_size))
+        templates = self.templates[projected]
+        indexes = range(offset, min(offset + limit, self.playlist_size))
+        items = ','.join(templates[index % len(templates)].render(index, self.artist_pool, self.album_pool)
+                         for index in indexes)
+        href = f'{self.api_url}/playlists/{playlist_id}/tracks'
+        next_url = f'{href}?offset={offset + limit}&limit={limit}' if offset + limit < self.playlist_size else None
+        previous_url = f'{href}?offset={max(0, offset - limit)}&limit={limit}' if offset else None
+        # Splice the pre-serialized items into the page envelope
+        envelope = json.dumps({'href': f'{href}?offset={offset}&limit={limit}', 'items': None, 'limit': limit,
+                               'next': next_url, 'offset': offset, 'previous': previous_url,
+                               'total': self.playlist_size}, separators=(',', ':'))
+        return envelope.replace('"items":null', f'"items":[{items}]', 1)
+
+
+class MockSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200, headers=None):
+        payload = (body if isinstance(body, str) else json.dumps(body, separators=(',', ':'))).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if urlsplit(self.path).path != '/api/token':
+            return self.send_json({'error': {'status': 404, 'message': 'Not found'}}, 404)
+        self.server.count('tokens')
+        self.server.delay()
+        self.send_json({'access_token': f'mock-token-{time.time_ns()}', 'token_type': 'Bearer', 'expires_in': 3600})
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+        server.delay()
+        retry_after = server.throttle()
+        if retry_after is not None:
+            server.count('throttled')
+            return self.send_json({'error': {'status': 429, 'message': 'API rate limit exceeded'}}, 429,
+                                  {'Retry-After': str(retry_after)})
+
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip('/').split('/')
+        if parts[:1] != ['v1']:
+            return self.send_json({'error': {'status': 404, 'message': 'Not found'}}, 404)
+        parts = parts[1:]
+        ids = [value for value in params.get('ids', '').split(',') if value]
+
+        if len(parts) == 3 and parts[0] == 'playlists' and parts[2] in ('tracks', 'items'):
+            body = server.playlist_page(parts[1], int(params.get('offset', 0)), int(params.get('limit', 100)),
+                                        projected=bool(params.get('fields')))
+            return self.send_json(body)
+        if len(parts) == 2 and parts[0] == 'playlists':
+            return self.send_json({**server.playlist, 'id': parts[1], 'snapshot_id': server.snapshot_id,
+                                   'tracks': {'total': server.playlist_size}})
+        if parts == ['artists']:
+            return self.send_json({'artists': [{**server.artist, 'id': value} for value in ids]})
+        if parts == ['albums']:
+            return self.send_json({'albums': [{**server.album, 'id': value} for value in ids]})
+        if parts == ['audio-features']:
+            return self.send_json({'audio_features': [{**server.audio_features, 'id': value} for value in ids]})
+        return self.send_json({'error': {'status': 404, 'message': 'Not found'}}, 404)
+
+
+def start_mock_server(**options):
+    """Start a MockSpotifyServer on a background thread and return it; call ``shutdown()`` to stop"""
+    server = MockSpotifyServer(**options)
+    threading.Thread(target=server.serve_forever, name='mock-spotify', daemon=True).start()
+    return server
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--playlist-size', type=int, default=50, help='Items per playlist')
+    parser.add_argument('--page-size', type=int, default=100, help='Largest page size the server honours')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Added latency per request')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Random extra latency per request')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds for randomly injected 429s')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='Requests per second allowed before answering with 429, like the real API')
+    parser.add_argument('--rate-window', type=float, default=1.0, help='Rolling window of --rate-limit in seconds')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for jitter and throttling')
+
+
+def server_options(args):
+    return {
+        'playlist_size': args.playlist_size,
+        'page_size': args.page_size,
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'throttle_rate': args.throttle_rate,
+        'retry_after': args.retry_after,
+        'rate_limit': args.rate_limit,
+        'rate_window': args.rate_window,
+        'seed': args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a mock Spotify Web API from recorded fixtures')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8085)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockSpotifyServer((args.host, args.port), **server_options(args))
+    print(f'Mock Spotify API on {server.api_url} (token endpoint {server.token_url})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Record fresh fixtures for the mock Spotify API from the real Web API.
+
+Fetches one page of a playlist plus the artists, albums and audio features of
+its first tracks and writes them to ``benchmarks/fixtures``, replacing the
+checked-in samples. Requires ``CLIENT_ID`` and ``CLIENT_SECRET``.
+
+Usage:
+    python benchmarks/record_fixtures.py [playlist URL or ID] [--items 10]
+"""
+import os
+import sys
+import json
+import argparse
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from mockspotify import FIXTURES_DIR  # noqa: E402
+
+
+def write_fixture(name, document):
+    path = os.path.join(FIXTURES_DIR, f'{name}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+    print(f'Wrote {path}')
+
+
+def main():
+    from spotifyextract import DEFAULT_PLAYLIST_URL, parse_playlist_id
+    from spotifyclients import get_spotify_client
+
+    parser = argparse.ArgumentParser(description='Record mock Spotify API fixtures from the real Web API')
+    parser.add_argument('playlist', nargs='?', default=DEFAULT_PLAYLIST_URL)
+    parser.add_argument('--items', type=int, default=10, help='Playlist items to keep as templates')
+    args = parser.parse_args()
+
+    sp = get_spotify_client()
+    playlist_id = parse_playlist_id(args.playlist)
+
+    page = sp.playlist_items(playlist_id, limit=args.items)
+    # Local files and unavailable tracks have no IDs to substitute, so they cannot serve as templates
+    page['items'] = [item for item in page['items'] if item.get('track') and item['track'].get('id')]
+    tracks = [item['track'] for item in page['items']]
+    playlist = sp.playlist(playlist_id, fields='collaborative,description,id,name,public,snapshot_id,type,uri')
+
+    write_fixture('playlist', playlist)
+    write_fixture('playlist_items', page)
+    write_fixture('artists', sp.artists([track['artists'][0]['id'] for track in tracks[:1]]))
+    write_fixture('albums', sp.albums([track['album']['id'] for track in tracks[:1]]))
+    audio_features = sp.audio_features([track['id'] for track in tracks[:1]])
+    if audio_features and audio_features[0]:
+        write_fixture('audio_features', {'audio_features': audio_features})
+    else:
+        print('No audio features returned for this app, keeping the existing fixture')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,15 @@ import azure.functions as func
 import os
 import logging
 
-from spotifyextract import register_spotify_ingestion
+from spotifyextract import register_spotify_ingestion, register_spotify_scheduled_ingestion
+from spotifyasyncextract import register_spotify_async_ingestion
 from spotifytransform import register_spotify_transformation
+from spotifybackfill import register_spotify_backfill
 
 app = func.FunctionApp()
 
 register_spotify_ingestion(app)
-register_spotify_transformation(app)
\ No newline at end of file
+register_spotify_scheduled_ingestion(app)
+register_spotify_async_ingestion(app)
+register_spotify_transformation(app)
+register_spotify_backfill(app)
\ No newline at end of file
@@ -0,0 +1,373 @@
+import logging
+import asyncio
+import json
+import time
+from datetime import datetime
+import azure.functions as func
+from azure.core.exceptions import HttpResponseError, ResourceExistsError
+from azure.storage.blob import ContentSettings
+
+from spotifyclients import get_async_clients, get_state_store, reset_async_clients
+from spotifymetrics import PhaseTimer, export_metrics
+from spotifyraw import encode_raw_payload, raw_blob_name, raw_content_settings
+from spotifyextract import (
+    CLIENT_ID,
+    SECRET_ID,
+    STORAGE_CONNECTION_STRING,
+    CONTAINER_NAME,
+    PLAYLIST_PAGE_SIZE,
+    PAGE_FETCH_CONCURRENCY,
+    PLAYLIST_FIELDS,
+    PLAYLIST_MANIFEST_BLOB,
+    PLAYLIST_CONCURRENCY,
+    COALESCE_ACROSS_INSTANCES,
+    INGEST_LEASE_SECONDS,
+    AsyncSingleFlight,
+    as_target,
+    export_ingestion_metrics,
+    playlist_lease_blob,
+    playlist_state_key,
+    request_scheduler,
+    resolve_ingest_targets,
+    summarize_ingestion,
+    target_key,
+)
+
+
+async def async_fetch_playlist_items(client, playlist_id, max_concurrency=PAGE_FETCH_CONCURRENCY, timer=None,
+                                     market=None):
+    """
+    Fetch all items of a playlist and merge them into a single raw payload.
+
+    Async counterpart of ``spotifyextract.iter_playlist_pages``: the first page
+    provides ``total`` and the remaining offsets are fetched concurrently, with at
+    most ``max_concurrency`` requests in flight for this playlist.
+
+    Args:
+        client: ``spotifyclients.AsyncSpotifyClient`` instance
+        playlist_id: Bare playlist ID
+        max_concurrency: Maximum number of concurrent page requests
+        timer: Optional PhaseTimer that receives a ``page_fetch`` sample per page
+        market: Optional market code; tracks are relinked to versions playable there
+
+    Returns:
+        Merged playlist items payload
+    """
+    async def fetch(offset):
+        started = time.perf_counter()
+        page = await request_scheduler.call_async(client.playlist_items, playlist_id, offset=offset,
+                                                  fields=PLAYLIST_FIELDS, market=market)
+        if timer is not None:
+            timer.sample('page_fetch', (time.perf_counter() - started) * 1000)
+        return page
+
+    data = await fetch(0)
+    page_size = data.get('limit') or PLAYLIST_PAGE_SIZE
+    offsets = range(page_size, data.get('total') or 0, page_size)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def fetch_page(offset):
+        async with semaphore:
+            return await fetch(offset)
+
+    for page in await asyncio.gather(*(fetch_page(offset) for offset in offsets)):
+        data['items'].extend(page.get('items', []))
+
+    data['offset'] = 0
+    data['next'] = None
+    if len(data['items']) != data.get('total'):
+        logging.warning(f"Playlist {target_key(playlist_id, market)} reported {data.get('total')} items but {len(data['items'])} were retrieved")
+    return data
+
+
+async def async_ingest_playlist(client, container_client, playlist_id, state_store=None, force=False, market=None):
+    """
+    Extract one playlist and upload it as its own raw blob without blocking the worker.
+
+    Applies the same snapshot_id change detection as ``spotifyextract.ingest_playlist``;
+    the state store is synchronous and is therefore accessed from a worker thread.
+
+    Args:
+        client: ``spotifyclients.AsyncSpotifyClient`` instance
+        container_client: ``azure.storage.blob.aio`` container client for the raw container
+        playlist_id: Bare playlist ID
+        state_store: Store holding per-playlist ingestion state, or None to always ingest
+        force: Ingest even if the snapshot is unchanged
+        market: Optional market code; stored under a ``market=XX`` partition
+
+    Returns:
+        Summary dict with the playlist's status, blob path, item count and timing
+    """
+    started = time.perf_counter()
+    summary = {'playlist_id': playlist_id, 'status': 'succeeded'}
+    if market:
+        summary['market'] = market
+    timer = PhaseTimer()
+    try:
+        await _async_ingest_playlist(client, container_client, playlist_id, summary, timer, state_store, force, market)
+    except Exception as e:
+        logging.error(f"Failed to ingest playlist {target_key(playlist_id, market)}: {str(e)}")
+        summary['status'] = 'failed'
+        summary['error'] = str(e)
+    summary['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    summary['timings'] = timer.summary()
+    export_metrics(
+        timer.metrics() + [('duration_ms', summary['duration_ms']), ('items', summary.get('items', 0)),
+                           ('bytes', summary.get('bytes', 0))],
+        operation='async_ingest_playlist', playlist_id=playlist_id, market=market or '', status=summary['status']
+    )
+    return summary
+
+
+async def _async_ingest_playlist(client, container_client, playlist_id, summary, timer, state_store, force, market):
+    # Body of async_ingest_playlist; fills in ``summary`` and returns early when the snapshot is unchanged
+    key = target_key(playlist_id, market)
+    state = None
+    if state_store is not None:
+        with timer.phase('snapshot'):
+            params = {'fields': 'snapshot_id', **({'market': market} if market else {})}
+            playlist = await request_scheduler.call_async(client.get, f'playlists/{playlist_id}', params=params)
+            state = await asyncio.to_thread(state_store.read, playlist_state_key(playlist_id, market)) or {}
+        summary['snapshot_id'] = playlist['snapshot_id']
+        if not force and state.get('snapshot_id') == playlist['snapshot_id']:
+            logging.info(f"Playlist {key} unchanged since {state.get('ingested_at')}, skipping")
+            summary['status'] = 'unchanged'
+            return
+
+    with timer.phase('fetch'):
+        data = await async_fetch_playlist_items(client, playlist_id, timer=timer, market=market)
+    summary['items'] = len(data.get('items', []))
+    if state is not None:
+        data['snapshot_id'] = summary['snapshot_id']
+    if market:
+        data['market'] = market
+
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    partition = f'market={market}/' if market else ''
+    blob_path = f"to_be_processed/{partition}{raw_blob_name(f'spotify_raw_{playlist_id}_{timestamp}')}"
+
+    # Encoding and compression are CPU-bound, so keep them off the event loop
+    with timer.phase('serialize'):
+        raw_content = await asyncio.to_thread(encode_raw_payload, data)
+    with timer.phase('upload'):
+        await container_client.upload_blob(
+            blob_path,
+            raw_content,
+            content_settings=ContentSettings(**raw_content_settings()),
+            overwrite=True
+        )
+    summary['bytes'] = len(raw_content)
+
+    summary['blob_path'] = blob_path
+    logging.info(f"Successfully uploaded {summary['items']} items of playlist {key} to {blob_path}")
+
+    if state is not None:
+        # Advance the cursor like the sync path, so the next incremental run does not ingest these items again
+        added_at = [item.get('added_at') or '' for item in data.get('items', [])]
+        state.update({
+            'snapshot_id': summary['snapshot_id'],
+            'last_added_at': max(added_at + [state.get('last_added_at') or '']) or None,
+            'ingested_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'blob_path': blob_path,
+        })
+        with timer.phase('state'):
+            await asyncio.to_thread(state_store.write, playlist_state_key(playlist_id, market), state)
+
+
+class AsyncPlaylistLease:
+    """asyncio counterpart of ``spotifyextract.PlaylistLease`` using the aio blob client"""
+
+    def __init__(self, container_client, playlist_id, duration=INGEST_LEASE_SECONDS, market=None):
+        self.blob_client = container_client.get_blob_client(playlist_lease_blob(playlist_id, market))
+        self.duration = duration
+        self.lease = None
+        self._renewer = None
+
+    async def acquire(self):
+        """Try to take the lease; returns False if another instance holds it"""
+        try:
+            await self.blob_client.upload_blob(b'', overwrite=False)
+        except ResourceExistsError:
+            pass
+        try:
+            self.lease = await self.blob_client.acquire_lease(lease_duration=self.duration)
+        except HttpResponseError as e:
+            if e.status_code == 409:
+                return False
+            raise
+        self._renewer = asyncio.ensure_future(self._renew())
+        return True
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(self.duration / 2)
+            try:
+                await self.lease.renew()
+            except Exception as e:
+                logging.warning(f"Could not renew ingestion lease on {self.blob_client.blob_name}: {str(e)}")
+                return
+
+    async def release(self):
+        """Stop renewing and release the lease if it is held"""
+        if self._renewer is not None:
+            self._renewer.cancel()
+        if self.lease is not None:
+            try:
+                await self.lease.release()
+            except Exception as e:
+                logging.warning(f"Could not release ingestion lease on {self.blob_client.blob_name}: {str(e)}")
+            self.lease = None
+
+
+# Shared by every async ingestion run on this instance's event loop
+async_single_flight = AsyncSingleFlight()
+
+
+async def async_ingest_playlist_coalesced(client, container_client, playlist_id, market=None, **kwargs):
+    """
+    Run ``async_ingest_playlist`` unless the same playlist is already being ingested.
+
+    Same semantics as ``spotifyextract.ingest_playlist_coalesced``: concurrent
+    requests on this instance share one run, other instances are kept out by a
+    short blob lease.
+    """
+    key = target_key(playlist_id, market)
+
+    async def run():
+        lease = None
+        try:
+            if COALESCE_ACROSS_INSTANCES:
+                lease = AsyncPlaylistLease(container_client, playlist_id, market=market)
+            if lease is not None and not await lease.acquire():
+                logging.info(f"Playlist {key} is being ingested by another instance, skipping")
+                summary = {'playlist_id': playlist_id, 'status': 'coalesced', 'duration_ms': 0.0}
+                if market:
+                    summary['market'] = market
+                return summary
+        except Exception as e:
+            logging.warning(f"Could not take ingestion lease for playlist {key}, ingesting anyway: {str(e)}")
+            lease = None
+        try:
+            return await async_ingest_playlist(client, container_client, playlist_id, market=market, **kwargs)
+        finally:
+            if lease is not None:
+                await lease.release()
+
+    summary, shared = await async_single_flight.do(key, run)
+    if shared:
+        summary = {**summary, 'coalesced': True}
+    return summary
+
+
+async def async_ingest_playlists(client, container_client, targets, state_store=None, force=False,
+                                 max_concurrency=PLAYLIST_CONCURRENCY):
+    """
+    Ingest several playlists concurrently on the event loop.
+
+    While one playlist waits on the Spotify API another can be uploading, so
+    fetches and uploads overlap within a single worker.
+
+    Args:
+        client: ``spotifyclients.AsyncSpotifyClient`` instance
+        container_client: ``azure.storage.blob.aio`` container client for the raw container
+        targets: Bare playlist IDs or (playlist ID, market) pairs to ingest
+        state_store: Store holding per-playlist ingestion state, or None to always ingest
+        force: Ingest even if a playlist's snapshot is unchanged
+        max_concurrency: Maximum number of playlists ingested at the same time
+
+    Returns:
+        List of per-playlist summaries in the order of ``targets``
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def ingest(target):
+        playlist_id, market = as_target(target)
+        async with semaphore:
+            return await async_ingest_playlist_coalesced(client, container_client, playlist_id, market=market,
+                                                         state_store=state_store, force=force)
+
+    return list(await asyncio.gather(*(ingest(target) for target in targets)))
+
+
+def register_spotify_async_ingestion(app):
+    """
+    Register the asyncio-native Spotify ingestion function with the Azure Functions app.
+
+    Args:
+        app: The Azure Functions app instance
+    """
+    @app.route(route="spotify/async", methods=["GET"])
+    async def spotify_async_http_trigger(req: func.HttpRequest) -> func.HttpResponse:
+        """
+        HTTP-triggered Azure Function that extracts playlists with non-blocking I/O.
+
+        Behaves like ``spotify_http_trigger`` but talks to the Spotify Web API over
+        aiohttp and uploads through ``azure.storage.blob.aio``, so page fetches and
+        blob uploads for different playlists overlap within one worker.
+
+        Args:
+            req: HTTP request object
+
+        Returns:
+            HTTP response with a JSON summary of per-playlist status and timing
+        """
+        logging.info('Async Spotify data extraction function triggered via HTTP')
+
+        if not CLIENT_ID or not SECRET_ID:
+            logging.error("Missing Spotify API credentials")
+            return func.HttpResponse(
+                "Please configure Spotify API credentials in application settings.",
+                status_code=500
+            )
+
+        if not STORAGE_CONNECTION_STRING:
+            logging.error("Missing Azure Storage connection string")
+            return func.HttpResponse(
+                "Please configure Azure Storage settings in application settings.",
+                status_code=500
+            )
+
+        try:
+            client, blob_service_client = await get_async_clients()
+            container_client = blob_service_client.get_container_client(CONTAINER_NAME)
+            timer = PhaseTimer()
+            with timer.phase('auth'):
+                await client.get_access_token()
+
+            # Resolve the playlists to ingest
+            try:
+                with timer.phase('resolve'):
+                    manifest = None
+                    if PLAYLIST_MANIFEST_BLOB:
+                        downloader = await container_client.download_blob(PLAYLIST_MANIFEST_BLOB)
+                        manifest = await downloader.readall()
+                    targets = resolve_ingest_targets(manifest, req.params.get('markets'))
+                logging.info(f"Ingesting {len(targets)} playlist(s)")
+            except Exception as e:
+                logging.error(f"Failed to resolve playlists to ingest: {str(e)}")
+                return func.HttpResponse(
+                    f"Error loading playlist configuration: {str(e)}",
+                    status_code=500
+                )
+
+            force = req.params.get('force', '').lower() in ('1', 'true', 'yes')
+            started = time.perf_counter()
+            results = await async_ingest_playlists(client, container_client, targets,
+                                                   state_store=get_state_store(), force=force)
+            summary, status_code = summarize_ingestion(results, (time.perf_counter() - started) * 1000, timer)
+            export_ingestion_metrics(summary, timer, 'http_async')
+
+            return func.HttpResponse(
+                body=json.dumps(summary),
+                mimetype="application/json",
+                status_code=status_code
+            )
+        except Exception as e:
+            error_message = str(e)
+            logging.error(f"Unexpected error in async Spotify data extraction: {error_message}")
+            await reset_async_clients()
+            return func.HttpResponse(
+                body=f"Error processing request: {error_message}",
+                mimetype="text/plain",
+                status_code=500
+            )
@@ -0,0 +1,286 @@
+"""
+Historical backfill: re-run the transform over raw blobs already in ``processed/``.
+
+Used to rebuild the transformed tables after the transform logic changes. Raw
+blobs are selected by the extraction timestamp in their name
+(``spotify_raw_<playlist>_<YYYYmmddHHMMSS>``, or ``spotify_raw_<YYYYmmddHHMMSS>``
+for blobs written before the playlist ID was added) and transformed in
+parallel in a process pool. Outputs are named after the raw blob (playlist ID
+and extraction timestamp), so transforming a blob twice overwrites its outputs
+instead of duplicating them.
+
+Progress is checkpointed in the state store under ``backfill/<run>.json``; a
+backfill that is killed or times out resumes with the blobs it had not
+finished when it is started again with the same range.
+
+Usage:
+    python spotifybackfill.py --start 2024-01-01 --end 2024-03-31 [--market US] [--workers 8]
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import azure.functions as func
+
+from spotifyclients import get_blob_service_client, get_state_store, reset_clients_after_error
+from spotifymetrics import PhaseTimer, export_metrics
+from spotifyraw import raw_blob_timestamp
+from spotifytransform import CONTAINER_NAME, STORAGE_CONNECTION_STRING, TRANSFORMED_PREFIX, transform_raw_blob
+
+# Worker processes per backfill; each transforms one raw blob at a time
+BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', str(os.cpu_count() or 2)))
+# Completed blobs between checkpoint writes; a resumed run redoes at most this many
+BACKFILL_CHECKPOINT_EVERY = int(os.environ.get('BACKFILL_CHECKPOINT_EVERY', '50'))
+# Most blobs one HTTP request transforms, so it finishes within the HTTP timeout; call again to continue
+BACKFILL_HTTP_MAX_BLOBS = int(os.environ.get('BACKFILL_HTTP_MAX_BLOBS', '500'))
+BACKFILL_STATE_PREFIX = 'backfill'
+
+
+def parse_date(value, end=False):
+    """
+    Parse a ``YYYY-mm-dd`` (or ISO datetime) bound of a backfill range.
+
+    A bare end date includes that whole day.
+    """
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) <= 10:
+        parsed += timedelta(days=1) - timedelta(microseconds=1)
+    return parsed
+
+
+def list_backfill_blobs(container_client, start, end, market=None):
+    """
+    List the raw blobs in ``processed/`` extracted between ``start`` and ``end`` (inclusive).
+
+    Args:
+        container_client: Container holding the raw blobs
+        start: Earliest extraction time as a datetime
+        end: Latest extraction time as a datetime
+        market: Only list blobs of this market partition (``processed/market=XX/``)
+
+    Returns:
+        Sorted list of blob names
+    """
+    prefix = f'processed/market={market.upper()}/' if market else 'processed/'
+    lower, upper = start.strftime('%Y%m%d%H%M%S'), end.strftime('%Y%m%d%H%M%S')
+    names = []
+    for blob in container_client.list_blobs(name_starts_with=prefix):
+        timestamp = raw_blob_timestamp(blob.name)
+        if timestamp and lower <= timestamp <= upper:
+            names.append(blob.name)
+    return sorted(names)
+
+
+def backfill_run_id(start, end, market=None, output_prefix=TRANSFORMED_PREFIX):
+    """Stable ID of a backfill, so that starting the same range again resumes it"""
+    key = json.dumps([start.isoformat(), end.isoformat(), (market or '').upper(), output_prefix])
+    return f"{start:%Y%m%d}-{end:%Y%m%d}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:10]}"
+
+
+def backfill_state_key(run_id):
+    return f'{BACKFILL_STATE_PREFIX}/{run_id}.json'
+
+
+def _transform_worker(blob_name, output_prefix):
+    """Transform one blob in a worker process; errors are returned rather than raised"""
+    started = time.perf_counter()
+    try:
+        container_client = get_blob_service_client().get_container_client(CONTAINER_NAME)
+        outputs = transform_raw_blob(container_client, blob_name, timestamp=raw_blob_timestamp(blob_name),
+                                     output_prefix=output_prefix)
+        return {'blob': blob_name, 'status': 'succeeded', 'outputs': len(outputs),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1)}
+    except Exception as e:
+        reset_clients_after_error(e)
+        return {'blob': blob_name, 'status': 'failed', 'error': str(e),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1)}
+
+
+def run_backfill(container_client, start, end, market=None, output_prefix=TRANSFORMED_PREFIX,
+                 workers=None, max_blobs=None, state_store=None):
+    """
+    Transform the raw blobs of a date range in a process pool, resuming from the last checkpoint.
+
+    The checkpoint holds the names of completed blobs and the errors of failed
+    ones. Completed blobs are skipped on resume; failed blobs are retried.
+
+    Args:
+        container_client: Container holding the raw blobs, used for listing
+        start: Earliest extraction time as a datetime
+        end: Latest extraction time as a datetime
+        market: Only backfill this market partition
+        output_prefix: Folder the transformed tables are written under
+        workers: Worker processes (defaults to ``BACKFILL_WORKERS``)
+        max_blobs: Stop after submitting this many blobs; the rest is left for the next run
+        state_store: Store for the checkpoint (defaults to the shared state store)
+
+    Returns:
+        Summary dict with counts, timings and the number of blobs still remaining
+    """
+    state_store = state_store or get_state_store()
+    workers = max(1, workers or BACKFILL_WORKERS)
+    run_id = backfill_run_id(start, end, market, output_prefix)
+    state_key = backfill_state_key(run_id)
+    timer = PhaseTimer()
+    started = time.perf_counter()
+
+    checkpoint = state_store.read(state_key) or {
+        'start': start.isoformat(), 'end': end.isoformat(), 'market': market,
+        'output_prefix': output_prefix, 'completed': [], 'failed': {},
+    }
+    completed = set(checkpoint['completed'])
+
+    with timer.phase('list'):
+        blobs = list_backfill_blobs(container_client, start, end, market)
+    pending = [name for name in blobs if name not in completed]
+    batch = pending[:max_blobs] if max_blobs else pending
+    logging.info(f"Backfill {run_id}: {len(blobs)} raw blob(s) in range, {len(completed)} already done, "
+                 f"transforming {len(batch)} with {workers} worker(s)")
+
+    def save_checkpoint():
+        checkpoint['completed'] = sorted(completed)
+        checkpoint['updated_at'] = datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+        with timer.phase('checkpoint'):
+            state_store.write(state_key, checkpoint)
+
+    succeeded = failed = 0
+    since_checkpoint = 0
+    if batch:
+        # Spawned workers build their own storage clients instead of inheriting the parent's connections
+        context = multiprocessing.get_context('spawn')
+        try:
+            with timer.phase('transform'), \
+                    ProcessPoolExecutor(max_workers=min(workers, len(batch)), mp_context=context) as executor:
+                futures = [executor.submit(_transform_worker, name, output_prefix) for name in batch]
+                for future in as_completed(futures):
+                    result = future.result()
+                    timer.sample('blob_transform', result['duration_ms'])
+                    if result['status'] == 'succeeded':
+                        succeeded += 1
+                        completed.add(result['blob'])
+                        checkpoint['failed'].pop(result['blob'], None)
+                    else:
+                        failed += 1
+                        checkpoint['failed'][result['blob']] = result['error']
+                        logging.error(f"Backfill of {result['blob']} failed: {result['error']}")
+                    since_checkpoint += 1
+                    if since_checkpoint >= BACKFILL_CHECKPOINT_EVERY:
+                        save_checkpoint()
+                        since_checkpoint = 0
+        finally:
+            # Keep what finished even if the pool broke, e.g. a worker was killed for memory
+            save_checkpoint()
+
+    summary = {
+        'run_id': run_id,
+        'checkpoint': state_key,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'market': market,
+        'output_prefix': output_prefix,
+        'blobs': len(blobs),
+        'previously_completed': len(blobs) - len(pending),
+        'succeeded': succeeded,
+        'failed': failed,
+        'remaining': len(blobs) - len(completed.intersection(blobs)),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+        'timings': timer.summary(),
+    }
+    export_metrics(
+        timer.metrics() + [(name, summary[name]) for name in ('duration_ms', 'blobs', 'succeeded', 'failed', 'remaining')],
+        operation='backfill'
+    )
+    return summary
+
+
+def register_spotify_backfill(app):
+    """
+    Register the HTTP-triggered backfill function with the Azure Functions app.
+
+    Args:
+        app: The Azure Functions app instance
+    """
+    @app.route(route="spotify/backfill", methods=["GET", "POST"])
+    def spotify_backfill_trigger(req: func.HttpRequest) -> func.HttpResponse:
+        """
+        HTTP-triggered Azure Function that re-transforms raw blobs from ``processed/``.
+
+        Takes ``start`` and ``end`` dates (``YYYY-mm-dd``) plus optional
+        ``market``, ``output_prefix`` and ``workers``. Each request transforms
+        at most ``limit`` (default ``BACKFILL_HTTP_MAX_BLOBS``) blobs; call it
+        again with the same parameters until ``remaining`` is 0.
+
+        Args:
+            req: HTTP request object
+
+        Returns:
+            HTTP response with a JSON summary of the backfill batch
+        """
+        logging.info('Spotify backfill function triggered via HTTP')
+
+        if not STORAGE_CONNECTION_STRING:
+            logging.error("Missing Azure Storage connection string")
+            return func.HttpResponse(
+                "Please configure Azure Storage settings in application settings.",
+                status_code=500
+            )
+
+        try:
+            start = parse_date(req.params['start'])
+            end = parse_date(req.params['end'], end=True)
+            workers = int(req.params['workers']) if req.params.get('workers') else None
+            limit = int(req.params.get('limit') or BACKFILL_HTTP_MAX_BLOBS)
+        except (KeyError, ValueError) as e:
+            return func.HttpResponse(
+                f"Pass start and end as YYYY-mm-dd and numeric workers/limit: {str(e)}",
+                status_code=400
+            )
+
+        try:
+            container_client = get_blob_service_client().get_container_client(CONTAINER_NAME)
+            summary = run_backfill(container_client, start, end, market=req.params.get('market'),
+                                   output_prefix=req.params.get('output_prefix') or TRANSFORMED_PREFIX,
+                                   workers=workers, max_blobs=limit)
+            return func.HttpResponse(
+                body=json.dumps(summary),
+                mimetype="application/json",
+                status_code=207 if summary['failed'] else 200
+            )
+        except Exception as e:
+            logging.error(f"Unexpected error in Spotify backfill: {str(e)}")
+            reset_clients_after_error(e)
+            return func.HttpResponse(
+                body=f"Error processing request: {str(e)}",
+                mimetype="text/plain",
+                status_code=500
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-run the transform over raw blobs in processed/ for a date range')
+    parser.add_argument('--start', required=True, help='First extraction date, YYYY-mm-dd')
+    parser.add_argument('--end', required=True, help='Last extraction date (inclusive), YYYY-mm-dd')
+    parser.add_argument('--market', help='Only backfill this market partition')
+    parser.add_argument('--output-prefix', default=TRANSFORMED_PREFIX,
+                        help='Folder for the rebuilt tables, e.g. transformed_data_v2 to keep the old outputs apart')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: BACKFILL_WORKERS)')
+    parser.add_argument('--max-blobs', type=int, default=None, help='Stop after this many blobs')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if not STORAGE_CONNECTION_STRING:
+        parser.error('Set AzureWebJobsStorage to the storage account connection string')
+    container_client = get_blob_service_client().get_container_client(CONTAINER_NAME)
+    summary = run_backfill(container_client, parse_date(args.start), parse_date(args.end, end=True),
+                           market=args.market, output_prefix=args.output_prefix,
+                           workers=args.workers, max_blobs=args.max_blobs)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+import os
+import logging
+import asyncio
+import threading
+import time
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import spotipy
+from spotipy.cache_handler import CacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient
+from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
+from spotifycodec import get_json_codec
+from spotifystore import BlobJsonStore, LocalJsonStore
+
+# Get environment variables
+CLIENT_ID = os.environ.get('CLIENT_ID')
+SECRET_ID = os.environ.get('CLIENT_SECRET')
+STORAGE_CONNECTION_STRING = os.environ.get('AzureWebJobsStorage')
+CONTAINER_NAME = os.environ.get('CONTAINER_NAME', "raw")
+
+SPOTIFY_API_URL = os.environ.get('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+SPOTIFY_TOKEN_URL = os.environ.get('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+HTTP_TIMEOUT_SECONDS = int(os.environ.get('HTTP_TIMEOUT_SECONDS', 30))
+# Size the pools for PLAYLIST_CONCURRENCY x PAGE_FETCH_CONCURRENCY requests in flight
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 32))
+HEALTH_CHECK_INTERVAL_SECONDS = int(os.environ.get('HEALTH_CHECK_INTERVAL_SECONDS', 300))
+TOKEN_CACHE_KEY = os.environ.get('TOKEN_CACHE_KEY', 'spotify_token.json')
+# Treat the token as expired this long before expires_at so it is refreshed off the hot path
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get('TOKEN_REFRESH_MARGIN_SECONDS', 300))
+
+
+def make_http_session(pool_size=HTTP_POOL_SIZE, max_retries=0):
+    """Create a requests session whose connection pool fits the configured concurrency"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class LazyClient:
+    """
+    Lazily created, process-wide client shared across invocations on a warm instance.
+
+    The client is built on first use by ``factory``. When a ``health_check`` is
+    given it runs at most once every ``HEALTH_CHECK_INTERVAL_SECONDS``, by one
+    caller and outside the lock so other callers keep using the client
+    meanwhile; a client that fails its check is discarded and rebuilt. Callers
+    that observe a broken client can also ``reset`` it explicitly.
+    """
+
+    def __init__(self, name, factory, health_check=None):
+        self.name = name
+        self.factory = factory
+        self.health_check = health_check
+        self._client = None
+        self._last_checked = 0
+        self._lock = threading.Lock()
+
+    def _check_due(self):
+        """Whether the current client should be checked now; claims the check for the calling thread"""
+        if self._client is None or self.health_check is None:
+            return False
+        if time.monotonic() - self._last_checked < HEALTH_CHECK_INTERVAL_SECONDS:
+            return False
+        self._last_checked = time.monotonic()
+        return True
+
+    def _is_healthy(self, client):
+        try:
+            self.health_check(client)
+            return True
+        except Exception as e:
+            logging.warning(f"Health check failed for {self.name} client, rebuilding it: {str(e)}")
+            return False
+
+    def get(self):
+        """Return the shared client, building or rebuilding it when needed"""
+        with self._lock:
+            client, check = self._client, self._check_due()
+        if check and not self._is_healthy(client):
+            with self._lock:
+                if self._client is client:
+                    self._client = None
+        with self._lock:
+            if self._client is None:
+                self._client = self.factory()
+                self._last_checked = time.monotonic()
+                logging.info(f"Created shared {self.name} client")
+            return self._client
+
+    def reset(self):
+        """Discard the shared client so the next ``get`` builds a fresh one"""
+        with self._lock:
+            self._client = None
+
+
+class SpotifyTokenCache(CacheHandler):
+    """
+    spotipy cache handler backed by process memory and a shared state store.
+
+    Replaces spotipy's default ``.cache`` file. Every instance checks its own
+    in-process copy first, then the shared store, before letting spotipy call the
+    accounts endpoint. Tokens within ``TOKEN_REFRESH_MARGIN_SECONDS`` of
+    ``expires_at`` are reported as missing so that a fresh token is requested and
+    published before the old one actually expires.
+    """
+
+    def __init__(self, store, key=TOKEN_CACHE_KEY, refresh_margin=TOKEN_REFRESH_MARGIN_SECONDS):
+        self.store = store
+        self.key = key
+        self.refresh_margin = refresh_margin
+        self._token_info = None
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, token_info):
+        return bool(token_info) and token_info.get('expires_at', 0) - time.time() > self.refresh_margin
+
+    def get_cached_token(self):
+        with self._lock:
+            if self._is_fresh(self._token_info):
+                return self._token_info
+            try:
+                token_info = self.store.read(self.key)
+            except Exception as e:
+                logging.warning(f"Could not read shared Spotify token cache: {str(e)}")
+                return None
+            if not self._is_fresh(token_info):
+                return None
+            self._token_info = token_info
+            return token_info
+
+    def save_token_to_cache(self, token_info):
+        with self._lock:
+            self._token_info = token_info
+            try:
+                self.store.write(self.key, token_info)
+            except Exception as e:
+                logging.warning(f"Could not write shared Spotify token cache: {str(e)}")
+
+
+class SharedClientCredentials(SpotifyClientCredentials):
+    """
+    Client credentials manager that lets only one thread request a token at a time.
+
+    When many playlists or markets start concurrently on a cold instance, the
+    first caller fetches the token and the others find it in the cache instead
+    of each requesting their own.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._token_lock = threading.Lock()
+
+    def get_access_token(self, as_dict=True, check_cache=True):
+        with self._token_lock:
+            return super().get_access_token(as_dict=as_dict, check_cache=check_cache)
+
+
+def _build_spotify_client():
+    # spotipy's default retry policy, except that 429s are left to the
+    # extract module's RequestScheduler so throttling is handled in one place
+    retry = Retry(
+        total=3,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=3,
+        backoff_factor=0.3,
+        status_forcelist=(500, 502, 503, 504),
+        respect_retry_after_header=False,
+    )
+    session = make_http_session(max_retries=retry)
+    client_credentials_manager = SharedClientCredentials(
+        client_id=CLIENT_ID,
+        client_secret=SECRET_ID,
+        requests_session=session,
+        requests_timeout=HTTP_TIMEOUT_SECONDS,
+        cache_handler=get_token_cache(),
+    )
+    client_credentials_manager.OAUTH_TOKEN_URL = SPOTIFY_TOKEN_URL
+    sp = spotipy.Spotify(
+        client_credentials_manager=client_credentials_manager,
+        requests_session=session,
+        requests_timeout=HTTP_TIMEOUT_SECONDS,
+    )
+    sp.prefix = f'{SPOTIFY_API_URL}/'
+    return sp
+
+
+def _check_spotify_client(sp):
+    # A lightweight API GET through the client's own connection pool and token. Only
+    # connection-level failures mean the client is broken; any HTTP response, even an
+    # error status, shows that it works (as in reset_clients_after_error)
+    try:
+        sp.available_markets()
+    except (spotipy.SpotifyException, spotipy.SpotifyOauthError):
+        pass
+
+
+def _build_blob_service_client():
+    transport = RequestsTransport(session=make_http_session(), session_owner=False)
+    return BlobServiceClient.from_connection_string(STORAGE_CONNECTION_STRING, transport=transport)
+
+
+def _check_blob_service_client(blob_service_client):
+    # Container-level, so that a container-scoped SAS connection string is allowed to make
+    # it; as for Spotify, an HTTP error response still shows that the transport works
+    try:
+        blob_service_client.get_container_client(CONTAINER_NAME).get_container_properties()
+    except HttpResponseError:
+        pass
+
+
+_spotify_client = LazyClient('Spotify', _build_spotify_client, _check_spotify_client)
+_blob_service_client = LazyClient('Blob Storage', _build_blob_service_client, _check_blob_service_client)
+
+
+def get_spotify_client():
+    """Return the shared spotipy client for this instance"""
+    return _spotify_client.get()
+
+
+def get_blob_service_client():
+    """Return the shared BlobServiceClient for this instance"""
+    return _blob_service_client.get()
+
+
+def _get_container_client():
+    return get_blob_service_client().get_container_client(CONTAINER_NAME)
+
+
+if STORAGE_CONNECTION_STRING:
+    _state_store = BlobJsonStore(_get_container_client)
+else:
+    _state_store = LocalJsonStore()
+_token_cache = SpotifyTokenCache(_state_store)
+
+
+def get_state_store():
+    """Return the shared JSON state store: blob-backed, or local files without a storage connection"""
+    return _state_store
+
+
+def get_token_cache():
+    """Return the shared Spotify token cache used by both the sync and async clients"""
+    return _token_cache
+
+
+def reset_spotify_client():
+    """Drop the shared spotipy client, e.g. after a connection-level failure"""
+    _spotify_client.reset()
+
+
+def reset_blob_service_client():
+    """Drop the shared BlobServiceClient, e.g. after a connection-level failure"""
+    _blob_service_client.reset()
+
+
+def reset_clients_after_error(error):
+    """
+    Drop whichever shared client a connection-level ``error`` came from.
+
+    HTTP status errors leave the clients alone; only broken connections or
+    transports trigger a rebuild on the next ``get``.
+    """
+    if isinstance(error, requests.exceptions.ConnectionError):
+        logging.warning("Resetting shared Spotify client after a connection error")
+        reset_spotify_client()
+    elif isinstance(error, ServiceRequestError):
+        logging.warning("Resetting shared Blob Storage client after a connection error")
+        reset_blob_service_client()
+
+
+class AsyncSpotifyClient:
+    """
+    Minimal asyncio client for the Spotify Web API using client credentials.
+
+    Only the endpoints the extraction pipeline needs are implemented. Access
+    tokens go through the same ``SpotifyTokenCache`` as the spotipy client, so
+    both paths and all instances share one token; concurrent callers share a
+    single token request. The current token is also kept on the client, so
+    requests only take the lock and go to the cache when it is missing or due
+    for refresh.
+    """
+
+    def __init__(self, session, client_id, client_secret, token_cache=None):
+        self.session = session
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_cache = token_cache or get_token_cache()
+        self.refresh_margin = getattr(self.token_cache, 'refresh_margin', TOKEN_REFRESH_MARGIN_SECONDS)
+        self._token_info = None
+        self._token_lock = asyncio.Lock()
+
+    def _current_token(self):
+        token_info = self._token_info
+        if token_info and token_info.get('expires_at', 0) - time.time() > self.refresh_margin:
+            return token_info['access_token']
+        return None
+
+    async def get_access_token(self):
+        """Return a valid access token, requesting a new one when needed"""
+        if (token := self._current_token()) is not None:
+            return token
+        async with self._token_lock:
+            # Another caller may have refreshed it while we waited for the lock
+            if (token := self._current_token()) is not None:
+                return token
+            # The cache may hit blob storage, so keep it off the event loop
+            token_info = await asyncio.to_thread(self.token_cache.get_cached_token)
+            if token_info is None:
+                auth = aiohttp.BasicAuth(self.client_id, self.client_secret)
+                async with self.session.post(SPOTIFY_TOKEN_URL, data={'grant_type': 'client_credentials'}, auth=auth) as response:
+                    response.raise_for_status()
+                    token_info = await response.json(loads=get_json_codec().loads)
+                token_info['expires_at'] = int(time.time()) + token_info['expires_in']
+                await asyncio.to_thread(self.token_cache.save_token_to_cache, token_info)
+            self._token_info = token_info
+            return token_info['access_token']
+
+    async def get(self, path, params=None):
+        """Issue an authenticated GET against the Web API and return the decoded JSON"""
+        headers = {'Authorization': f'Bearer {await self.get_access_token()}'}
+        async with self.session.get(f'{SPOTIFY_API_URL}/{path}', params=params, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json(loads=get_json_codec().loads)
+
+    async def playlist_items(self, playlist_id, limit=100, offset=0, fields=None, market=None):
+        """Fetch a single page of playlist items, optionally projected to ``fields`` and relinked for ``market``"""
+        params = {'limit': limit, 'offset': offset}
+        if fields:
+            params['fields'] = fields
+        if market:
+            params['market'] = market
+        return await self.get(f'playlists/{playlist_id}/tracks', params=params)
+
+
+# asyncio clients are bound to the event loop they were created on, so they are
+# cached per loop rather than per process
+_async_clients = {}
+
+
+async def get_async_clients():
+    """
+    Return the shared (AsyncSpotifyClient, aio BlobServiceClient) pair for the running loop.
+
+    The Functions worker runs async handlers on one long-lived event loop, so warm
+    invocations reuse the same aiohttp connection pool, access token and blob
+    transport. Clients from a previous, closed loop are discarded.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None or clients[0].session.closed:
+        for stale_loop in [stale for stale in _async_clients if stale.is_closed()]:
+            del _async_clients[stale_loop]
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS))
+        clients = (
+            AsyncSpotifyClient(session, CLIENT_ID, SECRET_ID),
+            AsyncBlobServiceClient.from_connection_string(STORAGE_CONNECTION_STRING),
+        )
+        _async_clients[loop] = clients
+        logging.info("Created shared async Spotify and Blob Storage clients")
+    return clients
+
+
+async def reset_async_clients():
+    """Close and drop the shared asyncio clients for the running loop"""
+    clients = _async_clients.pop(asyncio.get_running_loop(), None)
+    if clients is not None:
+        spotify_client, blob_service_client = clients
+        await spotify_client.session.close()
+        await blob_service_client.close()
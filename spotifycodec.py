@@ -0,0 +1,161 @@
+import os
+import json
+import logging
+import threading
+from typing import List, Optional, TypedDict
+
+try:
+    import msgspec
+except ImportError:  # msgspec is optional; the stdlib json module is the fallback
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib json module is the fallback
+    orjson = None
+
+# JSON backend for raw blobs and Spotify responses: auto (msgspec, then orjson,
+# then stdlib), msgspec, orjson or stdlib
+JSON_CODEC = os.environ.get('JSON_CODEC', 'auto').lower()
+
+
+# Playlist item fields the transform reads, i.e. the ``transform`` field
+# projection. Codecs that support typed decoding skip every other field.
+class ExternalUrls(TypedDict, total=False):
+    spotify: Optional[str]
+
+
+class AlbumFields(TypedDict, total=False):
+    id: Optional[str]
+    name: Optional[str]
+    release_date: Optional[str]
+    total_tracks: Optional[int]
+    external_urls: ExternalUrls
+
+
+class ArtistFields(TypedDict, total=False):
+    id: Optional[str]
+    name: Optional[str]
+    external_urls: ExternalUrls
+
+
+class TrackFields(TypedDict, total=False):
+    id: Optional[str]
+    name: Optional[str]
+    duration_ms: Optional[int]
+    popularity: Optional[int]
+    external_urls: ExternalUrls
+    album: AlbumFields
+    artists: List[ArtistFields]
+
+
+class PlaylistItemFields(TypedDict, total=False):
+    added_at: Optional[str]
+    track: Optional[TrackFields]
+
+
+class StdlibCodec:
+    """Compact JSON with the standard library; typed decoding falls back to full decoding"""
+
+    name = 'stdlib'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+    def dumps(self, value):
+        """Encode ``value`` as compact UTF-8 JSON bytes"""
+        return self._encoder.encode(value).encode('utf-8')
+
+    def loads(self, data):
+        """Decode JSON from bytes or str"""
+        return json.loads(data)
+
+    def decoder(self, schema=None):
+        """Return a ``loads`` function, decoding only the fields of ``schema`` when the backend supports it"""
+        return self.loads
+
+
+class OrjsonCodec:
+    """orjson: fast encoding and decoding, without typed decoding"""
+
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError("The orjson package is not installed")
+
+    def dumps(self, value):
+        return orjson.dumps(value)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def decoder(self, schema=None):
+        return orjson.loads
+
+
+class MsgspecCodec:
+    """
+    msgspec: fast encoding and decoding, plus typed decoding against a schema.
+
+    Typed decoders return plain dicts holding only the fields declared by the
+    schema; everything else in the document is skipped without building
+    Python objects for it.
+    """
+
+    name = 'msgspec'
+
+    def __init__(self):
+        if msgspec is None:
+            raise RuntimeError("The msgspec package is not installed")
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+        self._typed_decoders = {}
+        self._lock = threading.Lock()
+
+    def dumps(self, value):
+        return self._encoder.encode(value)
+
+    def loads(self, data):
+        return self._decoder.decode(data)
+
+    def decoder(self, schema=None):
+        if schema is None:
+            return self._decoder.decode
+        with self._lock:
+            if schema not in self._typed_decoders:
+                self._typed_decoders[schema] = msgspec.json.Decoder(schema)
+            return self._typed_decoders[schema].decode
+
+
+JSON_CODECS = {
+    'msgspec': MsgspecCodec,
+    'orjson': OrjsonCodec,
+    'stdlib': StdlibCodec,
+}
+
+_codec = None
+_codec_lock = threading.Lock()
+
+
+def get_json_codec():
+    """
+    Return the codec selected by ``JSON_CODEC``.
+
+    ``auto`` picks the first installed of msgspec (the only backend with typed
+    decoding), orjson and the stdlib; a named backend that is not installed
+    falls back to the stdlib.
+    """
+    global _codec
+    with _codec_lock:
+        if _codec is None:
+            if JSON_CODEC == 'auto':
+                names = [name for name, module in (('msgspec', msgspec), ('orjson', orjson)) if module is not None]
+                _codec = JSON_CODECS[(names or ['stdlib'])[0]]()
+            else:
+                try:
+                    _codec = JSON_CODECS[JSON_CODEC]()
+                except Exception as e:
+                    logging.warning(f"Could not use JSON codec {JSON_CODEC!r}, using the stdlib instead: {str(e)}")
+                    _codec = StdlibCodec()
+        return _codec
@@ -0,0 +1,259 @@
+import os
+import logging
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from spotifyextract import request_scheduler
+
+ENRICH_CONCURRENCY = int(os.environ.get('ENRICH_CONCURRENCY', 4))
+
+# Maximum IDs per call accepted by Spotify's batched endpoints
+AUDIO_FEATURES_BATCH_SIZE = 100
+ARTISTS_BATCH_SIZE = 50
+ALBUMS_BATCH_SIZE = 20
+
+ARTIST_CACHE_TTL_HOURS = float(os.environ.get('ARTIST_CACHE_TTL_HOURS', 24))
+# Albums and audio features do not change, but entries older than this are dropped
+# and fetched again, which keeps those caches to the recently seen entities
+METADATA_CACHE_RETENTION_DAYS = float(os.environ.get('METADATA_CACHE_RETENTION_DAYS', 90))
+# Documents each metadata cache is split into; concurrent runs only contend for shards they both add to
+METADATA_CACHE_SHARDS = int(os.environ.get('METADATA_CACHE_SHARDS', 16))
+# Conditional writes of one shard before its new entries are given up on
+METADATA_CACHE_WRITE_ATTEMPTS = 5
+
+ARTIST_DETAIL_COLUMNS = ['genres', 'followers', 'popularity']
+ALBUM_DETAIL_COLUMNS = ['label', 'popularity', 'genres', 'release_date_precision']
+
+AUDIO_FEATURE_COLUMNS = [
+    'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+    'instrumentalness', 'liveness', 'valence', 'tempo', 'time_signature',
+]
+
+
+class MetadataCache:
+    """
+    Persistent cache of Spotify metadata keyed by entity ID.
+
+    Entries are spread by a hash of the ID over ``shards`` JSON documents of the
+    state store (``<key>/<shard>.json``). Only the shards holding requested IDs
+    are read, and only shards that received new entries are written back.
+    Writes are conditional on the version that was read: when another transform
+    or backfill worker wrote the shard in the meantime, its entries are merged
+    with ours and the write is retried, so concurrent runs never drop each
+    other's entries.
+
+    Each entry keeps the time it was fetched; with a ``ttl_seconds`` entries
+    older than that are treated as missing and dropped whenever their shard is
+    written, without one they never expire. A cached value of None records that
+    Spotify had nothing for the ID, so it is not requested again.
+    """
+
+    def __init__(self, store, key, ttl_seconds=None, shards=METADATA_CACHE_SHARDS):
+        self.store = store
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+        self.shards = max(1, shards)
+        self.documents = {}
+        self._etags = {}
+        self._added = {}
+
+    def _shard(self, entity_id):
+        return zlib.crc32(entity_id.encode('utf-8')) % self.shards
+
+    def _shard_key(self, shard):
+        return f'{self.key}/{shard:03d}.json'
+
+    def _read_shard(self, shard):
+        """Read one shard, starting it empty if it is missing or unreadable"""
+        try:
+            document, etag = self.store.read_versioned(self._shard_key(shard))
+        except Exception as e:
+            logging.warning(f"Could not read metadata cache {self._shard_key(shard)}, starting empty: {str(e)}")
+            return {}, None
+        return document or {}, etag
+
+    def load(self, ids=None):
+        """Read the shards holding ``ids`` (every shard when omitted) that were not read yet"""
+        shards = range(self.shards) if ids is None else {self._shard(entity_id) for entity_id in ids if entity_id}
+        shards = [shard for shard in shards if shard not in self.documents]
+        if shards:
+            with ThreadPoolExecutor(max_workers=max(1, min(ENRICH_CONCURRENCY, len(shards)))) as executor:
+                for shard, (document, etag) in zip(shards, executor.map(self._read_shard, shards)):
+                    self.documents[shard], self._etags[shard] = document, etag
+        return self
+
+    def _is_fresh(self, entry):
+        return self.ttl_seconds is None or time.time() - entry['cached_at'] < self.ttl_seconds
+
+    def _entry(self, entity_id):
+        # Local tracks have no track, album or artist IDs
+        if not entity_id:
+            return None
+        return self.documents.get(self._shard(entity_id), {}).get(entity_id)
+
+    def missing(self, ids):
+        """Return the de-duplicated IDs that have no fresh cache entry"""
+        ids = [entity_id for entity_id in dict.fromkeys(ids) if entity_id]
+        self.load(ids)
+        return [entity_id for entity_id in ids
+                if (entry := self._entry(entity_id)) is None or not self._is_fresh(entry)]
+
+    def get(self, entity_id):
+        """Return the cached value for an ID, or None"""
+        entry = self._entry(entity_id)
+        return entry['value'] if entry else None
+
+    def update(self, values):
+        """Add or refresh entries from a mapping of ID to value"""
+        now = int(time.time())
+        for entity_id, value in values.items():
+            shard = self._shard(entity_id)
+            entry = {'value': value, 'cached_at': now}
+            self.documents.setdefault(shard, {})[entity_id] = entry
+            self._added.setdefault(shard, {})[entity_id] = entry
+
+    def _save_shard(self, shard, added):
+        """Write one shard conditionally, merging with a concurrent writer's version on conflict"""
+        for _ in range(METADATA_CACHE_WRITE_ATTEMPTS):
+            document = {entity_id: entry for entity_id, entry in {**self.documents.get(shard, {}), **added}.items()
+                        if self._is_fresh(entry)}
+            etag = self.store.write_if_unchanged(self._shard_key(shard), document, self._etags.get(shard))
+            if etag is not None:
+                self.documents[shard], self._etags[shard] = document, etag
+                return
+            # Someone else wrote the shard since we read it; start again from their version
+            self.documents[shard], self._etags[shard] = self._read_shard(shard)
+        logging.warning(f"Gave up writing metadata cache {self._shard_key(shard)} after "
+                        f"{METADATA_CACHE_WRITE_ATTEMPTS} conflicting writes; its new entries are fetched again next time")
+
+    def save(self):
+        """Write back the shards that received new entries, dropping expired entries from them"""
+        for shard, added in self._added.items():
+            self._save_shard(shard, added)
+        self._added = {}
+
+
+def batched(ids, batch_size):
+    """Split a list of IDs into consecutive batches of at most ``batch_size``"""
+    return [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+
+def fetch_batched(fetch_batch, ids, batch_size, max_workers=ENRICH_CONCURRENCY):
+    """
+    Call a batched Spotify endpoint for all ``ids`` concurrently.
+
+    Every call goes through the extract module's request scheduler, so enrichment
+    shares the instance's rate limit and 429 handling with extraction.
+
+    Args:
+        fetch_batch: Function taking a list of IDs and returning one result per ID, in order
+        ids: De-duplicated IDs to fetch
+        batch_size: Maximum IDs per call
+        max_workers: Maximum number of concurrent calls
+
+    Returns:
+        Dict mapping each ID to its result (None where Spotify returned nothing)
+    """
+    batches = batched(ids, batch_size)
+    if not batches:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        results = executor.map(lambda batch: request_scheduler.call(fetch_batch, batch), batches)
+        return {entity_id: value for batch, values in zip(batches, results) for entity_id, value in zip(batch, values)}
+
+
+def enrich_audio_features(sp, song_ids, cache):
+    """
+    Collect audio features for the given tracks, fetching only IDs the cache lacks.
+
+    Audio features of a track never change; the cache only expires entries after
+    ``METADATA_CACHE_RETENTION_DAYS`` to keep its size bounded.
+
+    Args:
+        sp: Authenticated spotipy client
+        song_ids: Track IDs seen in the run (duplicates allowed)
+        cache: MetadataCache for audio features, usually with ``METADATA_CACHE_RETENTION_DAYS``
+
+    Returns:
+        Rows of ``[song_id, *AUDIO_FEATURE_COLUMNS]`` for every track that has features
+    """
+    to_fetch = cache.missing(song_ids)
+    if to_fetch:
+        fetched = fetch_batched(lambda batch: sp.audio_features(batch), to_fetch, AUDIO_FEATURES_BATCH_SIZE)
+        cache.update({
+            song_id: {column: features[column] for column in AUDIO_FEATURE_COLUMNS} if features else None
+            for song_id, features in fetched.items()
+        })
+    unique_ids = [song_id for song_id in dict.fromkeys(song_ids) if song_id]
+    logging.info(f"Audio features: {len(to_fetch)} fetched, {len(unique_ids) - len(to_fetch)} served from cache")
+
+    rows = []
+    for song_id in unique_ids:
+        features = cache.get(song_id)
+        if features:
+            rows.append([song_id] + [features[column] for column in AUDIO_FEATURE_COLUMNS])
+    return rows
+
+
+def enrich_artists(sp, artist_ids, cache):
+    """
+    Collect genres, followers and popularity for the given artists.
+
+    Only artists without a fresh entry in the (TTL) cache are requested, 50 per
+    call. Chart artists repeat heavily from day to day, so most runs are served
+    almost entirely from the cache.
+
+    Args:
+        sp: Authenticated spotipy client
+        artist_ids: Artist IDs seen in the run (duplicates allowed)
+        cache: MetadataCache for artist details, usually with ``ARTIST_CACHE_TTL_HOURS``
+
+    Returns:
+        Dict mapping artist ID to a dict of ``ARTIST_DETAIL_COLUMNS``
+    """
+    to_fetch = cache.missing(artist_ids)
+    if to_fetch:
+        fetched = fetch_batched(lambda batch: sp.artists(batch)['artists'], to_fetch, ARTISTS_BATCH_SIZE)
+        cache.update({
+            artist_id: {
+                'genres': artist.get('genres', []),
+                'followers': (artist.get('followers') or {}).get('total'),
+                'popularity': artist.get('popularity'),
+            } if artist else None
+            for artist_id, artist in fetched.items()
+        })
+    unique_ids = [artist_id for artist_id in dict.fromkeys(artist_ids) if artist_id]
+    if unique_ids:
+        logging.info(f"Artists: {len(to_fetch)} fetched, cache hit rate {1 - len(to_fetch) / len(unique_ids):.1%}")
+
+    return {artist_id: cache.get(artist_id) for artist_id in unique_ids if cache.get(artist_id)}
+
+
+def enrich_albums(sp, album_ids, cache):
+    """
+    Collect label, popularity, genres and release date precision for the given albums.
+
+    Albums are effectively immutable, so each album is requested once, 20 per
+    call, and only again after ``METADATA_CACHE_RETENTION_DAYS``.
+
+    Args:
+        sp: Authenticated spotipy client
+        album_ids: Album IDs seen in the run (duplicates allowed)
+        cache: MetadataCache for album details, usually with ``METADATA_CACHE_RETENTION_DAYS``
+
+    Returns:
+        Dict mapping album ID to a dict of ``ALBUM_DETAIL_COLUMNS``
+    """
+    to_fetch = cache.missing(album_ids)
+    if to_fetch:
+        fetched = fetch_batched(lambda batch: sp.albums(batch)['albums'], to_fetch, ALBUMS_BATCH_SIZE)
+        cache.update({
+            album_id: {column: album.get(column) for column in ALBUM_DETAIL_COLUMNS} if album else None
+            for album_id, album in fetched.items()
+        })
+    unique_ids = [album_id for album_id in dict.fromkeys(album_ids) if album_id]
+    if unique_ids:
+        logging.info(f"Albums: {len(to_fetch)} fetched, cache hit rate {1 - len(to_fetch) / len(unique_ids):.1%}")
+
+    return {album_id: cache.get(album_id) for album_id in unique_ids if cache.get(album_id)}
@@ -1,11 +1,23 @@
 import os
+import re
 import logging
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+import asyncio
 import json
+import threading
+import time
+import zlib
+from itertools import chain
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 import azure.functions as func
-from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import HttpResponseError, ResourceExistsError
+from azure.storage.blob import ContentSettings
+
+from spotifyclients import get_spotify_client, get_blob_service_client, get_state_store, reset_clients_after_error
+from spotifyraw import raw_blob_name, raw_content_settings, write_raw_stream
+from spotifymetrics import PhaseTimer, TimedWriter, export_metrics, timed_iter
+from spotifystore import STATE_PREFIX
+from spotifyupload import StagedBlockUpload
 
 app = func.FunctionApp()
 # Get environment variables
@@ -14,6 +26,845 @@ SECRET_ID = os.environ.get('CLIENT_SECRET')
 STORAGE_CONNECTION_STRING = os.environ.get('AzureWebJobsStorage')
 CONTAINER_NAME = os.environ.get('CONTAINER_NAME', "raw")
 
+# Spotify caps playlist item pages at 100 entries
+PLAYLIST_PAGE_SIZE = 100
+PAGE_FETCH_CONCURRENCY = int(os.environ.get('PAGE_FETCH_CONCURRENCY', 8))
+
+# Field projections for playlist item pages. Without a filter every track and
+# album carries its available_markets list, which is most of the payload.
+PAGE_FIELDS = 'href,total,limit,offset,next,previous'
+TRANSFORM_ITEM_FIELDS = (
+    'items(added_at,track(id,name,duration_ms,popularity,external_urls(spotify),'
+    'album(id,name,release_date,total_tracks,external_urls(spotify)),'
+    'artists(id,name,external_urls(spotify))))'
+)
+ENRICH_ITEM_FIELDS = (
+    'items(added_at,added_by(id),is_local,track(id,name,duration_ms,popularity,explicit,track_number,disc_number,'
+    'uri,external_ids(isrc),external_urls(spotify),'
+    'album(id,name,album_type,release_date,release_date_precision,total_tracks,external_urls(spotify),artists(id,name)),'
+    'artists(id,name,uri,external_urls(spotify))))'
+)
+PLAYLIST_FIELD_PROJECTIONS = {
+    'full': None,
+    'transform': f'{PAGE_FIELDS},{TRANSFORM_ITEM_FIELDS}',
+    'enrich': f'{PAGE_FIELDS},{ENRICH_ITEM_FIELDS}',
+}
+# One of the projections above; PLAYLIST_FIELDS overrides it with a custom filter
+FIELDS_MODE = os.environ.get('FIELDS_MODE', 'transform')
+PLAYLIST_FIELDS = os.environ.get('PLAYLIST_FIELDS') or PLAYLIST_FIELD_PROJECTIONS.get(FIELDS_MODE, PLAYLIST_FIELD_PROJECTIONS['transform'])
+
+# Request scheduling: token bucket rate, adaptive concurrency bounds and retries per request
+REQUEST_RATE_PER_SECOND = float(os.environ.get('REQUEST_RATE_PER_SECOND', 10))
+REQUEST_BURST = int(os.environ.get('REQUEST_BURST', 20))
+REQUEST_MAX_CONCURRENCY = int(os.environ.get('REQUEST_MAX_CONCURRENCY', 16))
+REQUEST_MAX_RETRIES = int(os.environ.get('REQUEST_MAX_RETRIES', 5))
+# Seconds without a 429 (after its Retry-After pause) before the limits are restored to their maximums
+REQUEST_RECOVERY_SECONDS = float(os.environ.get('REQUEST_RECOVERY_SECONDS', 10))
+DEFAULT_RETRY_AFTER_SECONDS = 1.0
+# Share of the gap to the maximum rate and concurrency each successful request closes
+RECOVERY_STEP = 0.25
+
+# Playlists to ingest: comma-separated IDs/URLs, or a JSON manifest blob in CONTAINER_NAME
+DEFAULT_PLAYLIST_URL = "https://open.spotify.com/playlist/6UeSakyzhiEt4NB3UAd6NQ"  # Global Top 50
+PLAYLIST_IDS = os.environ.get('PLAYLIST_IDS', '')
+PLAYLIST_MANIFEST_BLOB = os.environ.get('PLAYLIST_MANIFEST_BLOB')
+PLAYLIST_CONCURRENCY = int(os.environ.get('PLAYLIST_CONCURRENCY', 4))
+
+# Country markets: comma-separated ISO 3166-1 alpha-2 codes that every configured
+# playlist is ingested for, and/or a JSON object mapping each market to its own
+# playlist (e.g. that country's Top 50). Each market is stored under market=XX.
+MARKETS = os.environ.get('MARKETS', '')
+MARKET_PLAYLISTS = os.environ.get('MARKET_PLAYLISTS', '')
+
+# Coalescing of concurrent ingestions of the same playlist: within an instance
+# callers share one in-flight run, across instances a short blob lease decides
+COALESCE_ACROSS_INSTANCES = os.environ.get('COALESCE_ACROSS_INSTANCES', 'true').lower() == 'true'
+# Blob leases last 15-60 seconds; the lease is renewed while the ingestion runs
+INGEST_LEASE_SECONDS = int(os.environ.get('INGEST_LEASE_SECONDS', 30))
+
+# Scheduled ingestion: NCRONTAB schedule, which must fire at a fixed interval, and how
+# many consecutive ticks the playlists are spread over (each playlist is ingested once per cycle)
+INGEST_SCHEDULE = os.environ.get('INGEST_SCHEDULE', '0 */10 * * * *')
+INGEST_SPREAD_SLOTS = int(os.environ.get('INGEST_SPREAD_SLOTS', 6))
+
+
+def retry_after_seconds(error):
+    """
+    Return how long to wait before retrying a throttled request, or None if ``error`` is not a 429.
+    
+    Understands both spotipy's ``SpotifyException`` and aiohttp's ``ClientResponseError``.
+    """
+    status = getattr(error, 'http_status', None) or getattr(error, 'status', None)
+    if status != 429:
+        return None
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return max(float(headers.get('Retry-After')), 0.0)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER_SECONDS
+
+
+class RequestScheduler:
+    """
+    Central scheduler for Spotify Web API requests made by this instance.
+    
+    Every request first takes a token from a token bucket refilled at ``rate``
+    requests per second, then a concurrency slot. Both limits adapt: a 429
+    halves them and pauses all requests for the ``Retry-After`` period. A burst
+    of 429s is one congestion event: only requests issued since the last
+    decrease can trigger another, so in-flight requests that were throttled
+    together halve the limits once. Every successful request closes
+    ``RECOVERY_STEP`` of the gap to the configured maximums (other failures do
+    not count), and once ``recovery_seconds`` pass after the last 429's pause
+    without another one, the maximums are restored outright. A long-lived
+    instance therefore does not carry a reduced rate into later invocations,
+    and throughput settles just below the rate Spotify allows. Only the
+    throttled request is retried, up to ``max_retries`` times.
+    """
+    
+    def __init__(self, rate=REQUEST_RATE_PER_SECOND, burst=REQUEST_BURST,
+                 max_concurrency=REQUEST_MAX_CONCURRENCY, max_retries=REQUEST_MAX_RETRIES,
+                 recovery_seconds=REQUEST_RECOVERY_SECONDS):
+        self.max_rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.recovery_seconds = recovery_seconds
+        self.rate = rate
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.throttled = 0
+        # Bumped on every decrease; requests remember the epoch they were issued in
+        self._epoch = 0
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._recover_at = 0.0
+        self._lock = threading.Lock()
+        self._slot_released = threading.Condition(self._lock)
+    
+    def _reserve(self):
+        """Take a token if one is available; otherwise return the seconds to wait"""
+        with self._lock:
+            now = time.monotonic()
+            self._recover(now)
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+    
+    def _recover(self, now):
+        """Restore the maximum limits once no 429 has been seen for the recovery period"""
+        if now >= self._recover_at and (self.rate < self.max_rate or self.concurrency < self.max_concurrency):
+            self.rate = self.max_rate
+            self.concurrency = float(self.max_concurrency)
+    
+    def _try_acquire_slot(self):
+        if self.in_flight < int(self.concurrency):
+            self.in_flight += 1
+            return True
+        return False
+    
+    def _release_slot(self, epoch, succeeded, retry_after=None):
+        with self._lock:
+            self.in_flight -= 1
+            if retry_after is not None:
+                self.throttled += 1
+                now = time.monotonic()
+                self._paused_until = max(self._paused_until, now + retry_after)
+                self._recover_at = max(self._recover_at, now + retry_after + self.recovery_seconds)
+                # A request issued before the last decrease was sent under the old limits;
+                # its 429 belongs to the congestion event that decrease already handled
+                if epoch == self._epoch:
+                    self._epoch += 1
+                    self.concurrency = max(1.0, self.concurrency / 2)
+                    self.rate = max(self.max_rate / 20, self.rate / 2)
+                    self._tokens = min(self._tokens, 0)
+            elif succeeded:
+                # The floors of the old additive increase let both reach their maximums instead of only approaching them
+                self.concurrency = min(self.max_concurrency, self.concurrency + max(
+                    (self.max_concurrency - self.concurrency) * RECOVERY_STEP, 1 / self.concurrency))
+                self.rate = min(self.max_rate, self.rate + max(
+                    (self.max_rate - self.rate) * RECOVERY_STEP, self.max_rate / 100))
+            self._slot_released.notify_all()
+    
+    def call(self, func, *args, **kwargs):
+        """Run ``func(*args, **kwargs)`` under the rate and concurrency limits, retrying on 429"""
+        for attempt in range(self.max_retries + 1):
+            while (wait := self._reserve()) > 0:
+                time.sleep(wait)
+            with self._lock:
+                while not self._try_acquire_slot():
+                    self._slot_released.wait()
+                epoch = self._epoch
+            
+            retry_after, succeeded = None, False
+            try:
+                result = func(*args, **kwargs)
+                succeeded = True
+                return result
+            except Exception as e:
+                retry_after = retry_after_seconds(e)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+                logging.warning(f"Spotify API throttled the request, retrying in {retry_after:.1f}s "
+                                f"(attempt {attempt + 1}/{self.max_retries}, concurrency {int(self.concurrency)})")
+            finally:
+                self._release_slot(epoch, succeeded, retry_after)
+    
+    async def call_async(self, func, *args, **kwargs):
+        """Async counterpart of ``call`` for coroutine functions, sharing the same limits"""
+        for attempt in range(self.max_retries + 1):
+            while (wait := self._reserve()) > 0:
+                await asyncio.sleep(wait)
+            while True:
+                with self._lock:
+                    if self._try_acquire_slot():
+                        epoch = self._epoch
+                        break
+                await asyncio.sleep(0.01)
+            
+            retry_after, succeeded = None, False
+            try:
+                result = await func(*args, **kwargs)
+                succeeded = True
+                return result
+            except Exception as e:
+                retry_after = retry_after_seconds(e)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+                logging.warning(f"Spotify API throttled the request, retrying in {retry_after:.1f}s "
+                                f"(attempt {attempt + 1}/{self.max_retries}, concurrency {int(self.concurrency)})")
+            finally:
+                self._release_slot(epoch, succeeded, retry_after)
+
+
+# Shared by every playlist and page fetched on this instance
+request_scheduler = RequestScheduler()
+
+
+def parse_playlist_id(playlist):
+    """Normalize a playlist URL, URI or bare ID to the bare playlist ID"""
+    playlist = playlist.strip()
+    if playlist.startswith('spotify:playlist:'):
+        return playlist.split(':')[-1]
+    if '/playlist/' in playlist:
+        return playlist.split('/playlist/')[-1].split('?')[0].split('/')[0]
+    return playlist
+
+
+def parse_markets(markets):
+    """Normalize a comma-separated string or list of market codes to de-duplicated upper-case codes"""
+    if isinstance(markets, str):
+        markets = markets.split(',')
+    return list(dict.fromkeys(market.strip().upper() for market in markets or [] if market and market.strip()))
+
+
+def target_key(playlist_id, market=None):
+    """Path identifying one playlist ingestion in blob names and state keys: the ID, or ``market=XX/<id>``"""
+    return f'market={market}/{playlist_id}' if market else playlist_id
+
+
+def resolve_ingest_targets(manifest=None, markets=None):
+    """
+    Resolve the (playlist, market) pairs to ingest.
+    
+    Playlists come from the first configured of: the manifest (the contents of
+    ``PLAYLIST_MANIFEST_BLOB``), ``MARKET_PLAYLISTS``, ``PLAYLIST_IDS`` and the
+    Global Top 50 playlist. The manifest is either a JSON list whose entries are
+    playlist IDs/URLs or objects with an ``id`` and optional ``market`` key, or
+    like ``MARKET_PLAYLISTS`` a JSON object mapping markets to playlists.
+    
+    Playlists without a market are ingested once per market in ``markets``, or
+    without a market when there are none. Playlists mapped to a market are kept
+    when ``markets`` is empty or contains that market.
+    
+    Args:
+        manifest: Raw manifest document, or None when no manifest is configured
+        markets: Market codes as a list or comma-separated string; defaults to ``MARKETS``
+        
+    Returns:
+        De-duplicated list of (bare playlist ID, market or None), in configuration order
+    """
+    markets = parse_markets(MARKETS if markets is None else markets)
+    if manifest is not None:
+        entries = json.loads(manifest)
+    elif MARKET_PLAYLISTS.strip():
+        entries = json.loads(MARKET_PLAYLISTS)
+    elif PLAYLIST_IDS.strip():
+        entries = PLAYLIST_IDS.split(',')
+    else:
+        entries = [DEFAULT_PLAYLIST_URL]
+    if isinstance(entries, dict):
+        entries = [{'id': playlist, 'market': market} for market, playlist in entries.items()]
+    
+    targets = []
+    for entry in entries:
+        playlist, market = (entry['id'], entry.get('market')) if isinstance(entry, dict) else (entry, None)
+        if not playlist or not playlist.strip():
+            continue
+        playlist_id = parse_playlist_id(playlist)
+        if market:
+            market = market.strip().upper()
+            if not markets or market in markets:
+                targets.append((playlist_id, market))
+        else:
+            targets.extend((playlist_id, market) for market in markets or [None])
+    return list(dict.fromkeys(targets))
+
+
+def load_ingest_targets(container_client=None, markets=None):
+    """Resolve the (playlist, market) pairs to ingest, reading the manifest blob when one is configured"""
+    manifest = None
+    if PLAYLIST_MANIFEST_BLOB and container_client is not None:
+        manifest = container_client.download_blob(PLAYLIST_MANIFEST_BLOB).readall()
+    return resolve_ingest_targets(manifest, markets)
+
+
+def fetch_playlist_page(sp, playlist_id, offset, limit=PLAYLIST_PAGE_SIZE, fields=PLAYLIST_FIELDS, market=None):
+    """Fetch a single page of playlist items starting at the given offset, projected to ``fields``"""
+    return request_scheduler.call(sp.playlist_items, playlist_id, fields=fields, limit=limit, offset=offset,
+                                  market=market)
+
+
+def iter_playlist_pages(sp, playlist_id, max_workers=PAGE_FETCH_CONCURRENCY, timer=None, market=None):
+    """
+    Yield every page of a playlist in offset order.
+    
+    The first page is fetched on its own to learn the playlist's ``total``; the
+    remaining offsets are then fetched concurrently with at most ``max_workers``
+    requests in flight. Pages are still yielded in order, so callers can merge or
+    stream them without re-sorting.
+    
+    Args:
+        sp: Authenticated spotipy client
+        playlist_id: Playlist ID, URI or URL
+        max_workers: Maximum number of concurrent page requests
+        timer: Optional PhaseTimer that receives a ``page_fetch`` sample per page
+        market: Optional market code; tracks are relinked to versions playable there
+        
+    Yields:
+        Raw playlist item pages as returned by the Spotify API
+    """
+    def fetch(offset):
+        started = time.perf_counter()
+        page = fetch_playlist_page(sp, playlist_id, offset, market=market)
+        if timer is not None:
+            timer.sample('page_fetch', (time.perf_counter() - started) * 1000)
+        return page
+    
+    first_page = fetch(0)
+    yield first_page
+    
+    # Step by the page size the API actually applied, in case it caps ``limit`` lower
+    total = first_page.get('total') or 0
+    page_size = first_page.get('limit') or PLAYLIST_PAGE_SIZE
+    offsets = range(page_size, total, page_size)
+    if not offsets:
+        return
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(offsets)))) as executor:
+        yield from executor.map(fetch, offsets)
+
+
+def iter_new_items(pages, since=None, progress=None):
+    """
+    Yield the items of a stream of pages, keeping only those added after ``since``.
+    
+    ``progress`` is updated in place with the number of items retrieved and
+    kept and the newest ``added_at`` seen, so callers can read them once the
+    stream has been consumed.
+    """
+    progress = progress if progress is not None else {}
+    progress.setdefault('retrieved', 0)
+    progress.setdefault('items', 0)
+    progress.setdefault('last_added_at', '')
+    for page in pages:
+        for item in page.get('items', []):
+            added_at = item.get('added_at') or ''
+            progress['retrieved'] += 1
+            progress['last_added_at'] = max(progress['last_added_at'], added_at)
+            if since and added_at <= since:
+                continue
+            progress['items'] += 1
+            yield item
+
+
+def playlist_state_key(playlist_id, market=None):
+    """Key of the per-playlist (and per-market) ingestion state document in the state store"""
+    return f'playlists/{target_key(playlist_id, market)}.json'
+
+
+def fetch_snapshot_id(sp, playlist_id, market=None):
+    """Fetch only the playlist's current snapshot_id, which changes whenever its items do"""
+    return request_scheduler.call(sp.playlist, playlist_id, fields='snapshot_id', market=market)['snapshot_id']
+
+
+def ingest_playlist(sp, container_client, playlist_id, state_store=None, force=False, incremental=False, market=None):
+    """
+    Extract one playlist and upload it as its own raw blob.
+    
+    When a ``state_store`` is given the playlist's ``snapshot_id`` is compared with
+    the one recorded at the last successful ingestion, and the fetch and upload
+    (and therefore the transform) are skipped if it has not changed. The state
+    also keeps a cursor of the newest ``added_at`` seen; in ``incremental`` mode
+    only items added after that cursor are written to the raw blob.
+    
+    With a ``market`` the items are requested for that market and the raw blob
+    and state are kept under a ``market=XX`` partition, so each market of the
+    same playlist is tracked separately.
+    
+    Time spent per phase (snapshot check, page fetches, serialization, upload
+    and state update) is reported under ``timings`` in the summary and handed
+    to the configured metrics exporter.
+    
+    Errors are caught and reported in the returned summary so that one failing
+    playlist does not abort the rest of a fan-out run.
+    
+    Args:
+        sp: Authenticated spotipy client
+        container_client: Container client for the raw container
+        playlist_id: Bare playlist ID
+        state_store: Store holding per-playlist ingestion state, or None to always ingest
+        force: Ingest even if the snapshot is unchanged
+        incremental: Only keep items added since the stored cursor (requires ``state_store``)
+        market: Optional ISO 3166-1 alpha-2 market code
+        
+    Returns:
+        Summary dict with the playlist's status, blob path, item count and timing
+    """
+    started = time.perf_counter()
+    summary = {'playlist_id': playlist_id, 'status': 'succeeded'}
+    if market:
+        summary['market'] = market
+    timer = PhaseTimer()
+    try:
+        _ingest_playlist(sp, container_client, playlist_id, summary, timer, state_store, force, incremental, market)
+    except Exception as e:
+        logging.error(f"Failed to ingest playlist {target_key(playlist_id, market)}: {str(e)}")
+        reset_clients_after_error(e)
+        summary['status'] = 'failed'
+        summary['error'] = str(e)
+    summary['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    summary['timings'] = timer.summary()
+    export_metrics(
+        timer.metrics() + [('duration_ms', summary['duration_ms']), ('items', summary.get('items', 0)),
+                           ('bytes', summary.get('bytes', 0))],
+        operation='ingest_playlist', playlist_id=playlist_id, market=market or '', status=summary['status']
+    )
+    return summary
+
+
+def _ingest_playlist(sp, container_client, playlist_id, summary, timer, state_store, force, incremental, market):
+    # Body of ingest_playlist; fills in ``summary`` and returns early when there is nothing to upload
+    key = target_key(playlist_id, market)
+    state = None
+    if state_store is not None:
+        with timer.phase('snapshot'):
+            snapshot_id = fetch_snapshot_id(sp, playlist_id, market)
+            state = state_store.read(playlist_state_key(playlist_id, market)) or {}
+        summary['snapshot_id'] = snapshot_id
+        if not force and state.get('snapshot_id') == snapshot_id:
+            logging.info(f"Playlist {key} unchanged since {state.get('ingested_at')}, skipping")
+            summary['status'] = 'unchanged'
+            return
+    
+    # Pages are serialized and uploaded as they arrive, so the upload overlaps
+    # with fetching and the whole payload never has to be held in memory
+    pages = iter_playlist_pages(sp, playlist_id, timer=timer, market=market)
+    with timer.phase('fetch'):
+        first_page = next(pages)
+    header = {key: value for key, value in first_page.items() if key != 'items'}
+    header.update(offset=0, next=None)
+    if market:
+        header['market'] = market
+    
+    # added_at values are ISO 8601 UTC timestamps, so they compare as strings
+    since = state.get('last_added_at') if state is not None and incremental else None
+    if state is not None:
+        header['snapshot_id'] = summary['snapshot_id']
+    if since:
+        header['incremental_since'] = since
+    progress = {'last_added_at': (state or {}).get('last_added_at') or ''}
+    
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    partition = f'market={market}/' if market else ''
+    blob_path = f"to_be_processed/{partition}{raw_blob_name(f'spotify_raw_{playlist_id}_{timestamp}')}"
+    upload = StagedBlockUpload(
+        container_client.get_blob_client(blob_path),
+        content_settings=ContentSettings(**raw_content_settings())
+    )
+    try:
+        # Compact, compressed JSON; the transform detects the compression on read.
+        # Waiting for pages counts as fetch, blocking on block uploads as upload
+        # and the rest of the stream as serialization.
+        with timer.remainder('serialize', 'fetch', 'upload'):
+            items = iter_new_items(timed_iter(chain([first_page], pages), timer, 'fetch'), since, progress)
+            write_raw_stream(TimedWriter(upload, timer, 'upload'), header, items)
+    except BaseException:
+        upload.abort()
+        raise
+    if progress['retrieved'] != header.get('total'):
+        logging.warning(f"Playlist {key} reported {header.get('total')} items but {progress['retrieved']} were retrieved")
+    
+    last_added_at = progress['last_added_at'] or None
+    if since and not progress['items']:
+        upload.abort()
+        logging.info(f"Playlist {key} has no items added since {since}, skipping upload")
+        state.update({'snapshot_id': summary['snapshot_id'], 'last_added_at': last_added_at})
+        with timer.phase('state'):
+            state_store.write(playlist_state_key(playlist_id, market), state)
+        summary['status'] = 'unchanged'
+        return
+    # Nothing is visible in the container until the block list is committed
+    with timer.phase('upload'):
+        summary['bytes'] = upload.commit()
+    summary['items'] = progress['items']
+    
+    summary['blob_path'] = blob_path
+    logging.info(f"Successfully uploaded {summary['items']} items of playlist {key} to {blob_path}")
+    
+    # Record the snapshot only once its data is safely stored
+    if state is not None:
+        state.update({
+            'snapshot_id': summary['snapshot_id'],
+            'last_added_at': last_added_at,
+            'ingested_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'blob_path': blob_path,
+        })
+        with timer.phase('state'):
+            state_store.write(playlist_state_key(playlist_id, market), state)
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution within this process.
+    
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for and share its result (or exception).
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+    
+    def do(self, key, fn):
+        """Run ``fn`` for ``key`` unless already in flight; returns (result, shared)"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of ``SingleFlight`` for coroutines running on one event loop"""
+    
+    def __init__(self):
+        self._calls = {}
+    
+    async def do(self, key, fn):
+        """Await ``fn()`` for ``key`` unless already in flight; returns (result, shared)"""
+        task = self._calls.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+        
+        task = self._calls[key] = asyncio.ensure_future(fn())
+        try:
+            return await asyncio.shield(task), False
+        finally:
+            self._calls.pop(key, None)
+
+
+def playlist_lease_blob(playlist_id, market=None):
+    """Name of the blob whose lease marks an ingestion of the playlist (in a market) in progress"""
+    return f'{STATE_PREFIX}/locks/{target_key(playlist_id, market)}.lock'
+
+
+class PlaylistLease:
+    """
+    Short blob lease held while one instance ingests a playlist.
+    
+    The lease lasts ``INGEST_LEASE_SECONDS`` and is renewed in the background at
+    half that interval, so long ingestions keep it while a crashed instance
+    releases it within one lease period.
+    """
+    
+    def __init__(self, container_client, playlist_id, duration=INGEST_LEASE_SECONDS, market=None):
+        self.blob_client = container_client.get_blob_client(playlist_lease_blob(playlist_id, market))
+        self.duration = duration
+        self.lease = None
+        self._stop = threading.Event()
+        self._renewer = None
+    
+    def acquire(self):
+        """Try to take the lease; returns False if another instance holds it"""
+        try:
+            self.blob_client.upload_blob(b'', overwrite=False)
+        except ResourceExistsError:
+            pass
+        try:
+            self.lease = self.blob_client.acquire_lease(lease_duration=self.duration)
+        except HttpResponseError as e:
+            if e.status_code == 409:
+                return False
+            raise
+        self._renewer = threading.Thread(target=self._renew, daemon=True)
+        self._renewer.start()
+        return True
+    
+    def _renew(self):
+        while not self._stop.wait(self.duration / 2):
+            try:
+                self.lease.renew()
+            except Exception as e:
+                logging.warning(f"Could not renew ingestion lease on {self.blob_client.blob_name}: {str(e)}")
+                return
+    
+    def release(self):
+        """Stop renewing and release the lease if it is held"""
+        self._stop.set()
+        if self.lease is not None:
+            try:
+                self.lease.release()
+            except Exception as e:
+                logging.warning(f"Could not release ingestion lease on {self.blob_client.blob_name}: {str(e)}")
+            self.lease = None
+
+
+# Shared by every ingestion run on this instance
+single_flight = SingleFlight()
+
+
+def ingest_playlist_coalesced(sp, container_client, playlist_id, market=None, **kwargs):
+    """
+    Run ``ingest_playlist`` unless the same playlist (and market) is already being ingested.
+    
+    Concurrent calls on this instance share one run and get its summary marked
+    ``coalesced``. Across instances, the run first takes a short blob lease; if
+    another instance holds it the playlist is reported with status ``coalesced``
+    and nothing is fetched or written. A lease that cannot be taken for any other
+    reason does not block ingestion.
+    
+    Args:
+        sp: Authenticated spotipy client
+        container_client: Container client for the raw container
+        playlist_id: Bare playlist ID
+        market: Optional market code; each market of a playlist is coalesced separately
+        **kwargs: Passed through to ``ingest_playlist``
+        
+    Returns:
+        Summary dict as returned by ``ingest_playlist``
+    """
+    key = target_key(playlist_id, market)
+    
+    def run():
+        lease = None
+        try:
+            if COALESCE_ACROSS_INSTANCES:
+                lease = PlaylistLease(container_client, playlist_id, market=market)
+            if lease is not None and not lease.acquire():
+                logging.info(f"Playlist {key} is being ingested by another instance, skipping")
+                summary = {'playlist_id': playlist_id, 'status': 'coalesced', 'duration_ms': 0.0}
+                if market:
+                    summary['market'] = market
+                return summary
+        except Exception as e:
+            logging.warning(f"Could not take ingestion lease for playlist {key}, ingesting anyway: {str(e)}")
+            lease = None
+        try:
+            return ingest_playlist(sp, container_client, playlist_id, market=market, **kwargs)
+        finally:
+            if lease is not None:
+                lease.release()
+    
+    summary, shared = single_flight.do(key, run)
+    if shared:
+        summary = {**summary, 'coalesced': True}
+    return summary
+
+
+def as_target(target):
+    """Normalize a bare playlist ID or a (playlist ID, market) pair to a pair"""
+    return (target, None) if isinstance(target, str) else tuple(target)
+
+
+def ingest_playlists(sp, container_client, targets, state_store=None, force=False, incremental=False,
+                     max_workers=PLAYLIST_CONCURRENCY):
+    """
+    Ingest several playlists concurrently, sharing one Spotify and one Blob client.
+    
+    Each playlist goes through ``ingest_playlist_coalesced``, so runs that overlap
+    with another request or instance for the same playlist are not duplicated.
+    Per-market runs of chart playlists are just more targets: they share the
+    client's access token, connection pool and request scheduler.
+    
+    Args:
+        sp: Authenticated spotipy client
+        container_client: Container client for the raw container
+        targets: Bare playlist IDs or (playlist ID, market) pairs to ingest
+        state_store: Store holding per-playlist ingestion state, or None to always ingest
+        force: Ingest even if a playlist's snapshot is unchanged
+        incremental: Only keep items added since each playlist's stored cursor
+        max_workers: Maximum number of playlists ingested at the same time
+        
+    Returns:
+        List of per-playlist summaries in the order of ``targets``
+    """
+    if not targets:
+        return []
+    
+    def ingest(target):
+        playlist_id, market = as_target(target)
+        return ingest_playlist_coalesced(sp, container_client, playlist_id, market=market, state_store=state_store,
+                                         force=force, incremental=incremental)
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as executor:
+        return list(executor.map(ingest, targets))
+
+
+def playlist_slot(playlist_id, slots=INGEST_SPREAD_SLOTS, market=None):
+    """Stable slot in [0, slots) a playlist (market) is ingested in; crc32 rather than hash() so all instances agree"""
+    return zlib.crc32(target_key(playlist_id, market).encode('utf-8')) % max(1, slots)
+
+
+def _cron_field_values(field, low, high):
+    """Values an NCRONTAB field matches: comma-separated ``*``, ``n`` or ``a-b``, each with an optional ``/step``"""
+    values = set()
+    for part in field.split(','):
+        spec, _, step = part.partition('/')
+        if spec == '*':
+            start, end = low, high
+        elif '-' in spec:
+            start, end = (int(value) for value in spec.split('-', 1))
+        else:
+            start = int(spec)
+            end = high if step else start
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+
+def schedule_interval_seconds(schedule=INGEST_SCHEDULE):
+    """
+    Seconds between the ticks of an NCRONTAB schedule (``{second} {minute} {hour} {day} {month} {day-of-week}``).
+    
+    Spreading playlists over ticks needs ticks that are evenly spaced and
+    repeat every day, so the day, month and day-of-week fields must be ``*``.
+    
+    Raises:
+        ValueError: When the schedule does not fire at a fixed interval
+    """
+    fields = schedule.split()
+    if len(fields) != 6 or fields[3:] != ['*', '*', '*']:
+        raise ValueError(f"Schedule must fire at a fixed interval every day: {schedule!r}")
+    seconds, minutes, hours = (_cron_field_values(field, 0, high) for field, high in zip(fields[:3], (59, 59, 23)))
+    ticks = sorted(hour * 3600 + minute * 60 + second for hour in hours for minute in minutes for second in seconds)
+    gaps = {later - earlier for earlier, later in zip(ticks, ticks[1:] + [ticks[0] + 86400])}
+    if len(gaps) != 1:
+        raise ValueError(f"Schedule must fire at a fixed interval every day: {schedule!r}")
+    return gaps.pop()
+
+
+def scheduled_tick_time(timer):
+    """
+    Time a timer tick was scheduled for, in the schedule's time zone.
+    
+    With ``use_monitor`` the host passes the schedule status recorded after the
+    previous tick, whose ``Next`` is this tick's occurrence, also when the tick
+    runs late or past due. Falls back to the current time before the first
+    recorded tick.
+    """
+    value = (getattr(timer, 'schedule_status', None) or {}).get('Next')
+    if value:
+        try:
+            # .NET writes up to 7 fractional digits; fromisoformat takes at most 6
+            return datetime.fromisoformat(re.sub(r'(\.\d{6})\d+', r'\1', value)).replace(tzinfo=None)
+        except ValueError:
+            logging.warning(f"Could not parse the timer's scheduled time {value!r}, using the current time")
+    return datetime.now()
+
+
+def current_ingest_slot(tick_time=None, schedule=INGEST_SCHEDULE, slots=INGEST_SPREAD_SLOTS):
+    """Slot of the schedule tick at ``tick_time`` (a naive datetime in the schedule's time zone; defaults to now)"""
+    tick_time = datetime.now() if tick_time is None else tick_time
+    elapsed = (tick_time - datetime(1970, 1, 1)).total_seconds()
+    return int(elapsed // schedule_interval_seconds(schedule)) % max(1, slots)
+
+
+def summarize_ingestion(results, duration_ms, timer=None):
+    """
+    Build the JSON summary and HTTP status code for a fan-out ingestion run.
+    
+    Unchanged and coalesced (skipped) playlists count as successful. Returns 200 when no
+    playlist failed, 207 on partial failure and 500 when every playlist failed.
+    
+    ``timings`` holds the run's own phases (e.g. ``auth``) from ``timer`` plus
+    the per-playlist phases summed over all playlists; as playlists run
+    concurrently those sums can exceed ``duration_ms``.
+    
+    Args:
+        results: Per-playlist summaries from ``ingest_playlist``
+        duration_ms: Wall-clock duration of the whole run
+        timer: Optional PhaseTimer with run-level phases
+        
+    Returns:
+        Tuple of (summary dict, HTTP status code)
+    """
+    failed = sum(1 for result in results if result['status'] == 'failed')
+    unchanged = sum(1 for result in results if result['status'] == 'unchanged')
+    coalesced = sum(1 for result in results if result['status'] == 'coalesced')
+    
+    phases = dict(timer.phases) if timer is not None else {}
+    for result in results:
+        for name, value in result.get('timings', {}).get('phases_ms', {}).items():
+            phases[name] = phases.get(name, 0.0) + value
+    summary = {
+        'playlists': len(results),
+        'succeeded': len(results) - failed - unchanged - coalesced,
+        'unchanged': unchanged,
+        'coalesced': coalesced,
+        'failed': failed,
+        'items': sum(result.get('items', 0) for result in results),
+        'bytes': sum(result.get('bytes', 0) for result in results),
+        'duration_ms': round(duration_ms, 1),
+        'timings': {'phases_ms': {name: round(value, 1) for name, value in phases.items()}},
+        'results': results,
+    }
+    
+    if not failed:
+        status_code = 200
+    elif failed < len(results):
+        status_code = 207
+    else:
+        status_code = 500
+    return summary, status_code
+
+
+def export_ingestion_metrics(summary, timer, trigger):
+    """Hand the run-level totals of an ingestion summary to the metrics exporter"""
+    export_metrics(
+        timer.metrics() + [(name, summary[name]) for name in
+                           ('duration_ms', 'playlists', 'succeeded', 'unchanged', 'coalesced', 'failed', 'items', 'bytes')],
+        operation='ingest', trigger=trigger
+    )
+
 
 def register_spotify_ingestion(app):
     """
@@ -29,14 +880,18 @@ def register_spotify_ingestion(app):
         """
         HTTP-triggered Azure Function that extracts data from Spotify API.
         
-        Extracts playlist data from Spotify and uploads raw JSON to Azure Blob Storage
-        in the to_be_processed folder for later transformation.
+        Extracts every configured playlist from Spotify and uploads each one as its
+        own raw JSON blob in the to_be_processed folder for later transformation.
+        Playlists whose snapshot_id has not changed since the last ingestion are
+        skipped unless the request passes ``force=true``. ``markets=US,GB,...``
+        ingests the configured playlists once per market (or picks those
+        markets from ``MARKET_PLAYLISTS``), overriding the ``MARKETS`` setting.
         
         Args:
             req: HTTP request object
             
         Returns:
-            HTTP response indicating success or failure
+            HTTP response with a JSON summary of per-playlist status and timing
         """
         logging.info('Spotify data extraction function triggered via HTTP')
         
@@ -56,11 +911,12 @@ def register_spotify_ingestion(app):
                     status_code=500
                 )
             
-            # Set up Spotify client
+            # Reuse the instance's shared Spotify client; the token is normally served from the cache
+            timer = PhaseTimer()
             try:
-                client_credentials_manager = SpotifyClientCredentials(client_id=CLIENT_ID, client_secret=SECRET_ID)
-                sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
-                logging.info("Successfully connected to Spotify API")
+                sp = get_spotify_client()
+                with timer.phase('auth'):
+                    sp.auth_manager.get_access_token(as_dict=False)
             except Exception as e:
                 logging.error(f"Failed to initialize Spotify client: {str(e)}")
                 return func.HttpResponse(
@@ -68,51 +924,31 @@ def register_spotify_ingestion(app):
                     status_code=500
                 )
             
-            # Use a reliable playlist ID - Global Top 50
+            # Set up the Blob Storage client and resolve the playlists to ingest
             try:
-                top50_playlist_url = "https://open.spotify.com/playlist/6UeSakyzhiEt4NB3UAd6NQ"
-                data = sp.playlist_tracks(top50_playlist_url)
-                logging.info(f"Successfully retrieved playlist data with {len(data.get('items', []))} tracks")
+                container_client = get_blob_service_client().get_container_client(CONTAINER_NAME)
+                with timer.phase('resolve'):
+                    targets = load_ingest_targets(container_client, req.params.get('markets'))
+                logging.info(f"Ingesting {len(targets)} playlist(s)")
             except Exception as e:
-                logging.error(f"Failed to retrieve playlist data: {str(e)}")
+                logging.error(f"Failed to resolve playlists to ingest: {str(e)}")
+                reset_clients_after_error(e)
                 return func.HttpResponse(
-                    f"Error retrieving playlist data: {str(e)}",
+                    f"Error loading playlist configuration: {str(e)}",
                     status_code=500
                 )
             
-            # Upload data to Azure Blob Storage
-            try:
-                # Create the BlobServiceClient
-                blob_service_client = BlobServiceClient.from_connection_string(STORAGE_CONNECTION_STRING)
-                
-                # Get container client
-                container_client = blob_service_client.get_container_client(CONTAINER_NAME)
-                
-                # Create the blob name (path)
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                file_name = f'spotify_raw_{timestamp}.json'
-                blob_path = f'to_be_processed/{file_name}'
-                
-                # Get the blob client
-                blob_client = container_client.get_blob_client(blob_path)
-                
-                # Upload data - ensure proper JSON serialization
-                json_data = json.dumps(data, indent=2)
-                blob_client.upload_blob(json_data, overwrite=True)
-                
-                logging.info(f"Successfully uploaded data to {blob_path}")
-            except Exception as e:
-                logging.error(f"Failed to upload data to Azure Blob Storage: {str(e)}")
-                return func.HttpResponse(
-                    f"Error uploading data to storage: {str(e)}",
-                    status_code=500
-                )
+            # Fan out over the playlists, each producing its own raw blob
+            force = req.params.get('force', '').lower() in ('1', 'true', 'yes')
+            started = time.perf_counter()
+            results = ingest_playlists(sp, container_client, targets, state_store=get_state_store(), force=force)
+            summary, status_code = summarize_ingestion(results, (time.perf_counter() - started) * 1000, timer)
+            export_ingestion_metrics(summary, timer, 'http')
             
-            # Return success response
             return func.HttpResponse(
-                body=f"Data successfully uploaded to {blob_path}",
-                mimetype="text/plain",
-                status_code=200
+                body=json.dumps(summary),
+                mimetype="application/json",
+                status_code=status_code
             )
         except Exception as e:
             error_message = str(e)
@@ -121,4 +957,69 @@ def register_spotify_ingestion(app):
                 body=f"Error processing request: {error_message}",
                 mimetype="text/plain",
                 status_code=500
-            )
\ No newline at end of file
+            )
+
+
+def register_spotify_scheduled_ingestion(app):
+    """
+    Register the timer-triggered Spotify ingestion function with the Azure Functions app.
+    
+    When ``INGEST_SCHEDULE`` does not fire at a fixed interval, playlists cannot
+    be spread over its ticks; the error is logged and every playlist is
+    ingested on every tick instead.
+    
+    Args:
+        app: The Azure Functions app instance
+    """
+    try:
+        schedule_interval_seconds(INGEST_SCHEDULE)
+        spread_slots = INGEST_SPREAD_SLOTS
+    except ValueError as e:
+        logging.error(f"{str(e)}; ignoring INGEST_SPREAD_SLOTS and ingesting every playlist on every tick")
+        spread_slots = 1
+    
+    @app.timer_trigger(schedule=INGEST_SCHEDULE, arg_name="timer", run_on_startup=False, use_monitor=True)
+    def spotify_timer_trigger(timer: func.TimerRequest) -> None:
+        """
+        Timer-triggered Azure Function that ingests playlists incrementally.
+        
+        Playlists are spread over ``INGEST_SPREAD_SLOTS`` consecutive ticks by a
+        stable hash of their ID, so each tick only handles its share instead of
+        every playlist firing at the top of the hour. Each due playlist is skipped
+        when its snapshot is unchanged, and otherwise only the items added since
+        its cursor are written.
+        
+        Args:
+            timer: Timer request object
+        """
+        if timer.past_due:
+            logging.warning('Scheduled Spotify ingestion is running late')
+        
+        if not CLIENT_ID or not SECRET_ID or not STORAGE_CONNECTION_STRING:
+            logging.error("Missing Spotify API credentials or Azure Storage connection string")
+            return
+        
+        try:
+            phase_timer = PhaseTimer()
+            sp = get_spotify_client()
+            with phase_timer.phase('auth'):
+                sp.auth_manager.get_access_token(as_dict=False)
+            container_client = get_blob_service_client().get_container_client(CONTAINER_NAME)
+            with phase_timer.phase('resolve'):
+                targets = load_ingest_targets(container_client)
+            
+            # The tick's scheduled time rather than the clock, so late and past-due ticks keep their slot
+            slot = current_ingest_slot(scheduled_tick_time(timer), slots=spread_slots) if spread_slots > 1 else 0
+            due = [(playlist_id, market) for playlist_id, market in targets
+                   if playlist_slot(playlist_id, slots=spread_slots, market=market) == slot]
+            logging.info(f"Scheduled ingestion slot {slot}/{spread_slots}: {len(due)} of {len(targets)} playlist(s) due")
+            
+            started = time.perf_counter()
+            results = ingest_playlists(sp, container_client, due, state_store=get_state_store(), incremental=True)
+            summary, _ = summarize_ingestion(results, (time.perf_counter() - started) * 1000, phase_timer)
+            export_ingestion_metrics(summary, phase_timer, 'timer')
+            logging.info(f"Scheduled ingestion finished: {json.dumps(summary)}")
+        except Exception as e:
+            logging.error(f"Unexpected error in scheduled Spotify ingestion: {str(e)}")
+            reset_clients_after_error(e)
+            raise
@@ -0,0 +1,218 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    from opentelemetry import metrics as otel_metrics
+except ImportError:  # OpenTelemetry is optional; metrics are logged by default
+    otel_metrics = None
+
+# Where per-playlist and per-run metrics go: log, jsonl, opentelemetry or none
+METRICS_EXPORTER = os.environ.get('METRICS_EXPORTER', 'log').lower()
+METRICS_FILE = os.environ.get('METRICS_FILE', os.path.join(tempfile.gettempdir(), 'spotify_etl_metrics.jsonl'))
+METRICS_NAMESPACE = 'spotify_etl'
+
+
+class PhaseTimer:
+    """
+    Accumulates wall-clock time per phase of an ingestion, plus individual samples.
+
+    Phases may be entered several times (e.g. ``upload`` while streaming and
+    again on commit); their durations add up. Samples keep every observation,
+    such as the duration of each page fetch. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block and add it to phase ``name``"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - started) * 1000)
+
+    @contextmanager
+    def remainder(self, name, *others):
+        """Time the enclosed block and add to ``name`` only the part not spent in phases ``others``"""
+        before = sum(self.phases.get(other, 0.0) for other in others)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            during = sum(self.phases.get(other, 0.0) for other in others) - before
+            self.add(name, max((time.perf_counter() - started) * 1000 - during, 0.0))
+
+    def add(self, name, duration_ms):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + duration_ms
+
+    def sample(self, name, value):
+        with self._lock:
+            self.samples.setdefault(name, []).append(value)
+
+    def summary(self):
+        """Machine-readable timings: rounded phase totals and count/total/max per sample series"""
+        with self._lock:
+            summary = {'phases_ms': {name: round(value, 1) for name, value in self.phases.items()}}
+            for name, values in self.samples.items():
+                summary[name] = {
+                    'count': len(values),
+                    'total_ms': round(sum(values), 1),
+                    'max_ms': round(max(values), 1),
+                }
+            return summary
+
+    def metrics(self):
+        """Flatten into (name, value) samples for an exporter"""
+        with self._lock:
+            flattened = [(f'phase_{name}_ms', value) for name, value in self.phases.items()]
+            flattened += [(f'{name}_ms', value) for name, values in self.samples.items() for value in values]
+            return flattened
+
+
+class TimedWriter:
+    """Binary writer that adds the time spent in ``write`` on the wrapped stream to a phase"""
+
+    def __init__(self, fileobj, timer, phase):
+        self.fileobj = fileobj
+        self.timer = timer
+        self.phase = phase
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        with self.timer.phase(self.phase):
+            return self.fileobj.write(data)
+
+    def flush(self):
+        pass
+
+
+def timed_iter(iterable, timer, phase):
+    """Yield from ``iterable``, adding the time spent waiting for each element to a phase"""
+    iterator = iter(iterable)
+    while True:
+        with timer.phase(phase):
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+        yield value
+
+
+class LogExporter:
+    """Writes one structured log line per export; repeated samples are reduced to count/sum/max"""
+
+    def export(self, samples, dimensions):
+        values = {}
+        for name, value in samples:
+            values.setdefault(name, []).append(value)
+        record = {
+            name: round(series[0], 1) if len(series) == 1
+            else {'count': len(series), 'sum': round(sum(series), 1), 'max': round(max(series), 1)}
+            for name, series in values.items()
+        }
+        logging.info(f"{METRICS_NAMESPACE} metrics {json.dumps({**dimensions, **record})}")
+
+
+class JsonLinesExporter:
+    """Appends one JSON line per export to ``METRICS_FILE``, e.g. for local runs and benchmarks"""
+
+    def __init__(self, path=METRICS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, samples, dimensions):
+        values = {}
+        for name, value in samples:
+            values.setdefault(name, []).append(round(value, 3))
+        line = json.dumps({'timestamp': datetime.utcnow().isoformat(timespec='milliseconds') + 'Z',
+                           'dimensions': dimensions, 'metrics': values})
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+class OpenTelemetryExporter:
+    """
+    Records every sample on an OpenTelemetry histogram named ``spotify_etl.<name>``.
+
+    The meter provider is whatever the app configured, e.g. with
+    ``azure-monitor-opentelemetry`` the samples become Application Insights
+    custom metrics.
+    """
+
+    def __init__(self):
+        if otel_metrics is None:
+            raise RuntimeError("The opentelemetry-api package is not installed")
+        self.meter = otel_metrics.get_meter(METRICS_NAMESPACE)
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, name):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = self.meter.create_histogram(f'{METRICS_NAMESPACE}.{name}')
+            return self.histograms[name]
+
+    def export(self, samples, dimensions):
+        attributes = {key: str(value) for key, value in dimensions.items()}
+        for name, value in samples:
+            self._histogram(name).record(value, attributes=attributes)
+
+
+class NullExporter:
+    def export(self, samples, dimensions):
+        pass
+
+
+METRICS_EXPORTERS = {
+    'log': LogExporter,
+    'jsonl': JsonLinesExporter,
+    'opentelemetry': OpenTelemetryExporter,
+    'none': NullExporter,
+}
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def register_metrics_exporter(name, factory):
+    """Make a custom exporter selectable with ``METRICS_EXPORTER=<name>``; ``factory()`` returns an object with ``export(samples, dimensions)``"""
+    METRICS_EXPORTERS[name.lower()] = factory
+
+
+def get_metrics_exporter():
+    """Return the exporter selected by ``METRICS_EXPORTER``, falling back to logging if it cannot be created"""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            try:
+                _exporter = METRICS_EXPORTERS[METRICS_EXPORTER]()
+            except Exception as e:
+                logging.warning(f"Could not create metrics exporter {METRICS_EXPORTER!r}, logging metrics instead: {str(e)}")
+                _exporter = LogExporter()
+        return _exporter
+
+
+def export_metrics(samples, **dimensions):
+    """
+    Hand (name, value) samples to the configured exporter.
+
+    Exporter failures are logged and swallowed so that metrics never fail an
+    ingestion.
+    """
+    try:
+        get_metrics_exporter().export(list(samples), dimensions)
+    except Exception as e:
+        logging.warning(f"Could not export metrics: {str(e)}")
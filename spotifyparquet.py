@@ -0,0 +1,103 @@
+import os
+import logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; without it tables are only written as CSV
+    pa = None
+    pq = None
+
+# Compression of Parquet outputs: zstd, snappy, gzip or none
+PARQUET_COMPRESSION = os.environ.get('PARQUET_COMPRESSION', 'zstd').lower()
+# Rows per Parquet row group; every row group carries min/max/null-count statistics per column
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get('PARQUET_ROW_GROUP_SIZE', 128 * 1024))
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+
+
+def _table_fields():
+    """Arrow types of every column a transformed table can have, including enrichment columns"""
+    timestamp = pa.timestamp('us', tz='UTC')
+    return {
+        'song': {
+            'song_id': pa.string(), 'name': pa.string(), 'duration_ms': pa.int32(), 'url': pa.string(),
+            'popularity': pa.int16(), 'added_date': timestamp, 'album_id': pa.string(), 'artist_id': pa.string(),
+        },
+        'album': {
+            'album_id': pa.string(), 'name': pa.string(), 'release_date': pa.date32(), 'total_tracks': pa.int16(),
+            'url': pa.string(), 'label': pa.string(), 'popularity': pa.int16(), 'genres': pa.string(),
+            'release_date_precision': pa.string(),
+        },
+        'artist': {
+            'artist_id': pa.string(), 'name': pa.string(), 'url': pa.string(), 'genres': pa.string(),
+            'followers': pa.int64(), 'popularity': pa.int16(),
+        },
+        'song_features': {
+            'song_id': pa.string(), 'danceability': pa.float64(), 'energy': pa.float64(), 'key': pa.int8(),
+            'loudness': pa.float64(), 'mode': pa.int8(), 'speechiness': pa.float64(), 'acousticness': pa.float64(),
+            'instrumentalness': pa.float64(), 'liveness': pa.float64(), 'valence': pa.float64(),
+            'tempo': pa.float64(), 'time_signature': pa.int8(),
+        },
+    }
+
+
+_fields = None
+
+
+def table_schema(table, df):
+    """
+    Return the explicit Arrow schema for a transformed table, in the DataFrame's column order.
+
+    Columns without a declared type (e.g. added by a newer transform) fall
+    back to the type Arrow infers, with a warning.
+    """
+    global _fields
+    if _fields is None:
+        _fields = _table_fields()
+    declared = _fields.get(table, {})
+    fields = []
+    for column in df.columns:
+        if column in declared:
+            fields.append(pa.field(column, declared[column]))
+        else:
+            logging.warning(f"No Parquet type declared for {table}.{column}, inferring it")
+            fields.append(pa.Schema.from_pandas(df[[column]], preserve_index=False).field(column))
+    return pa.schema(fields)
+
+
+def to_arrow_table(df, table):
+    """Convert a transformed table to an Arrow table with its explicit schema"""
+    if pa is None:
+        raise RuntimeError("Parquet and Arrow output require the pyarrow package")
+    return pa.Table.from_pandas(df, schema=table_schema(table, df), preserve_index=False)
+
+
+def make_parquet_buffer(df, table, compression=None):
+    """
+    Convert a DataFrame to Parquet bytes for uploading.
+
+    The table's explicit schema keeps dates and timestamps typed and narrows
+    integer columns; strings are dictionary-encoded and every row group
+    records column statistics, so downstream engines can skip row groups and
+    files when filtering.
+
+    Args:
+        df: Transformed table
+        table: Table name (``song``, ``album``, ``artist`` or ``song_features``)
+        compression: zstd, snappy, gzip or none; defaults to ``PARQUET_COMPRESSION``
+
+    Returns:
+        Parquet file content as bytes
+    """
+    compression = (compression or PARQUET_COMPRESSION).lower()
+    arrow_table = to_arrow_table(df, table)
+    buffer = pa.BufferOutputStream()
+    pq.write_table(
+        arrow_table,
+        buffer,
+        compression=None if compression == 'none' else compression,
+        row_group_size=PARQUET_ROW_GROUP_SIZE,
+        use_dictionary=True,
+        write_statistics=True,
+    )
+    return buffer.getvalue().to_pybytes()
@@ -0,0 +1,387 @@
+import os
+import re
+import gzip
+import io
+import json
+from itertools import chain, islice
+
+from spotifycodec import get_json_codec
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip from the stdlib is the default
+    zstandard = None
+
+# Layout of raw playlist blobs: a single JSON document, or NDJSON with a header
+# record followed by one playlist item per line
+RAW_FORMAT = os.environ.get('RAW_FORMAT', 'json').lower()
+# Compression of raw playlist blobs: gzip, zstd or none
+RAW_COMPRESSION = os.environ.get('RAW_COMPRESSION', 'gzip').lower()
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', 3))
+
+# Encoded JSON is handed to the compressor in chunks of about this size
+ENCODE_CHUNK_SIZE = 64 * 1024
+
+RAW_CONTENT_TYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+RAW_EXTENSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+# Raw blob names; the playlist ID is missing from blobs extracted before playlists were ingested separately
+RAW_NAME_PATTERN = re.compile(r'spotify_raw_(?:(?P<playlist_id>.+)_)?(?P<timestamp>\d{14})\.')
+# Marks the first line of an NDJSON raw blob, which holds the playlist metadata
+HEADER_RECORD = 'header'
+
+# NDJSON blobs start with the header record; anything else is a single JSON document
+NDJSON_HEADER_PATTERN = re.compile(rb'\s*\{\s*"_record"\s*:\s*"header"')
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# What may follow a decoded number up to the end of the window if the number continues in the next chunk
+NUMBER_TAIL = re.compile(r'[0-9.eE+\-]*\Z')
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def resolve_format(raw_format=None):
+    """Return the effective raw layout"""
+    raw_format = (raw_format or RAW_FORMAT).lower()
+    if raw_format not in RAW_CONTENT_TYPES:
+        raise ValueError(f"Unsupported raw format: {raw_format}")
+    return raw_format
+
+
+def resolve_compression(compression=None):
+    """Return the effective compression, falling back to gzip when zstd is not installed"""
+    compression = (compression or RAW_COMPRESSION).lower()
+    if compression not in RAW_EXTENSIONS:
+        raise ValueError(f"Unsupported raw compression: {compression}")
+    if compression == 'zstd' and zstandard is None:
+        return 'gzip'
+    return compression
+
+
+def raw_blob_name(stem, compression=None, raw_format=None):
+    """File name for a raw blob, e.g. ``spotify_raw_<id>_<ts>.json.gz`` or ``.ndjson.zst``"""
+    return f'{stem}.{resolve_format(raw_format)}{RAW_EXTENSIONS[resolve_compression(compression)]}'
+
+
+def raw_blob_timestamp(blob_name):
+    """Extraction timestamp from a raw blob name as ``YYYYmmddHHMMSS``, or None for other blobs"""
+    match = RAW_NAME_PATTERN.search(blob_name.rsplit('/', 1)[-1])
+    return match.group('timestamp') if match else None
+
+
+def raw_content_settings(compression=None, raw_format=None):
+    """Content type and encoding for a raw blob, as keyword arguments for ``ContentSettings``"""
+    compression = resolve_compression(compression)
+    return {
+        'content_type': RAW_CONTENT_TYPES[resolve_format(raw_format)],
+        'content_encoding': None if compression == 'none' else compression,
+    }
+
+
+def open_compressed_writer(fileobj, compression=None):
+    """Wrap a binary file object in a writer that compresses everything written to it"""
+    compression = resolve_compression(compression)
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=GZIP_LEVEL, mtime=0)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(fileobj, closefd=False)
+    return _UnclosedWriter(fileobj)
+
+
+class _UnclosedWriter(io.RawIOBase):
+    """Pass-through writer whose close() leaves the underlying file object open"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.fileobj.write(data)
+
+
+def write_json_chunks(writer, chunks):
+    """Write an iterable of encoded JSON chunks (bytes) to a binary writer, batching small chunks"""
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= ENCODE_CHUNK_SIZE:
+            writer.write(b''.join(pending))
+            pending = []
+            pending_size = 0
+    if pending:
+        writer.write(b''.join(pending))
+
+
+def iter_ndjson_lines(header, items):
+    """Yield the NDJSON lines of a raw payload: the header record, then one line per item"""
+    dumps = get_json_codec().dumps
+    yield dumps({'_record': HEADER_RECORD, **header}) + b'\n'
+    for item in items:
+        yield dumps(item) + b'\n'
+
+
+def iter_json_document(header, items):
+    """Yield a single JSON document with the header fields followed by an ``items`` array"""
+    dumps = get_json_codec().dumps
+    head = dumps(header)[:-1]
+    yield head + (b',"items":[' if header else b'"items":[')
+    # Items are encoded one by one, each in a single call to the codec
+    for index, item in enumerate(items):
+        yield (b',' if index else b'') + dumps(item)
+    yield b']}'
+
+
+def write_raw_stream(fileobj, header, items, compression=None, raw_format=None):
+    """
+    Serialize a raw playlist payload into a binary file object as it is produced.
+
+    ``items`` may be any iterable, e.g. a generator fed by page fetches, so the
+    payload is encoded, compressed and written while it is still being fetched.
+
+    Args:
+        fileobj: Binary file object to write to; it is left open
+        header: Playlist metadata (everything but ``items``)
+        items: Iterable of playlist items
+        compression: gzip, zstd or none; defaults to ``RAW_COMPRESSION``
+        raw_format: json or ndjson; defaults to ``RAW_FORMAT``
+    """
+    if resolve_format(raw_format) == 'ndjson':
+        chunks = iter_ndjson_lines(header, items)
+    else:
+        chunks = iter_json_document(header, items)
+    with open_compressed_writer(fileobj, compression) as writer:
+        write_json_chunks(writer, chunks)
+
+
+def encode_raw_payload(data, compression=None, raw_format=None):
+    """
+    Serialize a raw playlist payload as compact, compressed JSON or NDJSON.
+
+    The document is encoded incrementally and fed to the compressor chunk by
+    chunk, so the full uncompressed text never exists in memory at once.
+
+    Args:
+        data: Raw playlist payload
+        compression: gzip, zstd or none; defaults to ``RAW_COMPRESSION``
+        raw_format: json or ndjson; defaults to ``RAW_FORMAT``
+
+    Returns:
+        Encoded bytes
+    """
+    header = {key: value for key, value in data.items() if key != 'items'}
+    buffer = io.BytesIO()
+    write_raw_stream(buffer, header, data.get('items', []), compression, raw_format)
+    return buffer.getvalue()
+
+
+class _PrefixedReader(io.RawIOBase):
+    """Raw reader that replays already-consumed leading bytes before the rest of a stream"""
+
+    def __init__(self, prefix, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = 0
+        if self.prefix:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+        # Fill the rest of the buffer too, so the first read returns more than the replayed prefix
+        data = self.fileobj.read(len(buffer) - size) if size < len(buffer) else b''
+        buffer[size:size + len(data)] = data
+        return size + len(data)
+
+
+class ChunkedReader(io.RawIOBase):
+    """Raw reader over an iterable of byte chunks, e.g. ``StorageStreamDownloader.chunks()``"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b''
+                return 0
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def open_raw_stream(fileobj):
+    """
+    Return a buffered binary reader over the decompressed content of a raw blob stream.
+
+    The compression is detected from the first bytes, which are replayed to the
+    decompressor, so ``fileobj`` only needs a ``read(size)`` method (e.g. the
+    blob trigger's ``InputStream``).
+    """
+    prefix = fileobj.read(4)
+    stream = io.BufferedReader(_PrefixedReader(prefix, fileobj), buffer_size=ENCODE_CHUNK_SIZE)
+    if prefix[:2] == GZIP_MAGIC:
+        return io.BufferedReader(gzip.GzipFile(fileobj=stream, mode='rb'), buffer_size=ENCODE_CHUNK_SIZE)
+    if prefix[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError("Raw blob is zstd-compressed but the zstandard package is not installed")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream), buffer_size=ENCODE_CHUNK_SIZE)
+    return stream
+
+
+class JsonStreamScanner:
+    """
+    Reads JSON values one at a time from a text stream.
+
+    Only a window of about ``ENCODE_CHUNK_SIZE`` characters beyond the value
+    being decoded is held in memory. Each value is decoded with the C-accelerated
+    ``JSONDecoder.raw_decode``; when a value runs past the end of the window,
+    more text is read and the value is decoded again.
+    """
+
+    def __init__(self, text_stream, read_size=ENCODE_CHUNK_SIZE):
+        self.stream = text_stream
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Append the next chunk to the window, dropping what was consumed; False at the end of the stream"""
+        chunk = '' if self.eof else self.stream.read(self.read_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at the end of the stream"""
+        while True:
+            self.pos = JSON_WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of ``chars``, and return it"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Invalid raw JSON document: expected one of {chars!r}, found {char or 'end of data'!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode and consume the next JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number cut by the window's end (e.g. ``1.`` of ``1.25``) decodes as a shorter
+            # number; read on whenever nothing but number characters follow it
+            if (isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and NUMBER_TAIL.match(self.buffer, end) and self._fill()):
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_document_items(scanner, header):
+    """Yield the elements of a document's top-level ``items`` array, collecting its other keys into ``header``"""
+    scanner.expect('{')
+    if scanner.peek() == '}':
+        return
+    while True:
+        key = scanner.value()
+        scanner.expect(':')
+        if key == 'items' and scanner.peek() == '[':
+            scanner.expect('[')
+            if scanner.peek() == ']':
+                scanner.expect(']')
+            else:
+                while True:
+                    yield scanner.value()
+                    if scanner.expect(',]') == ']':
+                        break
+        else:
+            header[key] = scanner.value()
+        if scanner.expect(',}') == '}':
+            return
+
+
+def _read_document_header(scanner, header):
+    """Collect top-level keys into ``header`` up to the ``items`` array; return an iterator over the rest"""
+    items = _iter_document_items(scanner, header)
+    # Advance to the first item (or the end) so keys written before items are in the header
+    for first in items:
+        return chain([first], items)
+    return iter(())
+
+
+def _iter_ndjson_items(stream, start, stop, loads):
+    for index, line in enumerate(stream):
+        if stop is not None and index >= stop:
+            break
+        if index >= start and line.strip():
+            yield loads(line)
+
+
+def read_raw(fileobj, start=0, stop=None, schema=None):
+    """
+    Open a raw blob stream and return its playlist metadata and an iterator over its items.
+
+    Both layouts are parsed incrementally, so peak memory is bounded by a read
+    window and the item being decoded rather than by the blob size. NDJSON
+    blobs are read line by line. Single-document JSON blobs are scanned value
+    by value: the top-level keys are collected into the metadata and the
+    elements of ``items`` are decoded one at a time as the iterator is
+    consumed. Keys that come after ``items`` in a document (as in legacy blobs
+    holding an unmodified API response) are only added to the metadata once
+    the items have been consumed.
+
+    ``start`` and ``stop`` select a range of items (by position, as for
+    ``range``); with NDJSON the lines outside the range are skipped without
+    being parsed, which lets large backfills split a blob into line ranges.
+
+    NDJSON lines are decoded with the codec selected by ``JSON_CODEC``. With
+    msgspec and a ``schema`` (a TypedDict such as
+    ``spotifycodec.PlaylistItemFields``) only the declared fields are decoded.
+
+    Args:
+        fileobj: Binary stream of the (possibly compressed) raw blob
+        start: Index of the first item to return
+        stop: Index after the last item to return, or None for all
+        schema: Optional TypedDict of the item fields the caller reads
+
+    Returns:
+        Tuple of (metadata dict without ``items``, iterator over the selected items)
+    """
+    stream = open_raw_stream(fileobj)
+    if NDJSON_HEADER_PATTERN.match(stream.peek(64)):
+        header = get_json_codec().loads(stream.readline())
+        header.pop('_record')
+        return header, _iter_ndjson_items(stream, start, stop, get_json_codec().decoder(schema))
+
+    header = {}
+    scanner = JsonStreamScanner(io.TextIOWrapper(stream, encoding='utf-8'))
+    items = _read_document_header(scanner, header)
+    return header, islice(items, start, stop)
@@ -0,0 +1,364 @@
+import os
+import io
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import ContentSettings
+
+from spotifyclients import get_blob_service_client
+from spotifymetrics import export_metrics
+from spotifyparquet import PARQUET_COMPRESSION, PARQUET_CONTENT_TYPE, make_parquet_buffer, pa, to_arrow_table
+from spotifyraw import RAW_EXTENSIONS, open_compressed_writer, resolve_compression
+
+# Folder the transformed <table>_data folders are written under
+TRANSFORMED_PREFIX = 'transformed_data'
+# Formats every transformed table is written in, comma-separated: csv, jsonl, parquet, arrow
+OUTPUT_FORMATS = os.environ.get('OUTPUT_FORMATS', 'csv')
+# JSON object overriding OUTPUT_FORMATS per table, e.g. {"song": "csv,parquet", "album": "parquet"}
+TABLE_OUTPUT_FORMATS = os.environ.get('TABLE_OUTPUT_FORMATS')
+# JSON object of sink lists per table ("*" for tables not listed), taking precedence over the two settings above,
+# e.g. {"song": [{"format": "parquet", "partitioning": "date", "container": "curated"}], "*": ["csv"]}
+OUTPUT_SINKS = os.environ.get('OUTPUT_SINKS')
+# Outputs of one transform uploaded at the same time
+SINK_UPLOAD_CONCURRENCY = int(os.environ.get('SINK_UPLOAD_CONCURRENCY', 4))
+
+TABLES = ('song', 'album', 'artist', 'song_features')
+PARTITIONINGS = ('source', 'date')
+RAW_NAME_PREFIX = 'spotify_raw_'
+
+
+def _compress(compression, write):
+    """Run ``write(writer)`` against a compressing writer and return the compressed bytes"""
+    buffer = io.BytesIO()
+    with open_compressed_writer(buffer, compression) as writer:
+        write(writer)
+    return buffer.getvalue()
+
+
+class CsvFormat:
+    """UTF-8 CSV with a header row, optionally gzip or zstd compressed"""
+
+    name = 'csv'
+    extension = 'csv'
+    content_type = 'text/csv'
+    compressions = ('none', 'gzip', 'zstd')
+    # Compression wraps the whole file and adds .gz/.zst to the name
+    streamed = True
+
+    def default_compression(self):
+        return 'none'
+
+    def encode(self, df, table, compression):
+        return _compress(compression, lambda writer: writer.write(df.to_csv(index=False).encode('utf-8')))
+
+
+class JsonLinesFormat:
+    """One JSON object per row, with ISO 8601 dates, optionally gzip or zstd compressed"""
+
+    name = 'jsonl'
+    extension = 'jsonl'
+    content_type = 'application/x-ndjson'
+    compressions = ('none', 'gzip', 'zstd')
+    streamed = True
+
+    def default_compression(self):
+        return 'none'
+
+    def encode(self, df, table, compression):
+        content = df.to_json(orient='records', lines=True, date_format='iso', force_ascii=False)
+        return _compress(compression, lambda writer: writer.write(content.encode('utf-8')))
+
+
+class ParquetFormat:
+    """Parquet with the table's explicit schema; compression applies to the column chunks"""
+
+    name = 'parquet'
+    extension = 'parquet'
+    content_type = PARQUET_CONTENT_TYPE
+    compressions = ('zstd', 'snappy', 'gzip', 'none')
+    streamed = False
+
+    def __init__(self):
+        if pa is None:
+            raise RuntimeError("Parquet output requires the pyarrow package")
+
+    def default_compression(self):
+        return PARQUET_COMPRESSION
+
+    def encode(self, df, table, compression):
+        return make_parquet_buffer(df, table, compression)
+
+
+class ArrowIpcFormat:
+    """Arrow IPC file (Feather v2) with the table's explicit schema; compression applies to the record batches"""
+
+    name = 'arrow'
+    extension = 'arrow'
+    content_type = 'application/vnd.apache.arrow.file'
+    compressions = ('none', 'lz4', 'zstd')
+    streamed = False
+
+    def __init__(self):
+        if pa is None:
+            raise RuntimeError("Arrow output requires the pyarrow package")
+
+    def default_compression(self):
+        return 'none'
+
+    def encode(self, df, table, compression):
+        arrow_table = to_arrow_table(df, table)
+        buffer = pa.BufferOutputStream()
+        options = pa.ipc.IpcWriteOptions(compression=None if compression == 'none' else compression)
+        with pa.ipc.new_file(buffer, arrow_table.schema, options=options) as writer:
+            writer.write_table(arrow_table)
+        return buffer.getvalue().to_pybytes()
+
+
+SINK_FORMATS = {
+    'csv': CsvFormat,
+    'jsonl': JsonLinesFormat,
+    'parquet': ParquetFormat,
+    'arrow': ArrowIpcFormat,
+}
+
+
+def raw_blob_stem(raw_path):
+    """Raw blob name without folders, ``spotify_raw_`` and extensions, e.g. ``<playlist>_<ts>``"""
+    name = raw_path.rsplit('/', 1)[-1].split('.', 1)[0]
+    return name[len(RAW_NAME_PREFIX):] if name.startswith(RAW_NAME_PREFIX) else name
+
+
+def register_sink_format(name, factory):
+    """
+    Make a custom output format usable in ``OUTPUT_FORMATS`` and ``OUTPUT_SINKS``.
+
+    ``factory()`` returns an object with ``name``, ``extension``,
+    ``content_type``, ``compressions``, ``streamed`` (True when compression
+    wraps the whole file, as for CSV), ``default_compression()`` and
+    ``encode(df, table, compression)`` returning bytes.
+    """
+    SINK_FORMATS[name.lower()] = factory
+
+
+class SinkSpec:
+    """
+    One output of a transformed table: format, compression, partitioning and destination.
+
+    Output keys are ``<prefix>[/<format>]/<table>_data/<partitions>/<table>_transformed_<stem>.<ext>``,
+    where the stem is the raw blob's ``<playlist>_<ts>`` (see ``raw_blob_stem``),
+    so raw blobs extracted in the same second never share an output and
+    transforming a raw blob again overwrites its outputs. CSV keeps the
+    original layout; other formats get their own folder so each folder holds
+    a single format. Partitioning is a list of:
+
+    - ``source``: the raw blob's partition folders, e.g. ``market=US/``
+    - ``date``: the extraction date of the raw blob, e.g. ``date=2024-01-31/``
+
+    An empty list writes the table straight into its ``<table>_data`` folder.
+    Compression streams (CSV and JSON Lines) add ``.gz`` or ``.zst`` to the key.
+    """
+
+    def __init__(self, table, output_format='csv', compression=None, partitioning=('source',),
+                 container=None, prefix=None):
+        output_format = output_format.strip().lower()
+        if output_format not in SINK_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.table = table
+        self.format = SINK_FORMATS[output_format]()
+        compression = (compression or self.format.default_compression()).lower()
+        if compression not in self.format.compressions:
+            raise ValueError(f"Unsupported {output_format} compression: {compression}")
+        if self.format.streamed:
+            # Falls back to gzip when zstandard is not installed
+            compression = resolve_compression(compression)
+        self.compression = compression
+        self.suffix = RAW_EXTENSIONS[compression] if self.format.streamed else ''
+        if isinstance(partitioning, str):
+            partitioning = [] if partitioning.lower() == 'none' else partitioning.split(',')
+        self.partitioning = [partition.strip().lower() for partition in partitioning if partition.strip()]
+        for partition in self.partitioning:
+            if partition not in PARTITIONINGS:
+                raise ValueError(f"Unsupported partitioning: {partition}")
+        self.container = container
+        self.prefix = prefix
+
+    @classmethod
+    def from_config(cls, table, config):
+        """Build a sink from an ``OUTPUT_SINKS`` entry: a format name or an object with ``format`` and options"""
+        if isinstance(config, str):
+            return cls(table, config)
+        if not isinstance(config, dict):
+            raise ValueError(f"Invalid sink for {table}: {config!r}")
+        options = dict(config)
+        output_format = options.pop('format', 'csv')
+        unknown = set(options) - {'compression', 'partitioning', 'container', 'prefix'}
+        if unknown:
+            raise ValueError(f"Unknown sink options for {table}: {', '.join(sorted(unknown))}")
+        return cls(table, output_format, **options)
+
+    def blob_name(self, raw_path, timestamp, output_prefix=TRANSFORMED_PREFIX):
+        """
+        Output key for the table transformed from ``raw_path``.
+
+        Args:
+            raw_path: Raw blob path below ``to_be_processed/`` or ``processed/``
+            timestamp: Transform timestamp, ``YYYYmmddHHMMSS``, for ``date`` partitioning
+            output_prefix: Folder used unless the sink sets its own ``prefix``
+        """
+        folder = self.prefix or output_prefix
+        if self.format.name != 'csv':
+            folder = f'{folder}/{self.format.name}'
+        partitions = ''
+        for partition in self.partitioning:
+            if partition == 'source':
+                source = raw_path.rpartition('/')[0]
+                partitions += f'{source}/' if source else ''
+            elif partition == 'date':
+                partitions += f'date={timestamp[:4]}-{timestamp[4:6]}-{timestamp[6:8]}/'
+        stem = raw_blob_stem(raw_path)
+        return f'{folder}/{self.table}_data/{partitions}{self.table}_transformed_{stem}.{self.format.extension}{self.suffix}'
+
+
+def parse_formats(value):
+    """Split a comma-separated (or list) format setting into validated, lower-case format names"""
+    formats = value if isinstance(value, list) else str(value).split(',')
+    formats = [output_format.strip().lower() for output_format in formats if output_format.strip()]
+    for output_format in formats:
+        if output_format not in SINK_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+    return formats
+
+
+def table_sinks(table):
+    """
+    Sinks ``table`` is written to.
+
+    Looks up the table in ``OUTPUT_SINKS``, then its ``*`` entry, then
+    ``TABLE_OUTPUT_FORMATS`` and finally ``OUTPUT_FORMATS``; the format
+    settings give one sink per format with the default options.
+    """
+    if OUTPUT_SINKS:
+        config = json.loads(OUTPUT_SINKS)
+        entries = config.get(table, config.get('*'))
+        if entries is not None:
+            if not isinstance(entries, list):
+                entries = [entries]
+            return [SinkSpec.from_config(table, entry) for entry in entries]
+    overrides = json.loads(TABLE_OUTPUT_FORMATS) if TABLE_OUTPUT_FORMATS else {}
+    return [SinkSpec(table, output_format) for output_format in parse_formats(overrides.get(table, OUTPUT_FORMATS))]
+
+
+class SinkEngine:
+    """
+    Encodes transformed tables with each of their sinks and uploads the outputs.
+
+    Sinks are resolved when the engine is created, so a bad setting fails
+    before any work is done. Outputs are encoded one at a time and uploaded
+    by a thread pool while the next one is encoded; each output reports its
+    encode and upload time and is exported as an ``operation=sink`` metric.
+    """
+
+    def __init__(self, container_client, output_prefix=TRANSFORMED_PREFIX, sinks=None,
+                 max_concurrency=SINK_UPLOAD_CONCURRENCY):
+        """
+        Args:
+            container_client: Default destination container
+            output_prefix: Folder for sinks that do not set their own ``prefix``
+            sinks: Dict of table name to a list of ``SinkSpec``; defaults to ``table_sinks`` for every table
+            max_concurrency: Uploads running at the same time
+        """
+        self.container_client = container_client
+        self.output_prefix = output_prefix
+        self.sinks = sinks if sinks is not None else {table: table_sinks(table) for table in TABLES}
+        self.max_concurrency = max(1, max_concurrency)
+        self._containers = {}
+        self._containers_lock = threading.Lock()
+
+    def _container_client(self, name):
+        """Client for a sink's destination container; None means the default container"""
+        if name is None or name == getattr(self.container_client, 'container_name', None):
+            return self.container_client
+        with self._containers_lock:
+            if name not in self._containers:
+                self._containers[name] = get_blob_service_client().get_container_client(name)
+            return self._containers[name]
+
+    def _upload(self, sink, blob_name, data):
+        """Upload one output, creating its destination container on first use; returns the upload time in ms"""
+        container_client = self._container_client(sink.container)
+        content_settings = ContentSettings(content_type=sink.format.content_type)
+        started = time.perf_counter()
+        try:
+            container_client.upload_blob(name=blob_name, data=data, content_settings=content_settings, overwrite=True)
+        except ResourceNotFoundError as e:
+            if sink.container is None or getattr(e, 'error_code', None) != 'ContainerNotFound':
+                raise
+            logging.info(f"Creating output container {sink.container}")
+            try:
+                container_client.create_container()
+            except ResourceExistsError:
+                pass
+            container_client.upload_blob(name=blob_name, data=data, content_settings=content_settings, overwrite=True)
+        return (time.perf_counter() - started) * 1000
+
+    def write(self, tables, raw_path, timestamp, timer=None):
+        """
+        Encode and upload every table with each of its sinks.
+
+        Args:
+            tables: Dict of table name to DataFrame; tables without sinks are skipped
+            raw_path: Raw blob path the tables were built from, for ``source`` partitioning
+            timestamp: Transform timestamp used in the output names
+            timer: Optional PhaseTimer that receives the ``encode`` and ``upload`` phases
+
+        Returns:
+            List of dicts with each output's table, format, compression, container,
+            blob name, size in bytes and encode and upload times
+
+        Raises:
+            The first upload error, after the remaining uploads have finished
+        """
+        outputs = []
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='sink') as executor:
+            for table, df in tables.items():
+                for sink in self.sinks.get(table, []):
+                    started = time.perf_counter()
+                    data = sink.format.encode(df, table, sink.compression)
+                    encode_ms = (time.perf_counter() - started) * 1000
+                    blob_name = sink.blob_name(raw_path, timestamp, self.output_prefix)
+                    outputs.append((sink, blob_name, len(data), encode_ms,
+                                    executor.submit(self._upload, sink, blob_name, data)))
+                    del data
+
+        results, error = [], None
+        for sink, blob_name, size, encode_ms, future in outputs:
+            try:
+                upload_ms = future.result()
+            except Exception as e:
+                logging.error(f"Error uploading {blob_name}: {str(e)}")
+                error = error or e
+                continue
+            result = {
+                'table': sink.table,
+                'format': sink.format.name,
+                'compression': sink.compression,
+                'container': sink.container or getattr(self.container_client, 'container_name', None),
+                'blob': blob_name,
+                'bytes': size,
+                'encode_ms': round(encode_ms, 1),
+                'upload_ms': round(upload_ms, 1),
+            }
+            if timer is not None:
+                timer.add('encode', encode_ms)
+                timer.add('upload', upload_ms)
+            export_metrics(
+                [('encode_ms', encode_ms), ('upload_ms', upload_ms), ('bytes', size)],
+                operation='sink', table=sink.table, format=sink.format.name, compression=sink.compression
+            )
+            results.append(result)
+        if error is not None:
+            raise error
+        return results
@@ -0,0 +1,149 @@
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.storage.blob import ContentSettings
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; local conditional writes are then not locked
+    fcntl = None
+
+STATE_PREFIX = os.environ.get('STATE_PREFIX', 'state')
+LOCAL_STATE_DIR = os.environ.get('LOCAL_STATE_DIR', os.path.join(tempfile.gettempdir(), 'spotify_etl_state'))
+
+
+class BlobJsonStore:
+    """
+    Small JSON documents kept as blobs under ``STATE_PREFIX`` in the raw container.
+
+    Used for state that has to be shared by every instance of the function app,
+    such as the Spotify access token, playlist snapshots and enrichment caches.
+    The container client is resolved on every call so that a rebuilt shared
+    BlobServiceClient is picked up automatically.
+    """
+
+    def __init__(self, get_container_client, prefix=STATE_PREFIX):
+        self.get_container_client = get_container_client
+        self.prefix = prefix
+
+    def _blob_name(self, key):
+        return f'{self.prefix}/{key}'
+
+    def read(self, key):
+        """Return the stored document, or None when it does not exist"""
+        try:
+            content = self.get_container_client().download_blob(self._blob_name(key)).readall()
+        except ResourceNotFoundError:
+            return None
+        return json.loads(content)
+
+    def write(self, key, document):
+        """Create or replace the stored document"""
+        self.get_container_client().upload_blob(
+            name=self._blob_name(key),
+            data=json.dumps(document, separators=(',', ':')),
+            content_settings=ContentSettings(content_type='application/json'),
+            overwrite=True
+        )
+
+    def read_versioned(self, key):
+        """Return the stored document and its ETag, or (None, None) when it does not exist"""
+        try:
+            download = self.get_container_client().download_blob(self._blob_name(key))
+            content = download.readall()
+        except ResourceNotFoundError:
+            return None, None
+        return json.loads(content), download.properties.etag
+
+    def write_if_unchanged(self, key, document, etag):
+        """
+        Write the document only if it is still at the version read as ``etag``.
+
+        With ``etag`` None the document must not exist yet.
+
+        Returns:
+            The new ETag, or None when another writer changed the document first
+        """
+        conditions = {'etag': etag, 'match_condition': MatchConditions.IfNotModified} if etag else {}
+        try:
+            result = self.get_container_client().get_blob_client(self._blob_name(key)).upload_blob(
+                json.dumps(document, separators=(',', ':')),
+                content_settings=ContentSettings(content_type='application/json'),
+                overwrite=etag is not None,
+                **conditions
+            )
+        except (ResourceExistsError, ResourceModifiedError):
+            return None
+        return result['etag']
+
+
+class LocalJsonStore:
+    """
+    Stand-in for BlobJsonStore that keeps documents on the local file system.
+
+    Used when no storage connection is configured, e.g. for local runs and
+    benchmarks. Defaults to the temp directory because the app directory is
+    read-only when running from a package.
+    """
+
+    def __init__(self, directory=LOCAL_STATE_DIR):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key.split('/'))
+
+    def read(self, key):
+        """Return the stored document, or None when it does not exist"""
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write(self, key, document):
+        """Create or replace the stored document"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial document
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(document, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _etag(stat):
+        # Every write replaces the file, so inode and modification time identify a version
+        return f'{stat.st_ino}-{stat.st_mtime_ns}'
+
+    @contextmanager
+    def _locked(self, path):
+        """Hold an exclusive lock on ``path`` across processes, where the platform supports it"""
+        with open(f'{path}.lock', 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def read_versioned(self, key):
+        """Return the stored document and its version, or (None, None) when it does not exist"""
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return json.load(f), self._etag(os.fstat(f.fileno()))
+        except FileNotFoundError:
+            return None, None
+
+    def write_if_unchanged(self, key, document, etag):
+        """Write the document only if it is still at version ``etag`` (None: must not exist); see BlobJsonStore"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._locked(path):
+            try:
+                current = self._etag(os.stat(path))
+            except FileNotFoundError:
+                current = None
+            if current != etag:
+                return None
+            self.write(key, document)
+            return self._etag(os.stat(path))
@@ -1,13 +1,25 @@
 import os
 import logging
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import json
 from datetime import datetime
 import azure.functions as func
 import io
+import numpy as np
 import pandas as pd
-from azure.storage.blob import BlobServiceClient, ContentSettings
+
+from spotifyclients import get_blob_service_client, get_spotify_client, get_state_store, reset_clients_after_error
+from spotifycodec import PlaylistItemFields
+from spotifymetrics import PhaseTimer, export_metrics
+from spotifyraw import ChunkedReader, raw_blob_timestamp, read_raw
+from spotifysinks import TRANSFORMED_PREFIX, SinkEngine
+from spotifyenrich import (
+    MetadataCache,
+    ARTIST_CACHE_TTL_HOURS,
+    METADATA_CACHE_RETENTION_DAYS,
+    AUDIO_FEATURE_COLUMNS,
+    enrich_albums,
+    enrich_artists,
+    enrich_audio_features,
+)
 
 app = func.FunctionApp()
 # Get environment variables
@@ -15,6 +27,13 @@ CLIENT_ID = os.environ.get('CLIENT_ID')
 SECRET_ID = os.environ.get('CLIENT_SECRET')
 STORAGE_CONNECTION_STRING = os.environ.get('AzureWebJobsStorage')
 CONTAINER_NAME = os.environ.get('CONTAINER_NAME', "raw")
+# Audio features are only available to Spotify apps that were granted access to the endpoint
+ENRICH_AUDIO_FEATURES = os.environ.get('ENRICH_AUDIO_FEATURES', 'false').lower() == 'true'
+AUDIO_FEATURES_CACHE_KEY = 'cache/audio_features'
+ENRICH_ARTISTS = os.environ.get('ENRICH_ARTISTS', 'false').lower() == 'true'
+ARTISTS_CACHE_KEY = 'cache/artists'
+ENRICH_ALBUMS = os.environ.get('ENRICH_ALBUMS', 'false').lower() == 'true'
+ALBUMS_CACHE_KEY = 'cache/albums'
 
 def make_csv_buffer(df):
     """Convert DataFrame to CSV string buffer for uploading"""
@@ -23,135 +42,260 @@ def make_csv_buffer(df):
     csv_content = csv_buffer.getvalue()
     return csv_content
 
-def make_album(data):
-    """Extract album data from Spotify API response"""
-    album_df_list = []
-    for song in data['items']:
-        album_id = song['track']['album']['id']
-        album_name = song['track']['album']['name']
-        release_date = song['track']['album']['release_date']
-        total_tracks = song['track']['album']['total_tracks']
-        album_url = song['track']['album']['external_urls']['spotify']
-        row_data = [album_id, album_name, release_date, total_tracks, album_url]
-        album_df_list.append(row_data)
-    return album_df_list
-
-def make_artist(data):
-    """Extract artist data from Spotify API response"""
-    artist_df_list = []
-    for song in data['items']:
-        artist_id = song['track']['artists'][0]['id']
-        artist_name = song['track']['artists'][0]['name']
-        artist_url = song['track']['artists'][0]['external_urls']['spotify']
-        row_data = [artist_id, artist_name, artist_url]
-        artist_df_list.append(row_data)
-    return artist_df_list
-    
-def make_song(data):
-    """Extract song data from Spotify API response"""
-    song_df_list = []
-    for song in data['items']:
-        song_id = song['track']['id']
-        song_name = song['track']['name']
-        duration_ms = song['track']['duration_ms']
-        url = song['track']['external_urls']['spotify']
-        popularity = song['track']['popularity']
-        song_added = song['added_at']
-        album_id = song['track']['album']['id']
-        artist_id = song['track']['artists'][0]['id']
-        row_data = [song_id, song_name, duration_ms, url, popularity, song_added, album_id, artist_id]
-        song_df_list.append(row_data)
-    return song_df_list
+# Columns of the core tables with their declared dtypes. Integer columns fall
+# back to the nullable Int64 when a value is missing; datetime columns are
+# parsed from their ISO 8601 strings.
+SONG_COLUMNS = {
+    'song_id': 'object', 'name': 'object', 'duration_ms': 'int64', 'url': 'object',
+    'popularity': 'int64', 'added_date': 'datetime', 'album_id': 'object', 'artist_id': 'object',
+}
+ALBUM_COLUMNS = {'album_id': 'object', 'name': 'object', 'release_date': 'datetime', 'total_tracks': 'int64', 'url': 'object'}
+ARTIST_COLUMNS = {'artist_id': 'object', 'name': 'object', 'url': 'object'}
+
+def make_frame(columns, dtypes):
+    """Build a DataFrame from per-column lists, converting each column to its declared dtype"""
+    data = {}
+    for name, values in columns.items():
+        dtype = dtypes[name]
+        if dtype == 'datetime':
+            data[name] = pd.to_datetime(values)
+        elif dtype == 'int64' and None in values:
+            data[name] = pd.array(values, dtype='Int64')
+        else:
+            data[name] = np.array(values, dtype=dtype)
+    return pd.DataFrame(data)
+
+def make_columns(items):
+    """
+    Extract the song, album and artist tables from a stream of playlist items in a single pass.
+    
+    Each item's track, album and first artist are looked up once and their
+    fields appended straight to per-column lists. Albums and artists are
+    deduplicated on the way, keeping the first occurrence, so those columns
+    only ever hold one row per ID.
+    
+    Args:
+        items: Iterable of playlist items
+        
+    Returns:
+        Tuple of (song, album, artist) DataFrames with the dtypes declared in
+        ``SONG_COLUMNS``, ``ALBUM_COLUMNS`` and ``ARTIST_COLUMNS``
+    """
+    songs = {name: [] for name in SONG_COLUMNS}
+    albums = {name: [] for name in ALBUM_COLUMNS}
+    artists = {name: [] for name in ARTIST_COLUMNS}
+    # Bound appends keep the per-item loop free of attribute and key lookups
+    (add_song_id, add_song_name, add_duration, add_song_url,
+     add_popularity, add_added, add_song_album, add_song_artist) = [values.append for values in songs.values()]
+    add_album_id, add_album_name, add_release, add_total_tracks, add_album_url = [values.append for values in albums.values()]
+    add_artist_id, add_artist_name, add_artist_url = [values.append for values in artists.values()]
+    seen_albums, seen_artists = set(), set()
+    
+    for song in items:
+        track = song['track']
+        album = track['album']
+        artist = track['artists'][0]
+        album_id = album['id']
+        artist_id = artist['id']
+        
+        add_song_id(track['id'])
+        add_song_name(track['name'])
+        add_duration(track['duration_ms'])
+        add_song_url(track['external_urls']['spotify'])
+        add_popularity(track['popularity'])
+        add_added(song['added_at'])
+        add_song_album(album_id)
+        add_song_artist(artist_id)
+        
+        if album_id not in seen_albums:
+            seen_albums.add(album_id)
+            add_album_id(album_id)
+            add_album_name(album['name'])
+            add_release(album['release_date'])
+            add_total_tracks(album['total_tracks'])
+            add_album_url(album['external_urls']['spotify'])
+        
+        if artist_id not in seen_artists:
+            seen_artists.add(artist_id)
+            add_artist_id(artist_id)
+            add_artist_name(artist['name'])
+            add_artist_url(artist['external_urls']['spotify'])
+    
+    return make_frame(songs, SONG_COLUMNS), make_frame(albums, ALBUM_COLUMNS), make_frame(artists, ARTIST_COLUMNS)
+
+def make_song_features(song_ids):
+    """Build the song_features table for the given tracks via the batched audio-features endpoint"""
+    cache = MetadataCache(get_state_store(), AUDIO_FEATURES_CACHE_KEY, ttl_seconds=METADATA_CACHE_RETENTION_DAYS * 86400)
+    feature_rows = enrich_audio_features(get_spotify_client(), song_ids, cache)
+    cache.save()
+    return pd.DataFrame(feature_rows, columns=['song_id'] + AUDIO_FEATURE_COLUMNS)
+
+def add_artist_details(artist_df):
+    """Add genres, followers and popularity to the artist table via the batched artists endpoint"""
+    cache = MetadataCache(get_state_store(), ARTISTS_CACHE_KEY, ttl_seconds=ARTIST_CACHE_TTL_HOURS * 3600)
+    details = enrich_artists(get_spotify_client(), artist_df['artist_id'].tolist(), cache)
+    cache.save()
+    
+    artist_df = artist_df.copy()
+    artist_df['genres'] = [';'.join(details[artist_id]['genres']) if artist_id in details else None for artist_id in artist_df['artist_id']]
+    artist_df['followers'] = pd.array([details.get(artist_id, {}).get('followers') for artist_id in artist_df['artist_id']], dtype='Int64')
+    artist_df['popularity'] = pd.array([details.get(artist_id, {}).get('popularity') for artist_id in artist_df['artist_id']], dtype='Int64')
+    return artist_df
+
+def add_album_details(album_df):
+    """Add label, popularity, genres and release date precision to the album table via the batched albums endpoint"""
+    cache = MetadataCache(get_state_store(), ALBUMS_CACHE_KEY, ttl_seconds=METADATA_CACHE_RETENTION_DAYS * 86400)
+    details = enrich_albums(get_spotify_client(), album_df['album_id'].tolist(), cache)
+    cache.save()
+    
+    album_df = album_df.copy()
+    album_df['label'] = [details.get(album_id, {}).get('label') for album_id in album_df['album_id']]
+    album_df['popularity'] = pd.array([details.get(album_id, {}).get('popularity') for album_id in album_df['album_id']], dtype='Int64')
+    album_df['genres'] = [';'.join(details[album_id]['genres'] or []) if album_id in details else None for album_id in album_df['album_id']]
+    album_df['release_date_precision'] = [details.get(album_id, {}).get('release_date_precision') for album_id in album_df['album_id']]
+    return album_df
+
+def raw_blob_path(blob_name):
+    """Path of a raw blob below ``to_be_processed/`` or ``processed/``, keeping partition folders such as ``market=US``"""
+    for folder in ('to_be_processed/', 'processed/'):
+        if folder in blob_name:
+            return blob_name.split(folder, 1)[-1]
+    return blob_name
+
+
+def build_tables(raw_items):
+    """
+    Build the song, album and artist tables (plus optional song features) from playlist items.
+    
+    Enrichment is optional and best effort; a failure there is logged and
+    leaves the core tables intact.
+    
+    Args:
+        raw_items: Iterable of playlist items, e.g. from ``read_raw``
+        
+    Returns:
+        Dict of table name to DataFrame; ``song_features`` is only present when enabled and successful
+    """
+    song_df, album_df, artist_df = make_columns(raw_items)
+    
+    # Optional enrichment; a failure here should not lose the core tables
+    if ENRICH_ARTISTS:
+        try:
+            artist_df = add_artist_details(artist_df)
+        except Exception as e:
+            logging.error(f"Error enriching artists: {str(e)}")
+    
+    if ENRICH_ALBUMS:
+        try:
+            album_df = add_album_details(album_df)
+        except Exception as e:
+            logging.error(f"Error enriching albums: {str(e)}")
+    
+    tables = {'song': song_df, 'album': album_df, 'artist': artist_df}
+    if ENRICH_AUDIO_FEATURES:
+        try:
+            tables['song_features'] = make_song_features(song_df['song_id'].tolist())
+        except Exception as e:
+            logging.error(f"Error enriching songs with audio features: {str(e)}")
+    return tables
+
+
+def transform_raw_blob(container_client, blob_name, stream=None, timestamp=None, output_prefix=TRANSFORMED_PREFIX):
+    """
+    Transform one raw blob into tables and write them to each table's output sinks.
+    
+    Used by the blob trigger for new raw blobs and by the backfill for blobs
+    already in ``processed/``. The source blob is left where it is.
+    
+    Args:
+        container_client: Container holding the raw blob, and the default container for the outputs
+        blob_name: Name of the raw blob within the container
+        stream: Already open binary stream of the blob (e.g. the trigger's input); downloaded when omitted
+        timestamp: Timestamp for ``date`` partitioning; defaults to the extraction timestamp in the
+            raw blob name, so concurrent triggers for blobs of one fan-out never depend on the clock
+        output_prefix: Folder the ``<table>_data`` folders are written under, unless a sink sets its own
+        
+    Returns:
+        List of dicts describing each uploaded output (see ``SinkEngine.write``)
+    """
+    # Fail on a bad sink setting before any work is done
+    engine = SinkEngine(container_client, output_prefix)
+    timer = PhaseTimer()
+    
+    if stream is None:
+        # Stream the stored bytes chunk by chunk; read_raw detects the compression itself
+        stream = ChunkedReader(container_client.download_blob(blob_name, decompress=False).chunks())
+    
+    # Raw blobs may be gzip/zstd compressed JSON or NDJSON; either way items
+    # are parsed one at a time while the tables are built, and with msgspec
+    # only the fields the tables need are decoded
+    with timer.phase('build'):
+        _, raw_items = read_raw(stream, schema=PlaylistItemFields)
+        tables = build_tables(raw_items)
+    
+    # Output names carry the raw blob's playlist ID and timestamp and, depending on the sink,
+    # its partition (e.g. market=US/); only blobs named some other way fall back to the clock
+    timestamp = timestamp or raw_blob_timestamp(blob_name) or datetime.now().strftime("%Y%m%d%H%M%S")
+    outputs = engine.write(tables, raw_blob_path(blob_name), timestamp, timer)
+    
+    export_metrics(
+        timer.metrics() + [('items', len(tables['song'])), ('outputs', len(outputs)),
+                           ('bytes', sum(output['bytes'] for output in outputs))],
+        operation='transform', blob=blob_name
+    )
+    return outputs
+
+
+def move_to_processed(container_client, blob_name):
+    """Move a raw blob from ``to_be_processed/`` to ``processed/``, keeping its partition folders and stored encoding"""
+    source_path = f"to_be_processed/{raw_blob_path(blob_name)}"
+    target_path = f"processed/{raw_blob_path(blob_name)}"
+    
+    # Get the stored (still compressed) content and its content settings
+    source_blob_client = container_client.get_blob_client(source_path)
+    source_download = source_blob_client.download_blob(decompress=False)
+    file_content = source_download.readall()
+    
+    # Upload to processed folder, keeping Content-Type and Content-Encoding
+    processed_blob_client = container_client.get_blob_client(target_path)
+    processed_blob_client.upload_blob(
+        file_content,
+        content_settings=source_download.properties.content_settings,
+        overwrite=True
+    )
+    
+    # Delete the original file
+    source_blob_client.delete_blob()
+    return target_path
+
 
 def register_spotify_transformation(app):
     @app.blob_trigger(arg_name="myblob", path="raw/to_be_processed/{name}", connection="AzureWebJobsStorage")
     def TransformSpotifyData(myblob: func.InputStream):
         """
         Azure Function triggered when a new JSON file is added to the 'raw/to_be_processed' container.
-        Transforms Spotify playlist data into structured CSV files for songs, artists, and albums.
+        Transforms Spotify playlist data into song, artist and album tables and writes them to their output sinks.
         """
         logging.info(f"Python blob trigger function processed blob\n"
                     f"Name: {myblob.name}\n"
                     f"Blob Size: {myblob.length} bytes")
         
         try:
-            # Process the triggered blob
-            raw_data = json.loads(myblob.read().decode('utf-8'))
-            
-            # Create the BlobServiceClient
-            blob_service_client = BlobServiceClient.from_connection_string(STORAGE_CONNECTION_STRING)
-            container_client = blob_service_client.get_container_client(CONTAINER_NAME)
-
-            # Process the triggered data
-            album_df_list = make_album(raw_data)
-            artist_df_list = make_artist(raw_data)
-            song_df_list = make_song(raw_data)
-
-            # Create and clean dataframes
-            song_df = pd.DataFrame(song_df_list, columns=['song_id', 'name', 'duration_ms', 'url', 'popularity', 'added_date', 'album_id', 'artist_id'])
-            song_df['added_date'] = pd.to_datetime(song_df['added_date'])
-            
-            artist_df = pd.DataFrame(artist_df_list, columns=['artist_id', 'name', 'url'])
-            artist_df.drop_duplicates(subset='artist_id', keep='first', inplace=True, ignore_index=True)
-            
-            album_df = pd.DataFrame(album_df_list, columns=['album_id', 'name', 'release_date', 'total_tracks', 'url'])
-            album_df.drop_duplicates(subset='album_id', keep='first', inplace=True, ignore_index=True)
-            album_df['release_date'] = pd.to_datetime(album_df['release_date'])
-            
-            # Generate output paths with timestamps
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            song_key = f'transformed_data/song_data/song_transformed_{timestamp}.csv'
-            album_key = f'transformed_data/album_data/album_transformed_{timestamp}.csv'
-            artist_key = f'transformed_data/artist_data/artist_transformed_{timestamp}.csv'
-            
-            # Upload transformed CSV files with content type for CSV
-            content_settings = ContentSettings(content_type='text/csv')
+            # Reuse the instance's shared BlobServiceClient
+            container_client = get_blob_service_client().get_container_client(CONTAINER_NAME)
+            source_path = f"to_be_processed/{raw_blob_path(myblob.name)}"
             
+            # Stream the triggering blob through the shared transform
             try:
-                container_client.upload_blob(
-                    name=song_key, 
-                    data=make_csv_buffer(song_df),
-                    content_settings=content_settings,
-                    overwrite=True
-                )
-                
-                container_client.upload_blob(
-                    name=album_key, 
-                    data=make_csv_buffer(album_df),
-                    content_settings=content_settings,
-                    overwrite=True
-                )
-                
-                container_client.upload_blob(
-                    name=artist_key, 
-                    data=make_csv_buffer(artist_df),
-                    content_settings=content_settings,
-                    overwrite=True
-                )
-                
-                logging.info(f"Transformed data uploaded to {song_key}, {album_key}, {artist_key}")
+                outputs = transform_raw_blob(container_client, source_path, stream=myblob)
+                logging.info(f"Transformed data uploaded to {', '.join(output['blob'] for output in outputs)}")
             except Exception as e:
-                logging.error(f"Error uploading transformed data: {str(e)}")
+                logging.error(f"Error transforming or uploading data: {str(e)}")
                 raise
             
             # Move processed file to 'processed' folder
             try:
-                # Get the source blob name from the trigger
-                file_name = myblob.name.split('/')[-1]
-                source_path = f"to_be_processed/{file_name}"
-                target_path = f"processed/{file_name}"
-                
-                # Get the content from the source blob
-                source_blob_client = container_client.get_blob_client(source_path)
-                file_content = source_blob_client.download_blob().readall()
-                
-                # Upload to processed folder
-                processed_blob_client = container_client.get_blob_client(target_path)
-                processed_blob_client.upload_blob(file_content, overwrite=True)
-                
-                # Delete the original file
-                source_blob_client.delete_blob()
-                
+                target_path = move_to_processed(container_client, source_path)
                 logging.info(f"Moved {source_path} to {target_path}")
             except Exception as e:
                 logging.error(f"Error moving processed file: {str(e)}")
@@ -160,4 +304,5 @@ def register_spotify_transformation(app):
             logging.info('Spotify ETL transformation function completed successfully')
         except Exception as e:
             logging.error(f"Error in Spotify ETL transformation: {str(e)}")
-            raise
\ No newline at end of file
+            reset_clients_after_error(e)
+            raise
@@ -0,0 +1,116 @@
+import os
+import base64
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Raw payloads are uploaded as block blobs in blocks of this many bytes
+RAW_UPLOAD_BLOCK_SIZE = int(os.environ.get('RAW_UPLOAD_BLOCK_SIZE', 4 * 1024 * 1024))
+# Maximum number of blocks staged concurrently per raw blob
+RAW_UPLOAD_CONCURRENCY = int(os.environ.get('RAW_UPLOAD_CONCURRENCY', 4))
+
+
+def block_id(index):
+    """Base64 block ID for the block at ``index``; all IDs of a blob must have the same length"""
+    return base64.b64encode(f'{index:08d}'.encode()).decode()
+
+
+class StagedBlockUpload:
+    """
+    Writable stream that uploads to a block blob while it is being written.
+
+    Written bytes are buffered until a full block of ``block_size`` is available,
+    which is then staged in the background with at most ``max_concurrency``
+    blocks in flight; further writes block while that many are outstanding, so
+    memory stays bounded at roughly ``max_concurrency`` blocks. Nothing becomes
+    visible in the container until ``commit`` writes the block list, so the
+    transform's blob trigger never sees a partial blob.
+
+    Payloads that never fill a block are uploaded with a single ``upload_blob``
+    call on commit, which keeps small playlists at one request.
+    """
+
+    def __init__(self, blob_client, content_settings=None, block_size=RAW_UPLOAD_BLOCK_SIZE,
+                 max_concurrency=RAW_UPLOAD_CONCURRENCY):
+        self.blob_client = blob_client
+        self.content_settings = content_settings
+        self.block_size = max(1, block_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.size = 0
+        self._buffer = bytearray()
+        self._block_ids = []
+        self._futures = []
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        """Buffer ``data`` and stage every complete block"""
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.block_size:
+            self._stage(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _stage(self, block):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        # Surface a failed block before staging more
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        current_id = block_id(len(self._block_ids))
+        self._block_ids.append(current_id)
+        self._slots.acquire()
+        future = self._executor.submit(self.blob_client.stage_block, current_id, block, length=len(block))
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _wait(self):
+        if self._executor is None:
+            return
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def commit(self):
+        """
+        Stage the remaining bytes and commit the block list.
+
+        Returns:
+            Total number of bytes uploaded
+        """
+        if not self._block_ids:
+            self.blob_client.upload_blob(bytes(self._buffer), content_settings=self.content_settings, overwrite=True)
+            self._buffer.clear()
+            return self.size
+
+        if self._buffer:
+            self._stage(bytes(self._buffer))
+            self._buffer.clear()
+        self._wait()
+        self.blob_client.commit_block_list(self._block_ids, content_settings=self.content_settings)
+        logging.info(f"Committed {len(self._block_ids)} blocks ({self.size} bytes) to {self.blob_client.blob_name}")
+        return self.size
+
+    def abort(self):
+        """
+        Stop the upload without committing.
+
+        Already staged blocks are never committed; the service discards them
+        after a week.
+        """
+        self._buffer.clear()
+        try:
+            self._wait()
+        except Exception as e:
+            logging.warning(f"Staging a block of {self.blob_client.blob_name} failed during abort: {str(e)}")
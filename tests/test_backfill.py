@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from spotifybackfill import list_backfill_blobs, raw_blob_timestamp
+
+
+class _Blob:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Container:
+    def __init__(self, names):
+        self.names = names
+
+    def list_blobs(self, name_starts_with=''):
+        return [_Blob(name) for name in self.names if name.startswith(name_starts_with)]
+
+
+def test_raw_blob_timestamp_accepts_playlist_and_legacy_names():
+    assert raw_blob_timestamp('processed/spotify_raw_37i9dQZF1DX_20240101120000.json.gz') == '20240101120000'
+    assert raw_blob_timestamp('processed/market=US/spotify_raw_pl_20240101120000.ndjson.zst') == '20240101120000'
+    assert raw_blob_timestamp('processed/spotify_raw_20240101120000.json') == '20240101120000'
+    assert raw_blob_timestamp('processed/spotify_raw_notes.json') is None
+
+
+def test_list_backfill_blobs_includes_legacy_blobs():
+    container = _Container([
+        'processed/spotify_raw_20231231235959.json',
+        'processed/spotify_raw_20240101120000.json',
+        'processed/spotify_raw_pl_20240102120000.json.gz',
+        'processed/spotify_raw_pl_20240201120000.json.gz',
+    ])
+    names = list_backfill_blobs(container, datetime(2024, 1, 1), datetime(2024, 1, 31, 23, 59, 59))
+    assert names == ['processed/spotify_raw_20240101120000.json', 'processed/spotify_raw_pl_20240102120000.json.gz']
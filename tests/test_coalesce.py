@@ -0,0 +1,179 @@
+import time
+import asyncio
+import threading
+
+import pytest
+from azure.core.exceptions import HttpResponseError
+
+import spotifyextract
+from spotifyextract import AsyncSingleFlight, PlaylistLease, SingleFlight, ingest_playlist_coalesced
+
+
+def _run_concurrently(single_flight, key, fn, followers=3):
+    """Start one leader, then ``followers`` callers while the leader is still running ``fn``"""
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(single_flight.do(key, fn))
+        except Exception as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(followers + 1)]
+    threads[0].start()
+    for thread in threads[1:]:
+        # Followers must arrive while the leader's call is in flight
+        while key not in single_flight._calls:
+            time.sleep(0.001)
+        thread.start()
+    return threads, outcomes
+
+
+def test_concurrent_callers_share_one_result():
+    single_flight = SingleFlight()
+    release, calls = threading.Event(), []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return 'summary'
+
+    threads, outcomes = _run_concurrently(single_flight, 'pl', fn)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(outcomes, key=lambda outcome: outcome[1]) == [('summary', False)] + [('summary', True)] * 3
+
+
+def test_concurrent_callers_share_one_exception():
+    single_flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise RuntimeError('fetch failed')
+
+    threads, outcomes = _run_concurrently(single_flight, 'pl', fn)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(outcomes) == 4
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+
+
+def _raise_value_error():
+    raise ValueError('not found')
+
+
+def test_key_is_cleared_after_completion():
+    single_flight = SingleFlight()
+    assert single_flight.do('pl', lambda: 1) == (1, False)
+    with pytest.raises(ValueError):
+        single_flight.do('pl', _raise_value_error)
+    assert single_flight.do('pl', lambda: 2) == (2, False)
+    assert single_flight._calls == {}
+
+
+def test_async_single_flight_shares_one_run():
+    single_flight = AsyncSingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'summary'
+
+    async def main():
+        return await asyncio.gather(*(single_flight.do('pl', fn) for _ in range(4)))
+
+    outcomes = asyncio.run(main())
+    assert len(calls) == 1
+    assert outcomes == [('summary', False)] + [('summary', True)] * 3
+    assert single_flight._calls == {}
+
+
+class _Lease:
+    def __init__(self):
+        self.released = False
+
+    def renew(self):
+        pass
+
+    def release(self):
+        self.released = True
+
+
+class _LeaseBlob:
+    def __init__(self, blob_name, error=None):
+        self.blob_name = blob_name
+        self.error = error
+        self.lease = None
+
+    def upload_blob(self, data, overwrite=True):
+        pass
+
+    def acquire_lease(self, lease_duration=-1):
+        if self.error is not None:
+            raise self.error
+        self.lease = _Lease()
+        return self.lease
+
+
+class _Container:
+    def __init__(self, error=None):
+        self.error = error
+        self.blobs = {}
+
+    def get_blob_client(self, name):
+        return self.blobs.setdefault(name, _LeaseBlob(name, self.error))
+
+
+def _conflict(status_code=409):
+    error = HttpResponseError(message='There is already a lease present.')
+    error.status_code = status_code
+    return error
+
+
+def test_lease_held_elsewhere_is_not_acquired():
+    lease = PlaylistLease(_Container(_conflict()), 'pl', duration=15)
+    assert lease.acquire() is False
+    lease.release()
+
+
+@pytest.fixture
+def ingestions(monkeypatch):
+    calls = []
+
+    def ingest_playlist(sp, container_client, playlist_id, market=None, **kwargs):
+        calls.append((playlist_id, market))
+        return {'playlist_id': playlist_id, 'status': 'succeeded'}
+
+    monkeypatch.setattr(spotifyextract, 'ingest_playlist', ingest_playlist)
+    monkeypatch.setattr(spotifyextract, 'COALESCE_ACROSS_INSTANCES', True)
+    return calls
+
+
+def test_lease_conflict_reports_coalesced(ingestions):
+    summary = ingest_playlist_coalesced(None, _Container(_conflict()), 'pl', market='US')
+    assert summary == {'playlist_id': 'pl', 'status': 'coalesced', 'duration_ms': 0.0, 'market': 'US'}
+    assert ingestions == []
+
+
+def test_lease_is_released_after_ingestion(ingestions):
+    container = _Container()
+    summary = ingest_playlist_coalesced(None, container, 'pl')
+    assert summary['status'] == 'succeeded'
+    assert ingestions == [('pl', None)]
+    (blob,) = container.blobs.values()
+    assert blob.lease.released
+
+
+def test_lease_failure_other_than_conflict_does_not_block_ingestion(ingestions):
+    summary = ingest_playlist_coalesced(None, _Container(_conflict(403)), 'pl')
+    assert summary['status'] == 'succeeded'
+    assert ingestions == [('pl', None)]
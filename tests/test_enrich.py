@@ -0,0 +1,45 @@
+from spotifyenrich import AUDIO_FEATURE_COLUMNS, MetadataCache, enrich_albums, enrich_artists, enrich_audio_features
+from spotifystore import LocalJsonStore
+
+
+class _Spotify:
+    """Answers every requested ID; records the batches it was asked for"""
+
+    def __init__(self):
+        self.requested = []
+
+    def artists(self, ids):
+        self.requested.extend(ids)
+        return {'artists': [{'id': artist_id, 'genres': ['pop'], 'followers': {'total': 1}, 'popularity': 50}
+                            for artist_id in ids]}
+
+    def albums(self, ids):
+        self.requested.extend(ids)
+        return {'albums': [{'id': album_id, 'label': 'label', 'popularity': 40} for album_id in ids]}
+
+    def audio_features(self, ids):
+        self.requested.extend(ids)
+        return [{'id': song_id, **dict.fromkeys(AUDIO_FEATURE_COLUMNS, 0.5)} for song_id in ids]
+
+
+def _cache(tmp_path, key):
+    return MetadataCache(LocalJsonStore(str(tmp_path)), key)
+
+
+def test_local_tracks_without_ids_are_skipped(tmp_path):
+    sp = _Spotify()
+    artists = enrich_artists(sp, ['a1', None, 'a2', None], _cache(tmp_path, 'cache/artists'))
+    albums = enrich_albums(sp, [None, 'b1'], _cache(tmp_path, 'cache/albums'))
+    features = enrich_audio_features(sp, ['t1', None], _cache(tmp_path, 'cache/audio_features'))
+
+    assert sorted(artists) == ['a1', 'a2']
+    assert list(albums) == ['b1']
+    assert [row[0] for row in features] == ['t1']
+    assert None not in sp.requested
+
+
+def test_cache_get_of_a_missing_id_is_none(tmp_path):
+    cache = _cache(tmp_path, 'cache/artists')
+    assert cache.get(None) is None
+    assert cache.get('') is None
+    assert cache.missing([None, '']) == []
@@ -0,0 +1,17 @@
+import io
+import json
+
+import pytest
+
+from spotifyraw import JsonStreamScanner, _iter_document_items
+
+DOCUMENT = '{"total":2,"items":[1.25,-3e-2,{"popularity":105,"ratio":0.5},17],"limit":100}'
+
+
+@pytest.mark.parametrize('read_size', range(1, len(DOCUMENT) + 2))
+def test_values_are_decoded_across_any_window_boundary(read_size):
+    header = {}
+    scanner = JsonStreamScanner(io.StringIO(DOCUMENT), read_size=read_size)
+    items = list(_iter_document_items(scanner, header))
+    assert items == json.loads(DOCUMENT)['items']
+    assert header == {'total': 2, 'limit': 100}
@@ -0,0 +1,152 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from spotifyextract import RequestScheduler
+
+
+class _Throttled(Exception):
+    def __init__(self, retry_after=0):
+        super().__init__('API rate limit exceeded')
+        self.http_status = 429
+        self.headers = {'Retry-After': str(retry_after)}
+
+
+def _raise(error):
+    raise error
+
+
+def _scheduler(**options):
+    options = {'rate': 10, 'burst': 20, 'max_concurrency': 16, 'max_retries': 5, 'recovery_seconds': 60, **options}
+    return RequestScheduler(**options)
+
+
+def test_concurrent_429s_decrease_the_limits_once():
+    scheduler = _scheduler(max_retries=0)
+    barrier = threading.Barrier(4)
+
+    def throttled():
+        barrier.wait()
+        raise _Throttled()
+
+    errors = []
+
+    def call():
+        try:
+            scheduler.call(throttled)
+        except _Throttled as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 4
+    assert scheduler.throttled == 4
+    assert scheduler.rate == 5
+    assert scheduler.concurrency == 8
+
+
+def test_429_after_a_decrease_is_a_new_event():
+    scheduler = _scheduler(max_retries=0)
+    for _ in range(2):
+        with pytest.raises(_Throttled):
+            scheduler.call(_raise, _Throttled())
+    assert scheduler.rate == 2.5
+    assert scheduler.concurrency == 4
+
+
+def test_pause_honours_retry_after():
+    scheduler = _scheduler()
+    attempts = []
+
+    def throttled_once():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise _Throttled(retry_after=0.3)
+        return 'ok'
+
+    assert scheduler.call(throttled_once) == 'ok'
+    assert attempts[1] - attempts[0] >= 0.3
+
+
+def test_only_the_throttled_call_is_retried():
+    scheduler = _scheduler()
+    calls = {'a': 0, 'b': 0, 'c': 0}
+
+    def fetch(key):
+        calls[key] += 1
+        if key == 'a' and calls[key] == 1:
+            raise _Throttled()
+        if key == 'c':
+            raise ValueError('not found')
+        return key
+
+    assert scheduler.call(fetch, 'a') == 'a'
+    assert scheduler.call(fetch, 'b') == 'b'
+    with pytest.raises(ValueError):
+        scheduler.call(fetch, 'c')
+    assert calls == {'a': 2, 'b': 1, 'c': 1}
+
+
+def test_gives_up_after_max_retries():
+    scheduler = _scheduler(max_retries=2)
+    calls = []
+
+    def always_throttled():
+        calls.append(1)
+        raise _Throttled()
+
+    with pytest.raises(_Throttled):
+        scheduler.call(always_throttled)
+    assert len(calls) == 3
+
+
+def test_successes_recover_most_of_a_decrease():
+    scheduler = _scheduler(max_retries=0)
+    with pytest.raises(_Throttled):
+        scheduler.call(_raise, _Throttled())
+    for _ in range(10):
+        scheduler.call(lambda: None)
+    assert scheduler.rate > 8
+    assert int(scheduler.concurrency) >= 13
+
+
+def test_failures_other_than_429_do_not_recover():
+    scheduler = _scheduler(max_retries=0)
+    with pytest.raises(_Throttled):
+        scheduler.call(_raise, _Throttled())
+    for _ in range(10):
+        with pytest.raises(ValueError):
+            scheduler.call(_raise, ValueError())
+    assert scheduler.rate == 5
+
+
+def test_limits_are_restored_after_a_quiet_period():
+    scheduler = _scheduler(max_retries=0, recovery_seconds=0.2)
+    with pytest.raises(_Throttled):
+        scheduler.call(_raise, _Throttled())
+    assert scheduler.rate == 5
+    time.sleep(0.25)
+    scheduler.call(lambda: None)
+    assert scheduler.rate == 10
+    assert scheduler.concurrency == 16
+
+
+def test_call_async_retries_the_throttled_call():
+    scheduler = _scheduler()
+    calls = []
+
+    async def throttled_once():
+        calls.append(1)
+        if len(calls) == 1:
+            raise _Throttled()
+        return 'ok'
+
+    assert asyncio.run(scheduler.call_async(throttled_once)) == 'ok'
+    assert len(calls) == 2
+    assert scheduler.throttled == 1
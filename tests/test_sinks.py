@@ -0,0 +1,14 @@
+from spotifysinks import SinkSpec, raw_blob_stem
+
+
+def test_raw_blob_stem():
+    assert raw_blob_stem('market=US/spotify_raw_plA_20240101120000.ndjson.zst') == 'plA_20240101120000'
+    assert raw_blob_stem('spotify_raw_20240101120000.json') == '20240101120000'
+
+
+def test_outputs_of_raw_blobs_from_the_same_second_do_not_collide():
+    sink = SinkSpec('song', 'csv')
+    first = sink.blob_name('spotify_raw_plA_20240101120000.json.gz', '20240101120000')
+    second = sink.blob_name('spotify_raw_plB_20240101120000.json.gz', '20240101120000')
+    assert first == 'transformed_data/song_data/song_transformed_plA_20240101120000.csv'
+    assert first != second
@@ -0,0 +1,91 @@
+import time
+import random
+import threading
+
+import pytest
+
+from spotifyupload import StagedBlockUpload, block_id
+
+
+class _BlockBlob:
+    """Block blob client that stages blocks with random delays and can fail one of them"""
+
+    def __init__(self, fail_block=None):
+        self.blob_name = 'to_be_processed/spotify_raw_pl_20240101120000.json.gz'
+        self.fail_block = fail_block
+        self.staged = {}
+        self.committed = None
+        self.uploaded = None
+        self._lock = threading.Lock()
+
+    def stage_block(self, block_id, data, length=None):
+        time.sleep(random.uniform(0, 0.02))
+        if block_id == self.fail_block:
+            raise IOError('stage failed')
+        with self._lock:
+            self.staged[block_id] = data
+
+    def commit_block_list(self, block_ids, content_settings=None):
+        self.committed = [self.staged[block_id] for block_id in block_ids]
+
+    def upload_blob(self, data, content_settings=None, overwrite=False):
+        self.uploaded = data
+
+
+def test_small_payload_is_a_single_upload():
+    blob = _BlockBlob()
+    upload = StagedBlockUpload(blob, block_size=1024)
+    upload.write(b'{"items":[]}')
+    assert upload.commit() == 12
+    assert blob.uploaded == b'{"items":[]}'
+    assert blob.staged == {} and blob.committed is None
+
+
+def test_blocks_are_committed_in_write_order():
+    blob = _BlockBlob()
+    data = bytes(range(256)) * 40
+    upload = StagedBlockUpload(blob, block_size=100, max_concurrency=4)
+    for start in range(0, len(data), 37):
+        upload.write(data[start:start + 37])
+    assert upload.commit() == len(data)
+    assert len(blob.committed) == 103
+    assert b''.join(blob.committed) == data
+    assert blob.uploaded is None
+
+
+def test_failed_block_surfaces_on_commit_without_committing():
+    blob = _BlockBlob(fail_block=block_id(1))
+    upload = StagedBlockUpload(blob, block_size=10, max_concurrency=2)
+    upload.write(b'x' * 25)
+    with pytest.raises(IOError):
+        upload.commit()
+    assert blob.committed is None
+
+
+def test_failed_block_surfaces_on_a_later_write():
+    blob = _BlockBlob(fail_block=block_id(0))
+    upload = StagedBlockUpload(blob, block_size=10, max_concurrency=1)
+    upload.write(b'x' * 10)
+    # With one block in flight the next block waits for the failed one first
+    upload.write(b'x' * 10)
+    with pytest.raises(IOError):
+        upload.write(b'x' * 10)
+    upload.abort()
+    assert blob.committed is None
+
+
+def test_abort_never_commits():
+    blob = _BlockBlob(fail_block=block_id(2))
+    upload = StagedBlockUpload(blob, block_size=10)
+    upload.write(b'x' * 45)
+    upload.abort()
+    assert blob.committed is None
+    assert blob.uploaded is None
+
+
+def test_abort_of_a_small_payload_uploads_nothing():
+    blob = _BlockBlob()
+    upload = StagedBlockUpload(blob, block_size=1024)
+    upload.write(b'{"items":[]}')
+    upload.abort()
+    assert blob.uploaded is None